@@ -0,0 +1,87 @@
+"""
+Measure the import time of every lambda handler with python -X importtime and check it against a budget.
+
+Run it from the repository root: python benchmarks/import_time.py [--budget-ms 50]
+It exits with status 1 whenever a handler exceeds the budget or eagerly imports a heavy dependency.
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+ROOT_PATH = os.path.abspath(os.path.join(__file__, os.pardir, os.pardir))
+
+HANDLER_MODULES = [
+    "src.b3_history.app",
+    "src.data_warehouse.app",
+    "src.data_visualization.yahoo_finance",
+    "src.data_visualization.plot_generator",
+    "src.data_visualization.reconciliation",
+    "src.orchestrator.app",
+]
+HEAVY_DEPENDENCIES = ["pandas", "numpy", "sqlalchemy", "psycopg2", "yfinance", "matplotlib"]
+DEFAULT_BUDGET_MS = 50
+
+
+def measure_import(module_name: str) -> tuple:
+    """
+    Import given module in a fresh interpreter.
+
+    Return the cumulative time (in us) of every top-level import, and the names of all imported packages.
+    """
+    completed_process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module_name}"],
+        cwd=ROOT_PATH,
+        capture_output=True,
+        text=True,
+        check=True
+    )
+
+    # Lines look like "import time:       self [us] |  cumulative | imported package"
+    cumulative_times = {}
+    imported_packages = []
+    for line in completed_process.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+
+        _, cumulative, imported_package = line[len("import time:"):].split("|")
+        package_name = imported_package.rstrip()
+        imported_packages.append(package_name.strip())
+        if package_name.startswith(" " * 3):
+            continue  # nested import, already accounted for in its parent's cumulative time
+
+        cumulative_times[package_name.strip()] = int(cumulative)
+
+    return cumulative_times, imported_packages
+
+
+def main() -> int:
+    """Report handlers' import time and return a non-zero status if any of them is over budget."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS)
+    arguments = parser.parse_args()
+
+    status = 0
+    for module_name in HANDLER_MODULES:
+        cumulative_times, imported_packages = measure_import(module_name=module_name)
+        total_ms = sum(cumulative_times.values()) / 1000
+        heavy_imports = sorted({
+            package_name.split(".")[0]
+            for package_name in imported_packages
+            if package_name.split(".")[0] in HEAVY_DEPENDENCIES
+        })
+
+        verdict = "ok"
+        if total_ms > arguments.budget_ms or heavy_imports:
+            verdict = "OVER BUDGET"
+            status = 1
+
+        print(f"{module_name:<40} {total_ms:8.1f} ms  {verdict}")
+        if heavy_imports:
+            print(f"    eagerly imports: {', '.join(heavy_imports)}")
+
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
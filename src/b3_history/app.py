@@ -1,11 +1,14 @@
 """File for orchestrating the ETL process of B3 stock history."""
-from psycopg2.errors import InsufficientPrivilege
-
+from src.b3_history.modules.extraction_engine import RESOURCES_PATH, ROOT_PATH
+from src.b3_history.modules.load_sinks import build_sink
 from src.b3_history.modules.main_engine import DataLakeMainEngine
+from src.shared.lazy_import import lazy_import
+
+errors = lazy_import("psycopg2.errors")
 
 
-def lambda_handler(event: any) -> None:
-    """Orchestrate the workflow."""
+def lambda_handler(event: any) -> bool:
+    """Orchestrate the workflow, returning whether it ran to completion."""
     # Instance main engine
     engine = DataLakeMainEngine()
 
@@ -16,23 +19,49 @@ def lambda_handler(event: any) -> None:
     if event.get('schema'):
         engine.schema = event['schema']
 
+    # Decompress each file once and parse its fixed width lines by byte range, optionally in parallel
+    if event.get('raw_file_mode'):
+        engine.raw_file_mode = True
+        engine.workers = int(event.get('workers', 1))
+
+    # Prices can be kept as the exact integer cents B3 quotes them in, every reader converts them back to reais
+    if event.get('price_cents'):
+        engine.price_cents = True
+
+    # Full backfills can skip the write-ahead log, staging each file in unlogged tables until it is complete
+    if event.get('bulk_mode'):
+        engine.bulk_mode = True
+
+    # Batches expected to exceed the memory budget, in megabytes, are spilled to local files and uploaded in chunks
+    if event.get('memory_budget_mb'):
+        engine.memory_budget_mb = event['memory_budget_mb']
+
+    # Postgres by default, or local files, SQLite, memory or null sinks for running without a database
+    if event.get('sink'):
+        engine.sink = build_sink(
+            sink_name=event['sink'],
+            schema=engine.schema,
+            path=event.get('sink_path', ROOT_PATH + RESOURCES_PATH + 'sink/'),
+            file_format=event.get('file_format', 'npy')
+        )
+
     # Schema setup
     try:
-        engine.postgres.create_schema_database()
+        engine.sink.create_schema()
 
-    except InsufficientPrivilege:
-        engine.postgres.close_connections()
+    except errors.InsufficientPrivilege:
+        engine.sink.close()
         print("Insufficient privileges to execute create schema statement.\n"
               "Please, configure a database user with CREATE permission.\n"
               "Unable to continue works, stopping...")
-        return
+        return False
 
     # Loop through list of files
     for file in event.get('files_to_run'):
 
-        # Set properties accordingly
+        # Set properties accordingly and check the file against its previous ingestion
         engine.file_name = file
-        engine.total_lines = engine.get_file_total_lines()
+        engine.prepare_file()
 
         # After completion of a certain file, the next iteration should reset has_more parameter
         engine.has_more = True
@@ -41,7 +70,7 @@ def lambda_handler(event: any) -> None:
         while engine.has_more:
 
             # Get metadata for extraction
-            engine.get_last_line_read_from_postgres()
+            engine.get_last_line_read()
 
             # Check if file has already been read (remember that python considers first line as zero)
             if (engine.last_line_read + 1) == engine.total_lines:
@@ -51,8 +80,15 @@ def lambda_handler(event: any) -> None:
             # Execute extract, transform, and load processes
             engine.run_etl()
 
-    engine.create_update_view()
+        # Staged rows and checkpoints of a complete file are moved into its tables at once
+        engine.publish_file()
+
+    # Stocks history view can be left to a later invocation, e.g. when files are loaded by concurrent invocations
+    if event.get('refresh_view', True):
+        engine.finish_load()
+    engine.sink.close()
     print("All done!")
+    return True
 
 
 if __name__ == "__main__":
@@ -1,8 +1,19 @@
+from __future__ import annotations
+
+import hashlib
+import mmap
 import os
+import re
+import shutil
 import zipfile
+from calendar import monthrange
+from datetime import date
 from io import TextIOWrapper
 
-import pandas as pd
+from src.shared.lazy_import import lazy_import
+
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
 
 ROOT_PATH = os.path.abspath(  # return the absolute path of the following
     os.path.join(  # concatenate the directory of the following
@@ -12,6 +23,14 @@ ROOT_PATH = os.path.abspath(  # return the absolute path of the following
     )
 )
 RESOURCES_PATH = '/resources/'
+RAW_FILES_PATH = '/resources/raw/'
+
+# B3 publishes annual (COTAHIST_A2022), monthly (COTAHIST_M012023) and daily (COTAHIST_D02012023) files
+FILE_NAME_PATTERN = re.compile(
+    r"^COTAHIST_(?:A(?P<year>\d{4})|M(?P<month>\d{2})(?P<month_year>\d{4})"
+    r"|D(?P<day>\d{2})(?P<day_month>\d{2})(?P<day_year>\d{4}))\.zip$",
+    flags=re.IGNORECASE
+)
 
 
 class ExtractionEngine:
@@ -21,7 +40,22 @@ class ExtractionEngine:
         """Initialize the constructor."""
         # File handling properties
         self._file_name = None
+        self._file_period = None
         self._file_total_lines = 0
+        self.file_last_session = None
+
+        # Raw file properties: zipped file is decompressed once, and its fixed width lines are reached by offset
+        self.raw_file_mode = False
+        self.workers = 1
+        self.raw_file_path = None
+        self.record_length = 0
+
+        # Fingerprint properties, used to detect whether a re-published file kept its already ingested prefix
+        self.fingerprint_block_size = 1000  # number of quotation records per block
+        self.file_total_records = 0
+        self.file_fingerprints = []
+        self.partial_block_hashes = {}
+        self.prefix_last_session = None
 
         # Extraction properties
         self._batch_size = 1000
@@ -67,10 +101,35 @@ class ExtractionEngine:
         if not isinstance(new_file_name, str):
             raise TypeError("Invalid file_name. Please, check your event list")
 
-        if ".zip" not in new_file_name:
+        if ".zip" not in new_file_name.lower():
             raise ValueError(f"Expected extension .zip, got {new_file_name[-4:]} instead.")
 
+        self._file_period = self._parse_file_period(file_name=new_file_name)
         self._file_name = new_file_name
+        self.file_last_session = None
+        self.raw_file_path = None
+        self.record_length = 0
+        self.file_total_records = 0
+        self.file_fingerprints = []
+        self.partial_block_hashes = {}
+        self.prefix_last_session = None
+
+    @property
+    def file_period(self) -> tuple:
+        """Access the first and last dates covered by current file."""
+        return self._file_period
+
+    @property
+    def table_name(self) -> str:
+        """Name of the yearly table that stores current file's records."""
+        first_date, _ = self.file_period
+        return f"cotahist_a{first_date.year}"
+
+    @property
+    def options_table_name(self) -> str:
+        """Name of the yearly table that stores current file's option records."""
+        first_date, _ = self.file_period
+        return f"options_a{first_date.year}"
 
     @property
     def total_lines(self) -> int:
@@ -149,14 +208,58 @@ class ExtractionEngine:
 
         self._last_line_read = value
 
-    def get_file_total_lines(self):
-        """Quickly read file and get its total number of lines."""
-        # Open compressed file
-        with self._open_zipped_file(file_name=self.file_name) as file:
+    def get_file_total_lines(self, partial_blocks: dict = None, prefix_records: int = 0):
+        """
+        Quickly read file and get its total number of lines, its last trading session and its fingerprints.
+
+        Quotation records are hashed in blocks of fingerprint_block_size records. Header and trailer are left out,
+        since B3 rewrites them whenever the file is re-published. For every block index in partial_blocks,
+        the hash of its first records (as many as the dict value) is kept too, so that a block that was
+        incomplete in a previous version of the file can still be compared against the current one.
+        """
+        partial_blocks = partial_blocks or {}
+        fingerprints = []
+        partial_block_hashes = {}
+        last_session = prefix_last_session = ""
+        block_hash = self._new_block_hash()
+        record_index = -1
+
+        # Open compressed file, or its raw copy
+        with self._open_source_file() as file:
 
             # Iterate over lines
-            for i, _ in enumerate(file):
-                pass
+            for i, line_text in enumerate(file):
+
+                # Only quotation records (type 01) carry a trading session date
+                if not line_text.startswith("01"):
+                    continue
+
+                record_index += 1
+                block_index, block_position = divmod(record_index, self.fingerprint_block_size)
+                if record_index and not block_position:
+                    fingerprints.append(
+                        self._build_fingerprint(block_index - 1, self.fingerprint_block_size, block_hash)
+                    )
+                    block_hash = self._new_block_hash()
+
+                block_hash.update(line_text.encode())
+                last_session = max(last_session, line_text[self.columns_separator['data_pregao']])
+
+                if partial_blocks.get(block_index) == block_position + 1:
+                    partial_block_hashes[block_index] = block_hash.hexdigest()
+
+                if record_index + 1 == prefix_records:
+                    prefix_last_session = last_session
+
+        if record_index >= 0:
+            block_index, block_position = divmod(record_index, self.fingerprint_block_size)
+            fingerprints.append(self._build_fingerprint(block_index, block_position + 1, block_hash))
+
+        self.file_total_records = record_index + 1
+        self.file_fingerprints = fingerprints
+        self.partial_block_hashes = partial_block_hashes
+        self.file_last_session = self._parse_session(session=last_session)
+        self.prefix_last_session = self._parse_session(session=prefix_last_session)
 
         # Save into class property
         print(f"\nFile {self.file_name} total lines: {i}")
@@ -208,45 +311,164 @@ class ExtractionEngine:
             self.has_more = False
             return dataframe
 
+    def prepare_raw_file(self) -> None:
+        """
+        Decompress current file once into a local raw file, and measure the length of its lines.
+
+        COTAHIST lines are fixed width (245 characters plus line ending), hence line N starts at byte
+        N * record_length of the raw file, and any range of lines can be read without going through the previous ones.
+        """
+        zipped_file = ROOT_PATH + RESOURCES_PATH + self.file_name
+        raw_file = ROOT_PATH + RAW_FILES_PATH + os.path.splitext(self.file_name)[0] + ".txt"
+
+        if not os.path.exists(raw_file) or os.path.getmtime(raw_file) < os.path.getmtime(zipped_file):
+            print(f"Decompressing {self.file_name} into raw file... ", end='')
+            os.makedirs(ROOT_PATH + RAW_FILES_PATH, exist_ok=True)
+            with zipfile.ZipFile(zipped_file, 'r') as my_zip:
+                with my_zip.open(my_zip.namelist()[0]) as source, open(raw_file + ".tmp", 'wb') as target:
+                    shutil.copyfileobj(source, target)
+
+            # Every line, including the last one, must end with a line break to keep the width fixed
+            if os.path.getsize(raw_file + ".tmp") and not self._read_file_tail(path=raw_file + ".tmp").endswith(b"\n"):
+                line_ending = b"\r\n" if b"\r\n" in self._read_file_head(path=raw_file + ".tmp") else b"\n"
+                with open(raw_file + ".tmp", 'ab') as target:
+                    target.write(line_ending)
+
+            os.replace(raw_file + ".tmp", raw_file)
+            print("Done!")
+
+        first_line = self._read_file_head(path=raw_file)
+        record_length = first_line.find(b"\n") + 1
+        if record_length <= 0 or os.path.getsize(raw_file) % record_length:
+            raise ValueError(f"File {self.file_name} does not have fixed width lines.")
+
+        self.raw_file_path = raw_file
+        self.record_length = record_length
+
+    def get_batch_line_range(self) -> tuple:
+        """
+        Get first and last lines of the next batch, following the same boundaries as sequential reading.
+
+        Batches end at multiples of batch_size, or at the last line of file.
+        """
+        first_line = self.last_line_read + 1
+        last_line = min((self.last_line_read // self.batch_size + 1) * self.batch_size, self.total_lines - 1)
+        return first_line, last_line
+
+    def read_raw_records(self, raw_file_path: str, record_length: int, first_line: int, last_line: int):
+        """
+        Read lines first_line to last_line (inclusive) of a raw file into a dataframe, with vectorized slicing.
+
+        Lines are memory-mapped and viewed as a matrix of bytes, from which every column is cut at once.
+        Bytes are decoded as latin-1, which maps each byte into exactly one character.
+        """
+        number_of_lines = last_line - first_line + 1
+        if number_of_lines <= 0:
+            return pd.DataFrame(columns=list(self.columns_separator))
+
+        with open(raw_file_path, 'rb') as file:
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as memory_map:
+                records = np.frombuffer(
+                    memory_map,
+                    dtype=np.uint8,
+                    count=number_of_lines * record_length,
+                    offset=first_line * record_length
+                ).reshape(number_of_lines, record_length)
+
+                dataframe = pd.DataFrame({
+                    column_name: np.char.decode(
+                        np.ascontiguousarray(records[:, column_slice]).view(
+                            f"S{column_slice.stop - column_slice.start}"
+                        ).ravel(),
+                        'latin-1'
+                    )
+                    for column_name, column_slice in self.columns_separator.items()
+                })
+                del records  # release the buffer before closing the memory map
+
+        # Keep the same dtype sequential reading produces
+        return dataframe.astype(object)
+
     def _slice_columns(self, text) -> dict:
         """Slice text data and split its content appropriately."""
         return {
-            'tipo_de_registro': text[self.columns_separator['tipo_de_registro']],
-            'data_pregao': text[self.columns_separator['data_pregao']],
-            'codigo_bdi': text[self.columns_separator['codigo_bdi']],
-            'codigo_negociaco_papel': text[self.columns_separator['codigo_negociaco_papel']],
-            'tipo_de_mercado': text[self.columns_separator['tipo_de_mercado']],
-            'nome_resumido': text[self.columns_separator['nome_resumido']],
-            'especificacao_papel': text[self.columns_separator['especificacao_papel']],
-            'prazo_dias_mercado_termo': text[self.columns_separator['prazo_dias_mercado_termo']],
-            'moeda_referencia': text[self.columns_separator['moeda_referencia']],
-            'preco_abertura_pregao': text[self.columns_separator['preco_abertura_pregao']],
-            'preco_maximo_pregao': text[self.columns_separator['preco_maximo_pregao']],
-            'preco_minimo_pregao': text[self.columns_separator['preco_minimo_pregao']],
-            'preco_medio_pregao': text[self.columns_separator['preco_medio_pregao']],
-            'preco_ultimo_negocio': text[self.columns_separator['preco_ultimo_negocio']],
-            'preco_melhor_oferta_compra': text[self.columns_separator['preco_melhor_oferta_compra']],
-            'preco_melhor_oferta_venda': text[self.columns_separator['preco_melhor_oferta_venda']],
-            'numero_negocios_efetuados': text[self.columns_separator['numero_negocios_efetuados']],
-            'quantidade_total_titulos_negociados': text[
-                self.columns_separator['quantidade_total_titulos_negociados']
-            ],
-            'preco_exercicio_opcoes': text[self.columns_separator['preco_exercicio_opcoes']],
-            'indicador_correcao_precos': text[self.columns_separator['indicador_correcao_precos']],
-            'data_vencimento_opcoes': text[self.columns_separator['data_vencimento_opcoes']],
-            'fator_cotacao_papel': text[self.columns_separator['fator_cotacao_papel']],
-            'preco_exercicio_pontos_opcoes': text[self.columns_separator['preco_exercicio_pontos_opcoes']],
-            'codigo_papel_isin': text[self.columns_separator['codigo_papel_isin']],
-            'numero_distribuicao_papel': text[self.columns_separator['numero_distribuicao_papel']]
+            column_name: text[column_slice]
+            for column_name, column_slice in self.columns_separator.items()
+        }
+
+    @staticmethod
+    def _new_block_hash():
+        """Create an empty hash object for a block of records."""
+        return hashlib.blake2b(digest_size=16)
+
+    @staticmethod
+    def _build_fingerprint(block_index: int, record_count: int, block_hash) -> dict:
+        """Describe a block of records by its index, number of records and hash."""
+        return {
+            "block_index": block_index,
+            "record_count": record_count,
+            "block_hash": block_hash.hexdigest()
         }
 
+    @staticmethod
+    def _parse_session(session: str):
+        """Convert a YYYYMMDD string into date, keeping empty strings as None."""
+        if not session:
+            return None
+        return date(year=int(session[0:4]), month=int(session[4:6]), day=int(session[6:8]))
+
+    @staticmethod
+    def _parse_file_period(file_name: str) -> tuple:
+        """Get the first and last calendar dates covered by an annual, monthly or daily file."""
+        match = FILE_NAME_PATTERN.match(os.path.basename(file_name))
+        if not match:
+            raise ValueError(f"Unrecognized file name {file_name}. Expected COTAHIST_AYYYY, "
+                             "COTAHIST_MMMYYYY or COTAHIST_DDDMMYYYY.")
+
+        if match['year']:
+            year = int(match['year'])
+            return date(year, 1, 1), date(year, 12, 31)
+
+        if match['month']:
+            year, month = int(match['month_year']), int(match['month'])
+            _, last_day = monthrange(year, month)
+            return date(year, month, 1), date(year, month, last_day)
+
+        session = date(int(match['day_year']), int(match['day_month']), int(match['day']))
+        return session, session
+
+    def _open_source_file(self):
+        """
+        Open the raw copy of current file if it has been prepared, or the zipped file otherwise.
+
+        B3 files are latin-1, which is also how raw mode decodes records, whatever the host's locale.
+        """
+        if self.raw_file_mode and self.raw_file_path:
+            return open(self.raw_file_path, 'r', encoding='latin-1')
+
+        return self._open_zipped_file(file_name=self.file_name)
+
+    @staticmethod
+    def _read_file_head(path: str, size: int = 1024) -> bytes:
+        """Read the first bytes of a file."""
+        with open(path, 'rb') as file:
+            return file.read(size)
+
+    @staticmethod
+    def _read_file_tail(path: str, size: int = 2) -> bytes:
+        """Read the last bytes of a file."""
+        with open(path, 'rb') as file:
+            file.seek(max(os.path.getsize(path) - size, 0))
+            return file.read()
+
     @staticmethod
     def _open_zipped_file(file_name: str):
-        """Open zipped file and read it in non-binary mode."""
+        """Open zipped file and read it in non-binary mode, decoding it as latin-1."""
         zipped_file = ROOT_PATH + RESOURCES_PATH + file_name
         with zipfile.ZipFile(zipped_file, 'r') as my_zip:
             return TextIOWrapper(
                 my_zip.open(
                     my_zip.namelist()[0]
-                )
+                ),
+                encoding='latin-1'
             )
@@ -0,0 +1,981 @@
+"""File containing the destinations that B3 history can be loaded into."""
+from __future__ import annotations
+
+import json
+import os
+import re
+import shutil
+
+from src.b3_history.modules.transformation_engine import OPTION_COLUMNS
+from src.shared.column_definitions import CENTS_PRICE_COLUMNS, OPTION_MARKET_TYPES, PRICE_CENTS_TYPE
+from src.shared.lazy_import import lazy_import
+from src.shared.loading_engine import PostgresConnector
+
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+errors = lazy_import("psycopg2.errors")
+sqlite3 = lazy_import("sqlite3")
+
+YEARLY_TABLE_PATTERN = re.compile(r"^cotahist_a\d{4}$")
+OPTIONS_TABLE_PATTERN = re.compile(r"^options_a\d{4}$")
+
+# Tables holding extraction bookkeeping, as opposed to the yearly tables holding B3 history itself
+BOOKKEEPING_TABLES = ["extraction_progress", "extraction_fingerprint"]
+FINGERPRINT_COLUMNS = ['block_index', 'record_count', 'block_hash', 'is_final_block']
+
+# Bulk loads write into unlogged tables named after their targets, published once each file is complete
+STAGING_PREFIX = "staging_"
+
+# Parallel workers per index build, once bulk loaded tables are indexed
+BULK_MAINTENANCE_WORKERS = 4
+
+# Types of the numeric and boolean columns written by the file sink
+COLUMN_KIND_DTYPES = {
+    "integer": "int64",
+    "float": "float64",
+    "boolean": "bool",
+}
+
+
+class LoadSink:
+    """
+    Base class of the destinations of B3 history.
+
+    Besides the yearly tables, a sink stores extraction checkpoints and file fingerprints,
+    which let interrupted and re-published files be resumed.
+    """
+
+    def __init__(self, schema: str) -> None:
+        """Initialize the constructor."""
+        self.schema = schema
+
+        # Only postgres stages bulk loads, other sinks have no write-ahead log to skip
+        self.bulk_mode = False
+
+    def create_schema(self) -> None:
+        """Prepare the destination before anything is loaded into it."""
+
+    def upload_data(self, dataframe: pd.DataFrame, table_name: str) -> None:
+        """Append dataframe rows to given table, creating it when needed."""
+        raise NotImplementedError
+
+    def add_missing_columns(self, table_name: str, columns: list) -> None:
+        """Add to given table any of the columns it lacks. Tables written by this sink always hold every column."""
+
+    def validate_price_unit(self, price_cents: bool) -> None:
+        """Make sure yearly tables already hold prices in the unit being loaded. Sinks only check what they can."""
+
+    def get_last_line_read(self, file_name: str) -> int:
+        """Get the last line of given file already loaded, or zero if it was never read."""
+        raise NotImplementedError
+
+    def get_fingerprints(self, file_name: str) -> list:
+        """Get the fingerprints stored for given file, ordered by block."""
+        raise NotImplementedError
+
+    def delete_fingerprint_blocks(self, file_name: str, first_block: int) -> None:
+        """Delete given file's fingerprints starting from given block."""
+        raise NotImplementedError
+
+    def delete_extraction_progress(self, file_name: str, after_line: int) -> None:
+        """Delete given file's checkpoints beyond given line."""
+        raise NotImplementedError
+
+    def delete_sessions(self, table_name: str, first_session, last_session) -> None:
+        """Delete rows of given table whose sessions are within given dates."""
+        raise NotImplementedError
+
+    def discard_leftover_staging(self, file_name: str, table_names: list) -> None:
+        """Discard whatever an aborted load left staged for given tables. Sinks load straight into them by default."""
+
+    def publish_file(self, file_name: str, table_names: list) -> None:
+        """Make whatever was staged for given file visible in its tables. Sinks load straight into them by default."""
+
+    def finish_load(self, columns: list, option_columns: list) -> None:
+        """Build whatever is derived from the yearly tables, once every file has been loaded."""
+
+    def close(self) -> None:
+        """Release any connection or file held by the sink."""
+
+
+class PostgresSink(LoadSink):
+    """Sink loading B3 history into a postgres schema, read by the Data Warehouse."""
+
+    def __init__(self, schema: str) -> None:
+        """Initialize the constructor."""
+        # It is the only sink that needs database credentials
+        self.postgres = PostgresConnector(schema=schema)
+        super().__init__(schema=schema)
+
+    @property
+    def schema(self) -> str:
+        """Access attribute value."""
+        return self.postgres.schema
+
+    @schema.setter
+    def schema(self, schema_name: str) -> None:
+        """Define property setter, keeping connector's schema in sync."""
+        self.postgres.schema = schema_name
+
+    def create_schema(self) -> None:
+        """
+        Execute schema creation statement, along with bookkeeping tables.
+
+        Bookkeeping tables are created up front rather than by the first upload, since files loaded
+        concurrently by separate processes would race to create them.
+        """
+        self.postgres.create_schema_database()
+        self.postgres.execute_statement(statement=f"""
+            CREATE TABLE IF NOT EXISTS {self.schema}.extraction_progress (
+                file_name TEXT,
+                last_line_read BIGINT
+            );
+            CREATE TABLE IF NOT EXISTS {self.schema}.extraction_fingerprint (
+                file_name TEXT,
+                block_index BIGINT,
+                record_count BIGINT,
+                block_hash TEXT,
+                is_final_block BOOLEAN
+            );
+        """)
+
+        # Checkpoints of staged rows are staged along with them, since a crash empties every unlogged table
+        if self.bulk_mode:
+            self.postgres.execute_statement(statement="\n".join(
+                f"CREATE UNLOGGED TABLE IF NOT EXISTS {self.schema}.{STAGING_PREFIX}{table_name} "
+                f"(LIKE {self.schema}.{table_name});"
+                for table_name in BOOKKEEPING_TABLES
+            ))
+
+    def upload_data(self, dataframe: pd.DataFrame, table_name: str) -> None:
+        """Use postgres connector to append dataframe to table, or to its staging table in bulk mode."""
+        if not self.bulk_mode:
+            self.postgres.upload_data(dataframe=dataframe, table_name=table_name)
+
+        elif table_name in BOOKKEEPING_TABLES:
+            self.postgres.upload_data(dataframe=dataframe, table_name=STAGING_PREFIX + table_name)
+
+        elif YEARLY_TABLE_PATTERN.match(table_name) or OPTIONS_TABLE_PATTERN.match(table_name):
+            self._stage_data(dataframe=dataframe, table_name=table_name)
+
+        else:
+            self.postgres.upload_data(dataframe=dataframe, table_name=table_name)
+
+    def _stage_data(self, dataframe: pd.DataFrame, table_name: str) -> None:
+        """
+        Copy dataframe into the unlogged staging table of given yearly table, creating both when needed.
+
+        A missing yearly table is created empty first, with pandas' column types, so that staging tables
+        are always created unlogged with their target's columns, and never rewritten to change their persistence.
+        """
+        staging_table = STAGING_PREFIX + table_name
+        if not self.postgres.check_table_existence(table_name=staging_table)[staging_table]:
+            if not self.postgres.check_table_existence(table_name=table_name)[table_name]:
+                self.postgres.create_table(dataframe=dataframe.head(1), table_name=table_name)
+
+            self.postgres.execute_statement(
+                statement=f"CREATE UNLOGGED TABLE {self.schema}.{staging_table} (LIKE {self.schema}.{table_name})"
+            )
+
+        self.postgres.copy_data(dataframe=dataframe, table_name=staging_table)
+
+    def add_missing_columns(self, table_name: str, columns: list) -> None:
+        """
+        Add to given yearly table any column it lacks, and parse the cents columns it still keeps as text.
+
+        Tables loaded by older versions of this project lack volume_total_titulos_negociados, which
+        used to be left out of sequential extraction, or keep it as raw text cents. Columns quoted in cents
+        take the unit of the table's prices, and any other missing column is kept as text, like every raw column.
+        """
+        column_types = self.postgres.get_column_types(table_name=table_name)
+        if not column_types:
+            return
+
+        missing_columns = [column for column in columns if column not in column_types]
+        price_type = column_types.get("preco_ultimo_negocio") or "text"
+        for column in missing_columns:
+            column_type = price_type if column in CENTS_PRICE_COLUMNS else "TEXT"
+            self.postgres.execute_statement(
+                statement=f"ALTER TABLE {self.schema}.{table_name} ADD COLUMN IF NOT EXISTS {column} {column_type}"
+            )
+
+        # Stocks history view depends on the parsed columns, and is rebuilt once every file has been loaded
+        text_columns = [column for column in CENTS_PRICE_COLUMNS if column_types.get(column) == "text"]
+        if text_columns and price_type != "text":
+            cents_divisor = "" if price_type == PRICE_CENTS_TYPE else "::double precision / 100"
+            self.postgres.execute_statement(statement=f"""
+                DROP MATERIALIZED VIEW IF EXISTS {self.schema}.stocks_history;
+
+                ALTER TABLE {self.schema}.{table_name}
+                {", ".join(
+                    f"ALTER COLUMN {column} TYPE {price_type} USING {column}::bigint{cents_divisor}"
+                    for column in text_columns
+                )};
+            """)
+
+    def validate_price_unit(self, price_cents: bool) -> None:
+        """
+        Make sure every yearly table stores prices in the unit being loaded, either integer cents or floats.
+
+        Stocks and options history views concatenate every yearly table, so a schema must not mix both units.
+        """
+        expected_type = PRICE_CENTS_TYPE if price_cents else "double precision"
+        for table_name in self.postgres.list_tables():
+            if not (YEARLY_TABLE_PATTERN.match(table_name) or OPTIONS_TABLE_PATTERN.match(table_name)):
+                continue
+
+            price_type = self.postgres.get_column_types(table_name=table_name).get("preco_ultimo_negocio")
+            if price_type and price_type != expected_type:
+                raise ValueError(
+                    f"Table {table_name} stores prices as {price_type}, expected {expected_type}. "
+                    f"Load prices {'as cents' if price_cents else 'as floats'} into another schema instead."
+                )
+
+    def get_last_line_read(self, file_name: str) -> int:
+        """Run a query to get file's last line read."""
+        # Although schema name is user input, it has already been validated against prohibited characters
+        query = f"""
+            SELECT *
+            FROM {self._get_bookkeeping_source(table_name="extraction_progress")}
+            WHERE file_name = %(file_name)s
+            ORDER BY last_line_read DESC
+            LIMIT 1;
+        """
+        try:
+            extraction_progress = self.postgres.read_sql_query(
+                query=query,
+                params={'file_name': file_name}
+            )
+        except errors.UndefinedTable:
+            # project's first run will create this table later on
+            return 0
+
+        if not len(extraction_progress):
+            # File will be read for the first time
+            return 0
+
+        return int(extraction_progress['last_line_read'].iloc[0])
+
+    def get_fingerprints(self, file_name: str) -> list:
+        """Run a query to get the fingerprints stored for given file, ordered by block."""
+        query = f"""
+            SELECT block_index, record_count, block_hash, is_final_block
+            FROM {self._get_bookkeeping_source(table_name="extraction_fingerprint")}
+            WHERE file_name = %(file_name)s
+            ORDER BY block_index
+        """
+        try:
+            fingerprints = self.postgres.read_sql_query(
+                query=query,
+                params={'file_name': file_name}
+            )
+        except errors.UndefinedTable:
+            # project's first run will create this table later on
+            return []
+
+        return fingerprints.to_dict(orient='records')
+
+    def delete_fingerprint_blocks(self, file_name: str, first_block: int) -> None:
+        """Delete given file's fingerprints starting from given block."""
+        for table_name in self._get_existing_tables(table_name="extraction_fingerprint"):
+            statement = f"""
+                DELETE FROM {self.schema}.{table_name}
+                WHERE file_name = %(file_name)s AND block_index >= %(first_block)s
+            """
+            self.postgres.execute_statement(
+                statement=statement,
+                params={"file_name": file_name, "first_block": first_block}
+            )
+
+    def delete_extraction_progress(self, file_name: str, after_line: int) -> None:
+        """Delete given file's checkpoints beyond given line."""
+        for table_name in self._get_existing_tables(table_name="extraction_progress"):
+            statement = f"""
+                DELETE FROM {self.schema}.{table_name}
+                WHERE file_name = %(file_name)s AND last_line_read > %(after_line)s
+            """
+            self.postgres.execute_statement(
+                statement=statement,
+                params={"file_name": file_name, "after_line": after_line}
+            )
+
+    def delete_sessions(self, table_name: str, first_session, last_session) -> None:
+        """Delete rows of given yearly table, and of its staging table in bulk mode, within given dates."""
+        # Table name is built from a validated file name, and schema name has already been validated
+        for existing_table in self._get_existing_tables(table_name=table_name):
+            statement = f"""
+                DELETE FROM {self.schema}.{existing_table}
+                WHERE data_pregao BETWEEN %(first_session)s AND %(last_session)s
+            """
+            self.postgres.execute_statement(
+                statement=statement,
+                params={"first_session": first_session, "last_session": last_session}
+            )
+
+    def discard_leftover_staging(self, file_name: str, table_names: list) -> None:
+        """
+        Drop staging tables left behind by an aborted bulk load, before anything of given file is staged.
+
+        Files of the same year are loaded one after the other, so unless given file resumes its own staging,
+        rows in its staging tables were left by an aborted file and would be published along with it.
+        Checkpoints staged with them are deleted as well, so that their file is read again from its published state.
+        """
+        if not self.bulk_mode:
+            return
+
+        staged_progress = self.postgres.read_sql_query(
+            query=f"SELECT count(*) AS checkpoints FROM {self.schema}.{STAGING_PREFIX}extraction_progress "
+                  f"WHERE file_name = %(file_name)s",
+            params={"file_name": file_name}
+        )
+        if staged_progress['checkpoints'][0]:
+            return
+
+        leftover_tables = [
+            STAGING_PREFIX + table_name for table_name in table_names
+            if self.postgres.check_table_existence(table_name=STAGING_PREFIX + table_name)[STAGING_PREFIX + table_name]
+        ]
+        if not leftover_tables:
+            return
+
+        # Table names end with the year shared by the daily, monthly and annual files loaded into them
+        years = sorted({table_name[-4:] for table_name in table_names})
+        statements = [f"DROP TABLE {self.schema}.{table_name};" for table_name in leftover_tables]
+        statements += [
+            f"DELETE FROM {self.schema}.{STAGING_PREFIX}{table_name} WHERE file_name ~* %(file_pattern)s;"
+            for table_name in BOOKKEEPING_TABLES
+        ]
+
+        print(f"Dropping {', '.join(leftover_tables)}, left behind by an aborted load... ", end="")
+        self.postgres.execute_statement(
+            statement="\n".join(statements),
+            params={"file_pattern": rf"^COTAHIST_(A|M\d{{2}}|D\d{{4}})({'|'.join(years)})\.zip$"}
+        )
+        print("Dropped!")
+
+    def publish_file(self, file_name: str, table_names: list) -> None:
+        """
+        Move what was staged for given file into its yearly tables, along with its checkpoints, in one transaction.
+
+        Each staging table is appended to its logged target in a single statement, which writes the published rows
+        to the write-ahead log once, while staging skipped it. Published tables are analyzed right away,
+        so that the first queries on them are planned with fresh statistics.
+        """
+        if not self.bulk_mode:
+            return
+
+        statements = []
+        published_tables = []
+        for table_name in table_names:
+            staging_table = STAGING_PREFIX + table_name
+            if not self.postgres.check_table_existence(table_name=staging_table)[staging_table]:
+                continue
+
+            columns = ", ".join(self.postgres.get_table_columns(table_name=staging_table))
+            statements += [
+                f"INSERT INTO {self.schema}.{table_name} ({columns}) "
+                f"SELECT {columns} FROM {self.schema}.{staging_table};",
+                f"DROP TABLE {self.schema}.{staging_table};",
+            ]
+            published_tables.append(table_name)
+
+        for table_name in BOOKKEEPING_TABLES:
+            statements += [
+                f"INSERT INTO {self.schema}.{table_name} "
+                f"SELECT * FROM {self.schema}.{STAGING_PREFIX}{table_name} WHERE file_name = %(file_name)s;",
+                f"DELETE FROM {self.schema}.{STAGING_PREFIX}{table_name} WHERE file_name = %(file_name)s;",
+            ]
+
+        print(f"Publishing staged tables of {file_name}... ", end="")
+        self.postgres.execute_statement(statement="\n".join(statements), params={"file_name": file_name})
+        if published_tables:
+            self.postgres.execute_statement(
+                statement=f"ANALYZE {', '.join(f'{self.schema}.{table_name}' for table_name in published_tables)}"
+            )
+        print("Published!")
+
+    def finish_load(self, columns: list, option_columns: list) -> None:
+        """Rebuild stocks and options history views and ticker lineage, then mark schema as loaded for readers."""
+        self.add_missing_yearly_columns(columns=columns)
+        self.split_legacy_options(option_columns=option_columns)
+        self.create_update_view(columns=columns)
+        self.create_update_options_view(columns=option_columns)
+        self.create_update_ticker_lineage()
+        if self.bulk_mode:
+            self.analyze_derived_relations()
+        self.postgres.record_load_watermark()
+
+    def add_missing_yearly_columns(self, columns: list) -> None:
+        """
+        Add missing columns to every yearly table, not only to the ones loaded in this run.
+
+        Views select every column by name from each yearly table, so a single table left behind would break them.
+        """
+        for table_name in self.postgres.list_tables(prefix="cotahist_a"):
+            if YEARLY_TABLE_PATTERN.match(table_name):
+                self.add_missing_columns(table_name=table_name, columns=columns)
+
+    def split_legacy_options(self, option_columns: list) -> None:
+        """
+        Move option records out of yearly tables loaded before options were kept apart, and drop option columns.
+
+        Each table is migrated in a single transaction, so an interrupted migration is simply run again.
+        Stocks history view depends on the dropped columns, and is rebuilt right after anyway.
+        Legacy tables may lack some of the option columns, e.g. volume, which are added to them beforehand.
+        """
+        market_types = ", ".join(f"'{market_type}'" for market_type in OPTION_MARKET_TYPES)
+        option_types = " ".join(
+            f"WHEN '{market_type}' THEN '{option_type}'" for market_type, option_type in OPTION_MARKET_TYPES.items()
+        )
+        derived_columns = {
+            "underlying": "left(codigo_negociaco_papel, 4)",
+            "option_type": f"CASE tipo_de_mercado {option_types} END",
+        }
+        selected_columns = ", ".join(
+            f"{derived_columns[column]} AS {column}" if column in derived_columns else column
+            for column in option_columns
+        )
+        for table_name in self.postgres.list_tables(prefix="cotahist_a"):
+            if not YEARLY_TABLE_PATTERN.match(table_name):
+                continue
+            if not set(OPTION_COLUMNS) <= set(self.postgres.get_table_columns(table_name=table_name)):
+                continue
+
+            self.add_missing_columns(
+                table_name=table_name,
+                columns=[column for column in option_columns if column not in derived_columns]
+            )
+
+            # Table names come from the catalog and are matched against the patterns above
+            print(f"Moving options out of {table_name}... ", end="")
+            options_table_name = table_name.replace("cotahist_a", "options_a")
+            selection = f"SELECT {selected_columns} FROM {self.schema}.{table_name}"
+            self.postgres.execute_statement(statement=f"""
+                DROP MATERIALIZED VIEW IF EXISTS {self.schema}.stocks_history;
+
+                CREATE TABLE IF NOT EXISTS {self.schema}.{options_table_name} AS {selection} WITH NO DATA;
+
+                INSERT INTO {self.schema}.{options_table_name} ({", ".join(option_columns)})
+                {selection}
+                WHERE tipo_de_mercado IN ({market_types});
+
+                DELETE FROM {self.schema}.{table_name} WHERE tipo_de_mercado IN ({market_types});
+
+                ALTER TABLE {self.schema}.{table_name}
+                {", ".join(f"DROP COLUMN {column}" for column in OPTION_COLUMNS)};
+            """)
+            print("Done!")
+
+    def create_update_view(self, columns: list) -> None:
+        """
+        Orchestrate the creation of the view that aggregates all tables uploaded.
+
+        Since there is no user input, we should be safe against SQL injection.
+        This view will concatenate every yearly table found in schema's catalog.
+        """
+        view_created = self._create_yearly_view(
+            view_name="stocks_history",
+            table_pattern=YEARLY_TABLE_PATTERN,
+            columns=columns
+        )
+        if not view_created:
+            return
+
+        # Data Warehouse reads a ticker's history by its code and session
+        self.postgres.execute_statement(
+            statement=f"{self._get_maintenance_settings()}"
+                      f"CREATE INDEX IF NOT EXISTS stocks_history_ticker_session_idx "
+                      f"ON {self.schema}.stocks_history (codigo_negociaco_papel, data_pregao)"
+        )
+
+        # Cross-sections read every ticker of a market within a few sessions, e.g. for screens and index rebuilds
+        self.postgres.execute_statement(
+            statement=f"{self._get_maintenance_settings()}"
+                      f"CREATE INDEX IF NOT EXISTS stocks_history_session_market_idx "
+                      f"ON {self.schema}.stocks_history (data_pregao, tipo_de_mercado)"
+        )
+        print("Created view successfully!")
+
+    def create_update_options_view(self, columns: list) -> None:
+        """Orchestrate the creation of the view that aggregates every yearly options table."""
+        view_created = self._create_yearly_view(
+            view_name="options_history",
+            table_pattern=OPTIONS_TABLE_PATTERN,
+            columns=columns
+        )
+        if not view_created:
+            return
+
+        # Option chains are read by underlying and session, then ordered by expiry and strike straight from the index
+        self.postgres.execute_statement(
+            statement=f"{self._get_maintenance_settings()}"
+                      f"CREATE INDEX IF NOT EXISTS options_history_chain_idx ON {self.schema}.options_history "
+                      f"(underlying, data_pregao, data_vencimento_opcoes, preco_exercicio_opcoes)"
+        )
+        print("Created options view successfully!")
+
+    def _create_yearly_view(self, view_name: str, table_pattern: re.Pattern, columns: list) -> bool:
+        """Rebuild a materialized view concatenating every yearly table matching pattern, if there is any."""
+        existent_tables = [
+            table_name
+            for table_name in self.postgres.list_tables()
+            if table_pattern.match(table_name)
+        ]
+
+        # It would be quite weird to arrive here with no table uploaded, but let's check it anyway
+        if not existent_tables:
+            return False
+
+        # build SQL statement by concatenating tables with UNION ALL
+        # The view is rebuilt so that sessions appended by daily and monthly files show up
+        # Columns are listed explicitly, since columns added to older tables sit at their end
+        selected_columns = ", ".join(columns)
+        statement_header = f"DROP MATERIALIZED VIEW IF EXISTS {self.schema}.{view_name};\n" \
+                           f"CREATE MATERIALIZED VIEW {self.schema}.{view_name} AS\n" \
+                           f"SELECT {selected_columns} FROM {self.schema}.{existent_tables.pop(0)}"
+
+        union_statement = f"\nUNION ALL\n SELECT {selected_columns} FROM {self.schema}."
+        remaining_statement = [
+            union_statement + table
+            for table in existent_tables
+        ]
+
+        complete_statement = statement_header + ''.join(remaining_statement)
+
+        # execute
+        self.postgres.execute_statement(statement=complete_statement)
+        return True
+
+    def create_update_ticker_lineage(self) -> None:
+        """
+        Build the table mapping each ISIN to every trading code it had, and the sessions each code was used.
+
+        It lets the Data Warehouse resolve a ticker's whole history (e.g. "PET 3" and PETR3) with an indexed lookup.
+        Since stocks history is rebuilt on every run, so is the lineage.
+        """
+        if not self.postgres.check_materialized_view_existence(view_name="stocks_history"):
+            return
+
+        statement = f"""
+            {self._get_maintenance_settings()}
+            DROP TABLE IF EXISTS {self.schema}.ticker_lineage;
+            CREATE TABLE {self.schema}.ticker_lineage AS
+            SELECT
+                sh.codigo_papel_isin,
+                sh.codigo_negociaco_papel,
+                sh.tipo_de_mercado,
+                min(sh.data_pregao) AS first_session,
+                max(sh.data_pregao) AS last_session
+            FROM {self.schema}.stocks_history sh
+            WHERE sh.codigo_papel_isin IS NOT NULL
+            GROUP BY sh.codigo_papel_isin, sh.codigo_negociaco_papel, sh.tipo_de_mercado;
+
+            CREATE INDEX ticker_lineage_isin_idx ON {self.schema}.ticker_lineage (codigo_papel_isin);
+            CREATE INDEX ticker_lineage_ticker_idx ON {self.schema}.ticker_lineage (codigo_negociaco_papel);
+        """
+        self.postgres.execute_statement(statement=statement)
+        print("Created ticker lineage successfully!")
+
+    def analyze_derived_relations(self) -> None:
+        """Gather statistics of the views and lineage rebuilt from bulk loaded tables, before anyone queries them."""
+        relations = [
+            relation_name
+            for relation_name in ["stocks_history", "options_history", "ticker_lineage"]
+            if relation_name in self.postgres.get_catalog()
+        ]
+        if relations:
+            self.postgres.execute_statement(
+                statement=f"ANALYZE {', '.join(f'{self.schema}.{relation_name}' for relation_name in relations)}"
+            )
+
+    def close(self) -> None:
+        """Close postgres connections."""
+        self.postgres.close_connections()
+
+    def _get_existing_tables(self, table_name: str) -> list:
+        """List given table and, in bulk mode, its staging table, among the ones that exist."""
+        table_names = [table_name, STAGING_PREFIX + table_name] if self.bulk_mode else [table_name]
+        return [
+            name for name in table_names
+            if self.postgres.check_table_existence(table_name=name)[name]
+        ]
+
+    def _get_bookkeeping_source(self, table_name: str) -> str:
+        """Get the relation to read checkpoints from, which also holds staged ones in bulk mode."""
+        if not self.bulk_mode:
+            return f"{self.schema}.{table_name}"
+
+        return f"(SELECT * FROM {self.schema}.{table_name} " \
+               f"UNION ALL SELECT * FROM {self.schema}.{STAGING_PREFIX}{table_name}) {table_name}"
+
+    def _get_maintenance_settings(self) -> str:
+        """
+        Get the settings that let postgres build indexes with parallel workers in bulk mode.
+
+        They only last for the transaction of the statement they precede, which execute_statement commits.
+        """
+        if not self.bulk_mode:
+            return ""
+
+        return f"SET LOCAL max_parallel_maintenance_workers = {BULK_MAINTENANCE_WORKERS};\n"
+
+
+class SQLiteSink(LoadSink):
+    """Sink loading B3 history into a local SQLite database file, one file per schema."""
+
+    def __init__(self, schema: str, path: str) -> None:
+        """Initialize the constructor."""
+        super().__init__(schema=schema)
+        self.path = path
+        self.connection = None
+
+    def create_schema(self) -> None:
+        """Open (and create, if needed) schema's database file."""
+        os.makedirs(self.path, exist_ok=True)
+        self.connection = sqlite3.connect(os.path.join(self.path, f"{self.schema}.sqlite"))
+
+    def upload_data(self, dataframe: pd.DataFrame, table_name: str) -> None:
+        """Use pandas to_sql method with the sqlite connection."""
+        dataframe.to_sql(
+            name=table_name,
+            con=self.connection,
+            if_exists='append',
+            index=False,
+            chunksize=1000
+        )
+
+    def get_last_line_read(self, file_name: str) -> int:
+        """Run a query to get file's last line read."""
+        if not self._table_exists(table_name="extraction_progress"):
+            return 0
+
+        last_line_read, = self.connection.execute(
+            "SELECT max(last_line_read) FROM extraction_progress WHERE file_name = ?", (file_name,)
+        ).fetchone()
+        return int(last_line_read or 0)
+
+    def get_fingerprints(self, file_name: str) -> list:
+        """Run a query to get the fingerprints stored for given file, ordered by block."""
+        if not self._table_exists(table_name="extraction_fingerprint"):
+            return []
+
+        cursor = self.connection.execute(
+            f"SELECT {', '.join(FINGERPRINT_COLUMNS)} FROM extraction_fingerprint "
+            f"WHERE file_name = ? ORDER BY block_index",
+            (file_name,)
+        )
+        return [dict(zip(FINGERPRINT_COLUMNS, row)) for row in cursor.fetchall()]
+
+    def delete_fingerprint_blocks(self, file_name: str, first_block: int) -> None:
+        """Delete given file's fingerprints starting from given block."""
+        self._delete_rows(
+            table_name="extraction_fingerprint",
+            condition="file_name = ? AND block_index >= ?",
+            params=(file_name, first_block)
+        )
+
+    def delete_extraction_progress(self, file_name: str, after_line: int) -> None:
+        """Delete given file's checkpoints beyond given line."""
+        self._delete_rows(
+            table_name="extraction_progress",
+            condition="file_name = ? AND last_line_read > ?",
+            params=(file_name, after_line)
+        )
+
+    def delete_sessions(self, table_name: str, first_session, last_session) -> None:
+        """Delete rows of given yearly table whose sessions are within given dates, stored as ISO text."""
+        self._delete_rows(
+            table_name=table_name,
+            condition="date(data_pregao) BETWEEN ? AND ?",
+            params=(first_session.isoformat(), last_session.isoformat())
+        )
+
+    def finish_load(self, columns: list, option_columns: list) -> None:
+        """Rebuild stocks and options history as plain views, since SQLite has no materialized views."""
+        table_names = [
+            table_name
+            for table_name, in self.connection.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table' ORDER BY name"
+            ).fetchall()
+        ]
+        for view_name, table_pattern, view_columns in [
+            ("stocks_history", YEARLY_TABLE_PATTERN, columns),
+            ("options_history", OPTIONS_TABLE_PATTERN, option_columns),
+        ]:
+            existent_tables = [table_name for table_name in table_names if table_pattern.match(table_name)]
+            if not existent_tables:
+                continue
+
+            selected_columns = ", ".join(view_columns)
+            self.connection.executescript(
+                f"DROP VIEW IF EXISTS {view_name};\n"
+                f"CREATE VIEW {view_name} AS\n"
+                + "\nUNION ALL\n".join(f"SELECT {selected_columns} FROM {table}" for table in existent_tables)
+                + ";"
+            )
+            print(f"Created view {view_name} successfully!")
+
+    def close(self) -> None:
+        """Close database file."""
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def _table_exists(self, table_name: str) -> bool:
+        """Check if given table exists inside database file."""
+        return self.connection.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table_name,)
+        ).fetchone() is not None
+
+    def _delete_rows(self, table_name: str, condition: str, params: tuple) -> None:
+        """Delete rows of given table matching condition, if the table exists."""
+        if not self._table_exists(table_name=table_name):
+            return
+
+        # Table names are built from validated file names or are bookkeeping constants
+        with self.connection:
+            self.connection.execute(f"DELETE FROM {table_name} WHERE {condition}", params)
+
+
+class DataFrameSink(LoadSink):
+    """Base class of the sinks holding tables as dataframes, whose bookkeeping is done in pandas."""
+
+    def read_table(self, table_name: str) -> pd.DataFrame | None:
+        """Read every row of given table, or None if it does not exist."""
+        raise NotImplementedError
+
+    def write_table(self, table_name: str, dataframe: pd.DataFrame) -> None:
+        """Replace every row of given table."""
+        raise NotImplementedError
+
+    def get_last_line_read(self, file_name: str) -> int:
+        """Get file's last line read from its checkpoints."""
+        extraction_progress = self.read_table(table_name="extraction_progress")
+        if extraction_progress is None:
+            return 0
+
+        last_lines_read = extraction_progress.loc[extraction_progress['file_name'] == file_name, 'last_line_read']
+        return int(last_lines_read.max()) if len(last_lines_read) else 0
+
+    def get_fingerprints(self, file_name: str) -> list:
+        """Get the fingerprints stored for given file, ordered by block."""
+        fingerprints = self.read_table(table_name="extraction_fingerprint")
+        if fingerprints is None:
+            return []
+
+        fingerprints = fingerprints[fingerprints['file_name'] == file_name].sort_values(by='block_index')
+        return fingerprints[FINGERPRINT_COLUMNS].to_dict(orient='records')
+
+    def delete_fingerprint_blocks(self, file_name: str, first_block: int) -> None:
+        """Delete given file's fingerprints starting from given block."""
+        self._delete_rows(
+            table_name="extraction_fingerprint",
+            condition=lambda dataframe: (dataframe['file_name'] == file_name)
+            & (dataframe['block_index'] >= first_block)
+        )
+
+    def delete_extraction_progress(self, file_name: str, after_line: int) -> None:
+        """Delete given file's checkpoints beyond given line."""
+        self._delete_rows(
+            table_name="extraction_progress",
+            condition=lambda dataframe: (dataframe['file_name'] == file_name)
+            & (dataframe['last_line_read'] > after_line)
+        )
+
+    def delete_sessions(self, table_name: str, first_session, last_session) -> None:
+        """Delete rows of given yearly table whose sessions are within given dates."""
+        self._delete_rows(
+            table_name=table_name,
+            condition=lambda dataframe: dataframe['data_pregao'].between(first_session, last_session)
+        )
+
+    def _delete_rows(self, table_name: str, condition) -> None:
+        """Rewrite given table without the rows matching condition, a function returning a boolean mask."""
+        dataframe = self.read_table(table_name=table_name)
+        if dataframe is None:
+            return
+
+        matching_rows = condition(dataframe)
+        if matching_rows.any():
+            self.write_table(table_name=table_name, dataframe=dataframe[~matching_rows].reset_index(drop=True))
+
+
+class MemorySink(DataFrameSink):
+    """
+    Sink keeping every table in memory, for running extraction and transformation without any database.
+
+    With keep_rows disabled it becomes a null sink: yearly tables only count their rows,
+    while checkpoints and fingerprints are still kept so that files are read exactly like in a real load.
+    """
+
+    def __init__(self, schema: str, keep_rows: bool = True) -> None:
+        """Initialize the constructor."""
+        super().__init__(schema=schema)
+        self.keep_rows = keep_rows
+        self.tables = {}
+        self.row_counts = {}
+
+    def upload_data(self, dataframe: pd.DataFrame, table_name: str) -> None:
+        """Append dataframe to the table's list of dataframes."""
+        self.row_counts[table_name] = self.row_counts.get(table_name, 0) + len(dataframe)
+        if self.keep_rows or table_name in BOOKKEEPING_TABLES:
+            self.tables.setdefault(table_name, []).append(dataframe)
+
+    def read_table(self, table_name: str) -> pd.DataFrame | None:
+        """Concatenate the dataframes uploaded to given table."""
+        if not self.tables.get(table_name):
+            return None
+
+        return pd.concat(self.tables[table_name], ignore_index=True)
+
+    def write_table(self, table_name: str, dataframe: pd.DataFrame) -> None:
+        """Replace the dataframes of given table."""
+        self.tables[table_name] = [dataframe]
+        self.row_counts[table_name] = len(dataframe)
+
+
+class FileSink(DataFrameSink):
+    """
+    Sink writing every table as local files, one per column, either in numpy binary or CSV format.
+
+    Each upload becomes a part directory inside the table's directory, holding one file per column and
+    the kind of each column, so that values are read back with their original types.
+    """
+
+    def __init__(self, schema: str, path: str, file_format: str = "npy") -> None:
+        """Initialize the constructor."""
+        if file_format not in ["npy", "csv"]:
+            raise ValueError(f"Invalid file format {file_format}. Expected npy or csv.")
+
+        super().__init__(schema=schema)
+        self.path = path
+        self.file_format = file_format
+
+    def create_schema(self) -> None:
+        """Create schema's directory."""
+        os.makedirs(os.path.join(self.path, self.schema), exist_ok=True)
+
+    def upload_data(self, dataframe: pd.DataFrame, table_name: str) -> None:
+        """Write dataframe as a new part of given table."""
+        table_directory = self._get_table_directory(table_name=table_name)
+        existing_parts = self._list_parts(table_directory=table_directory)
+        next_part = int(existing_parts[-1].split('-')[1]) + 1 if existing_parts else 0
+
+        part_directory = os.path.join(table_directory, f"part-{next_part:05d}")
+        os.makedirs(part_directory)
+
+        column_kinds = {}
+        for column in dataframe.columns:
+            column_kinds[column] = self._get_column_kind(series=dataframe[column])
+            self._write_column(
+                series=dataframe[column],
+                kind=column_kinds[column],
+                file_path=os.path.join(part_directory, f"{column}.{self.file_format}")
+            )
+
+        with open(os.path.join(part_directory, "columns.json"), "w") as columns_file:
+            json.dump(column_kinds, columns_file)
+
+    def read_table(self, table_name: str) -> pd.DataFrame | None:
+        """Read every part of given table, restoring each column's kind."""
+        dataframes = list(self.read_parts(table_name=table_name))
+        if not dataframes:
+            return None
+
+        return pd.concat(dataframes, ignore_index=True)
+
+    def read_parts(self, table_name: str):
+        """Read given table one part at a time, restoring each column's kind, without holding it all in memory."""
+        table_directory = self._get_table_directory(table_name=table_name)
+        for part in self._list_parts(table_directory=table_directory):
+            part_directory = os.path.join(table_directory, part)
+            with open(os.path.join(part_directory, "columns.json")) as columns_file:
+                column_kinds = json.load(columns_file)
+
+            yield pd.DataFrame({
+                column: self._read_column(
+                    file_path=os.path.join(part_directory, f"{column}.{self.file_format}"),
+                    kind=kind
+                )
+                for column, kind in column_kinds.items()
+            })
+
+    def write_table(self, table_name: str, dataframe: pd.DataFrame) -> None:
+        """Replace every part of given table with a single one."""
+        shutil.rmtree(self._get_table_directory(table_name=table_name), ignore_errors=True)
+        if len(dataframe):
+            self.upload_data(dataframe=dataframe, table_name=table_name)
+
+    def _get_table_directory(self, table_name: str) -> str:
+        """Build the path of given table's directory."""
+        return os.path.join(self.path, self.schema, table_name)
+
+    @staticmethod
+    def _list_parts(table_directory: str) -> list:
+        """List the part directories of a table, in the order they were written."""
+        if not os.path.isdir(table_directory):
+            return []
+
+        return sorted(part for part in os.listdir(table_directory) if part.startswith("part-"))
+
+    @staticmethod
+    def _get_column_kind(series: pd.Series) -> str:
+        """Classify a column as date, integer, float, boolean or string, the kinds found in B3 history."""
+        inferred_type = pd.api.types.infer_dtype(series, skipna=True)
+        if inferred_type in ["date", "datetime", "datetime64"]:
+            return "date"
+        if inferred_type == "integer":
+            return "integer"
+        if inferred_type in ["floating", "mixed-integer-float", "decimal"]:
+            return "float"
+        if inferred_type == "boolean":
+            return "boolean"
+        return "string"
+
+    def _write_column(self, series: pd.Series, kind: str, file_path: str) -> None:
+        """Write a column to its own file. Missing strings are written as empty ones, as B3 has no empty values."""
+        if kind == "date":
+            # Days precision holds B3's 9999-12-31 placeholder, unlike pandas' nanosecond timestamps
+            values = np.array(series.tolist(), dtype="datetime64[D]")
+        elif kind == "string":
+            values = series.fillna("").astype(str).to_numpy(dtype=str)
+        else:
+            values = series.to_numpy(dtype=COLUMN_KIND_DTYPES[kind])
+
+        if self.file_format == "npy":
+            np.save(file_path, values, allow_pickle=False)
+        else:
+            pd.Series(values.astype(str) if kind == "date" else values, name=series.name).to_csv(file_path, index=False)
+
+    def _read_column(self, file_path: str, kind: str) -> pd.Series:
+        """Read a column from its own file, converting it back to its kind."""
+        if self.file_format == "npy":
+            values = np.load(file_path, allow_pickle=False)
+        else:
+            values = pd.read_csv(file_path, dtype=str, skip_blank_lines=False).iloc[:, 0].to_numpy()
+
+        if kind == "date":
+            return pd.Series(values.astype("datetime64[D]").astype(object))
+
+        series = pd.Series(values)
+        if kind == "string":
+            return series.replace("", np.nan)
+        if kind == "boolean" and self.file_format == "csv":
+            return series == "True"
+        return series.astype(COLUMN_KIND_DTYPES[kind])
+
+
+def build_sink(sink_name: str, schema: str, path: str = None, file_format: str = "npy") -> LoadSink:
+    """Instance the sink chosen by name: postgres, sqlite, files, memory or null."""
+    if sink_name == "postgres":
+        return PostgresSink(schema=schema)
+    if sink_name == "sqlite":
+        return SQLiteSink(schema=schema, path=path)
+    if sink_name == "files":
+        return FileSink(schema=schema, path=path, file_format=file_format)
+    if sink_name == "memory":
+        return MemorySink(schema=schema)
+    if sink_name == "null":
+        return MemorySink(schema=schema, keep_rows=False)
+
+    raise ValueError(f"Invalid sink {sink_name}. Expected postgres, sqlite, files, memory or null.")
@@ -1,23 +1,66 @@
-"""File for extracting data from B3 history files, transforming, and uploading to postgres datalake"""
-import pandas as pd
-from psycopg2.errors import UndefinedTable
+"""File for extracting data from B3 history files, transforming, and uploading to datalake"""
+from __future__ import annotations
+
+from datetime import timedelta
 
 from src.b3_history.modules.extraction_engine import ExtractionEngine
-from src.b3_history.modules.transformation_engine import TransformationEngine
-from src.shared.loading_engine import PostgresConnector
+from src.b3_history.modules.load_sinks import LoadSink, PostgresSink
+from src.b3_history.modules.memory_engine import MemoryEngine
+from src.b3_history.modules.transformation_engine import OPTION_COLUMNS, TransformationEngine
+from src.shared.lazy_import import lazy_import
+
+futures = lazy_import("concurrent.futures")
+pd = lazy_import("pandas")
+
+
+class RecordRangeEngine(ExtractionEngine, TransformationEngine):
+    """Engine without database connection, for parsing and transforming a range of raw file lines in a worker."""
+
 
+def extract_and_transform_record_range(
+        raw_file_path: str,
+        record_length: int,
+        line_range: tuple,
+        price_cents: bool = False
+) -> pd.DataFrame:
+    """Read a range of lines from a raw file and transform them, meant to run inside a worker process."""
+    engine = RecordRangeEngine()
+    first_line, last_line = line_range
+    return engine.transform_dataframe(
+        dataframe=engine.read_raw_records(
+            raw_file_path=raw_file_path,
+            record_length=record_length,
+            first_line=first_line,
+            last_line=last_line
+        ),
+        price_cents=price_cents
+    )
 
-class DataLakeMainEngine(ExtractionEngine, TransformationEngine):
-    """Main class for reading zipped file, transform the dataframe and upload data to postgres."""
+
+class DataLakeMainEngine(ExtractionEngine, TransformationEngine, MemoryEngine):
+    """Main class for reading zipped file, transform the dataframe and upload data to its sink."""
 
     def __init__(self):
         """Initialize constructor."""
         # Extraction and Transformation engines inheritance
         super().__init__()
 
-        # Postgres class composition
+        # Sink composition, postgres unless another one is set before the first load
         self._schema = "b3_history"  # default value, but can be overwritten with event parameter
-        self.postgres = PostgresConnector(schema=self.schema)
+        self._sink = None
+
+        # Number of fingerprint blocks of current file already stored alongside its checkpoints
+        self._stored_fingerprint_blocks = 0
+
+        # Prices are stored as floats, unless kept as the exact integer cents B3 quotes them in
+        self._price_cents = False
+
+        # Bulk loads are staged into unlogged tables and published once each file is complete
+        self._bulk_mode = False
+
+        # Memory is not traced unless a budget is set, in megabytes, along with the peak of each stage of a batch
+        self._memory_budget_mb = None
+        self.stage_peaks = {}
 
     @property
     def schema(self) -> str:
@@ -40,112 +83,320 @@ class DataLakeMainEngine(ExtractionEngine, TransformationEngine):
             raise ValueError("Prohibited characters found in schema name!")
 
         self._schema = schema_name
-        self.postgres.schema = schema_name
+        if self._sink is not None:
+            self._sink.schema = schema_name
+
+    @property
+    def sink(self) -> LoadSink:
+        """Access attribute value, connecting to postgres if no other sink was set."""
+        if self._sink is None:
+            self._sink = PostgresSink(schema=self.schema)
+            self._sink.bulk_mode = self.bulk_mode
+        return self._sink
+
+    @sink.setter
+    def sink(self, sink: LoadSink) -> None:
+        """Define property setter, loading into engine's schema."""
+        if not isinstance(sink, LoadSink):
+            raise TypeError(f"Invalid type {type(sink)} for sink.")
+
+        sink.schema = self.schema
+        sink.bulk_mode = self.bulk_mode
+        self._sink = sink
+
+    @property
+    def price_cents(self) -> bool:
+        """Access attribute value."""
+        return self._price_cents
+
+    @price_cents.setter
+    def price_cents(self, value: bool) -> None:
+        """Define property setter and validate input."""
+        if not isinstance(value, bool):
+            raise TypeError(f"Invalid type {type(value)} for price_cents.")
+
+        self._price_cents = value
+
+    @property
+    def bulk_mode(self) -> bool:
+        """Access attribute value."""
+        return self._bulk_mode
+
+    @bulk_mode.setter
+    def bulk_mode(self, value: bool) -> None:
+        """Define property setter and validate input, keeping sink's mode in sync."""
+        if not isinstance(value, bool):
+            raise TypeError(f"Invalid type {type(value)} for bulk_mode.")
+
+        self._bulk_mode = value
+        if self._sink is not None:
+            self._sink.bulk_mode = value
+
+    @property
+    def spot_columns(self) -> list:
+        """Columns of the yearly tables holding every market but options."""
+        return [column for column in self.columns_separator if column not in OPTION_COLUMNS]
+
+    @property
+    def option_columns(self) -> list:
+        """Columns of the yearly tables holding options."""
+        return ['underlying', 'option_type', *self.columns_separator]
 
     def run_etl(self) -> None:
         """Run main ETL method."""
-        # Extract
-        extracted_dataframe = self.read_and_extract_data_from_file()
+        # A file read for the first time replaces whatever was previously loaded for its sessions
+        if self.last_line_read == 0:
+            self.delete_file_period()
 
-        # Transform
-        transformed_dataframe = self.transform_dataframe(
-            dataframe=extracted_dataframe
-        )
+        self.stage_peaks = {}
+        if self.raw_file_mode:
+            # Extract and transform, in parallel ranges of the raw file
+            with self.track_memory(stage="extract_transform"):
+                dataframes = self.read_and_transform_raw_batch()
+
+        else:
+            # Extract
+            with self.track_memory(stage="extract"):
+                dataframe = self.read_and_extract_data_from_file()
+
+            # Transform, in place so that the extracted batch is not copied
+            with self.track_memory(stage="transform"):
+                dataframes = [self.transform_dataframe(dataframe=dataframe, price_cents=self.price_cents)]
+            del dataframe
 
         # Load
-        print("Uploading data to postgres... ", end='')
-        self.postgres.upload_data(
-            dataframe=transformed_dataframe,
-            table_name=self.file_name.split('.')[0].lower()
-        )
+        with self.track_memory(stage="load"):
+            self.upload_batch(dataframes=dataframes)
+
+        self.report_memory()
+        self.adapt_batch_size()
+
+    def upload_batch(self, dataframes: list) -> None:
+        """
+        Upload transformed parts of a batch, loading options apart from every other market, and checkpoint it.
+
+        When uploading the batch would exceed the memory budget, it is spilled to local files first and
+        uploaded back one chunk at a time. Parts are popped from given list, so that each one is released once loaded.
+        """
+        if self.exceeds_memory_budget(dataframes=dataframes):
+            parts = self.read_spilled_dataframes(spill_sink=self.spill_dataframes(dataframes=dataframes))
+        else:
+            parts = (dataframes.pop(0) for _ in range(len(dataframes)))
+
+        print("Uploading data... ", end='')
+        for dataframe in parts:
+            spot_dataframe, options_dataframe = self.split_options(dataframe=dataframe)
+            del dataframe
+            for table_dataframe, table_name in [
+                (spot_dataframe, self.table_name),
+                (options_dataframe, self.options_table_name)
+            ]:
+                if len(table_dataframe):
+                    self.sink.upload_data(dataframe=table_dataframe, table_name=table_name)
+
         self.upload_extraction_progress()
         print('Upload complete!')
 
+    def read_and_transform_raw_batch(self) -> list:
+        """
+        Extract and transform next batch straight from its byte range in the raw file.
+
+        The batch is split into one contiguous range of lines per worker, and each worker parses and
+        transforms its own range. Resuming from last_line_read costs a single seek.
+        Ranges are returned as separate dataframes, so that the batch is never concatenated into a copy.
+        """
+        first_line, last_line = self.get_batch_line_range()
+        number_of_lines = last_line - first_line + 1
+        range_size = -(-number_of_lines // max(self.workers, 1))  # ceiling division
+        line_ranges = [
+            (range_start, min(range_start + range_size - 1, last_line))
+            for range_start in range(first_line, last_line + 1, range_size)
+        ]
+
+        print(f'Reading lines {first_line} to {last_line}... ', end='')
+        if self.workers > 1 and len(line_ranges) > 1:
+            with futures.ProcessPoolExecutor(max_workers=self.workers) as executor:
+                dataframes = list(executor.map(
+                    extract_and_transform_record_range,
+                    [self.raw_file_path] * len(line_ranges),
+                    [self.record_length] * len(line_ranges),
+                    line_ranges,
+                    [self.price_cents] * len(line_ranges)
+                ))
+        else:
+            dataframes = [
+                extract_and_transform_record_range(self.raw_file_path, self.record_length, line_range, self.price_cents)
+                for line_range in line_ranges
+            ]
+
+        self.last_line_read = last_line
+        self.has_more = last_line < self.total_lines - 1
+        if self.has_more:
+            print(f"Batch {last_line} completed!")
+        else:
+            print(f"Reached the end of file {self.file_name}.")
+
+        return dataframes
+
+    def prepare_file(self) -> None:
+        """
+        Scan current file and reconcile it with the checkpoint of its previous ingestion.
+
+        B3 re-publishes the current year's file with new sessions appended. When the fingerprints stored
+        for the ingested prefix still match, only the appended tail is read. If any block changed,
+        progress is discarded and the file is reloaded from scratch.
+        """
+        self.has_more = True
+        if self.raw_file_mode:
+            self.prepare_raw_file()
+
+        self.sink.validate_price_unit(price_cents=self.price_cents)
+        self.sink.add_missing_columns(table_name=self.table_name, columns=self.spot_columns)
+        self.sink.discard_leftover_staging(
+            file_name=self.file_name,
+            table_names=[self.table_name, self.options_table_name]
+        )
+        self.get_last_line_read()
+        stored_fingerprints = self.sink.get_fingerprints(file_name=self.file_name)
+
+        partial_blocks = {
+            fingerprint['block_index']: fingerprint['record_count']
+            for fingerprint in stored_fingerprints
+            if fingerprint['record_count'] < self.fingerprint_block_size
+        }
+        prefix_records = int(sum(fingerprint['record_count'] for fingerprint in stored_fingerprints))
+        self.total_lines = self.get_file_total_lines(
+            partial_blocks=partial_blocks,
+            prefix_records=prefix_records
+        )
+        self._stored_fingerprint_blocks = len(stored_fingerprints)
+
+        if not stored_fingerprints:
+            if self.last_line_read:
+                print("No fingerprints found for previous progress, trusting its line numbers.")
+            return
+
+        current_hashes = {
+            fingerprint['block_index']: fingerprint['block_hash']
+            for fingerprint in self.file_fingerprints
+        }
+        for fingerprint in stored_fingerprints:
+            if fingerprint['record_count'] < self.fingerprint_block_size:
+                current_hash = self.partial_block_hashes.get(fingerprint['block_index'])
+            else:
+                current_hash = current_hashes.get(fingerprint['block_index'])
+
+            if current_hash != fingerprint['block_hash']:
+                print(f"File {self.file_name} changed since its last ingestion. Reloading it entirely...")
+                self.reset_file_progress()
+                return
+
+        # A block smaller than fingerprint_block_size is the last one of its file version, and it is only stored
+        # once every record was read, which also covers checkpoints stored before the final flag was reliable
+        file_was_completed = any(
+            fingerprint['is_final_block'] or fingerprint['record_count'] < self.fingerprint_block_size
+            for fingerprint in stored_fingerprints
+        )
+        if not file_was_completed or self.file_total_records == prefix_records:
+            # Either a regular resume of an interrupted ingestion, or nothing new to read
+            return
+
+        # The previous version was completely read: resume right after its last record, which sits
+        # where its trailer used to be (the header is the first line of the file)
+        print(f"File {self.file_name} has {self.file_total_records - prefix_records} new records appended.")
+        last_stored_block = int(stored_fingerprints[-1]['block_index'])
+        self.sink.delete_fingerprint_blocks(file_name=self.file_name, first_block=last_stored_block)
+        self._stored_fingerprint_blocks = last_stored_block
+        self.sink.delete_extraction_progress(file_name=self.file_name, after_line=prefix_records)
+        self.last_line_read = prefix_records
+        self.upload_extraction_progress()
+
+        # Sessions appended to the file may have been loaded before through daily or monthly files
+        if self.prefix_last_session:
+            self.delete_file_period(first_session=self.prefix_last_session + timedelta(days=1))
+
+    def reset_file_progress(self) -> None:
+        """Discard checkpoints and fingerprints of current file, so that it is read from its beginning."""
+        self.sink.delete_extraction_progress(file_name=self.file_name, after_line=-1)
+        self.sink.delete_fingerprint_blocks(file_name=self.file_name, first_block=0)
+        self._stored_fingerprint_blocks = 0
+        self.last_line_read = 0
+
     def upload_extraction_progress(self) -> None:
-        """Build a dataframe from extraction attribute and upload it to datalake."""
+        """Build a dataframe from extraction attribute and upload it to datalake, along with new fingerprints."""
         dataframe = pd.DataFrame([
             {
                 "file_name": self.file_name,
                 "last_line_read": self.last_line_read
             }
         ])
-        self.postgres.upload_data(
+        self.sink.upload_data(
             dataframe=dataframe,
             table_name="extraction_progress"
         )
+        self.upload_fingerprints()
 
-    def create_update_view(self):
+    def upload_fingerprints(self) -> None:
         """
-        Orchestrate the creation of the view that aggregates all tables uploaded.
+        Upload fingerprints of the blocks that have been completely ingested since the last checkpoint.
 
-        Since there is no user input, we should be safe against SQL injection.
-        This view will concatenate every existing table in schema.
+        Lines are counted from the header, so the number of records ingested equals last_line_read.
+        Once every record has been read, its last (possibly incomplete) block is flagged as final, even when
+        the batch ended right on the last record and only the trailer is left to be read.
         """
-        all_years = range(1986, 2023)
-        all_tables = [
-            "cotahist_a" + str(year)
-            for year in all_years
-        ]
+        all_records_ingested = not self.has_more or self.last_line_read >= self.file_total_records
+        if all_records_ingested:
+            records_ingested = self.file_total_records
+        else:
+            records_ingested = self.last_line_read
 
-        # Check which tables exist in datalake
-        table_existence_check = []
-        for table in all_tables:
-            table_existence_check.append(
-                self.postgres.check_table_existence(table_name=table)
-            )
-
-        existent_tables = [
-            table_name
-            for table in table_existence_check
-            for table_name, exists in table.items()
-            if exists
+        new_fingerprints = [
+            {
+                "file_name": self.file_name,
+                **fingerprint,
+                "is_final_block": all_records_ingested and fingerprint is self.file_fingerprints[-1]
+            }
+            for fingerprint in self.file_fingerprints[self._stored_fingerprint_blocks:]
+            if fingerprint['block_index'] * self.fingerprint_block_size + fingerprint['record_count']
+            <= records_ingested
         ]
-
-        # It would be quite weird to arrive here with no table uploaded, but let's check it anyway
-        if not existent_tables:
+        if not new_fingerprints:
             return
 
-        # build SQL statement by concatenating tables with UNION ALL
-        statement_header = f"CREATE MATERIALIZED VIEW IF NOT EXISTS {self.schema}.stocks_history AS\n" \
-                           f"SELECT * FROM {self.schema}.{existent_tables.pop(0)}"
+        self.sink.upload_data(
+            dataframe=pd.DataFrame(new_fingerprints),
+            table_name="extraction_fingerprint"
+        )
+        self._stored_fingerprint_blocks += len(new_fingerprints)
 
-        union_statement = f"\nUNION ALL\n SELECT * FROM {self.schema}."
-        remaining_statement = [
-            union_statement + table
-            for table in existent_tables
-        ]
+    def delete_file_period(self, first_session=None) -> None:
+        """
+        Delete rows of the sessions covered by current file from its yearly tables.
 
-        complete_statement = statement_header + ''.join(remaining_statement)
-
-        # execute
-        self.postgres.execute_statement(statement=complete_statement)
-        print("Created view successfully!")
-
-    def get_last_line_read_from_postgres(self) -> None:
-        """Run a query to get file's last line read."""
-        # Although schema name is user input, it has already been validated against prohibited characters
-        query = f"""
-            SELECT *
-            FROM {self.schema}.extraction_progress
-            WHERE file_name = %(file_name)s
-            ORDER BY last_line_read DESC
-            LIMIT 1;
+        Daily, monthly and annual files of the same year share the same tables, so whichever file is read
+        last becomes the source of truth for its sessions and no duplicates are left behind.
+        Annual files only cover up to their last session, keeping newer daily files untouched.
         """
-        query_parameter = {'file_name': self.file_name}
+        period_start, last_session = self.file_period
+        first_session = first_session or period_start
+        if self.file_last_session:
+            last_session = min(last_session, self.file_last_session)
 
-        try:
-            extraction_progress = self.postgres.read_sql_query(
-                query=query,
-                params=query_parameter
+        for table_name in [self.table_name, self.options_table_name]:
+            self.sink.delete_sessions(
+                table_name=table_name,
+                first_session=first_session,
+                last_session=last_session
             )
-        except UndefinedTable:
-            # project's first run will create this table later on
-            self.last_line_read = 0
-            return
 
-        if not len(extraction_progress):
-            # File will be read for the first time
-            self.last_line_read = 0
-            return
+    def get_last_line_read(self) -> None:
+        """Get file's last line read from sink's checkpoints."""
+        self.last_line_read = self.sink.get_last_line_read(file_name=self.file_name)
+
+    def publish_file(self) -> None:
+        """Publish whatever was staged for current file into its yearly tables, once it has been completely read."""
+        self.sink.publish_file(file_name=self.file_name, table_names=[self.table_name, self.options_table_name])
 
-        self.last_line_read = int(extraction_progress['last_line_read'])
+    def finish_load(self) -> None:
+        """Build whatever the sink derives from yearly tables, such as stocks and options history views."""
+        self.sink.finish_load(columns=self.spot_columns, option_columns=self.option_columns)
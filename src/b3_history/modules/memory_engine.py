@@ -0,0 +1,124 @@
+"""File containing the class that keeps each batch within a memory budget, spilling it to local files if needed."""
+from __future__ import annotations
+
+import contextlib
+import resource
+import shutil
+import tempfile
+import tracemalloc
+
+from src.b3_history.modules.load_sinks import FileSink
+
+# Uploading a dataframe allocates buffers a few times its own size, e.g. to_sql's rows and statements
+LOAD_MEMORY_FACTOR = 3
+
+# Smallest number of rows uploaded at once when a spilled batch is loaded back
+MIN_SPILL_CHUNK_ROWS = 1000
+
+
+class MemoryEngine:
+    """
+    Class for tracking peak memory of each ETL stage against an optional budget, in megabytes.
+
+    Python allocations are traced per stage, which covers pandas buffers too. Once a batch is expected to
+    exceed the budget while being uploaded, it is spilled to local files and uploaded back in smaller chunks.
+    Batches that peak above the budget make the next ones smaller.
+    """
+
+    @property
+    def memory_budget_mb(self) -> float | None:
+        """Access attribute value."""
+        return self._memory_budget_mb
+
+    @memory_budget_mb.setter
+    def memory_budget_mb(self, value: float | None) -> None:
+        """Define property setter and validate input, starting to trace allocations once a budget is set."""
+        if value is not None:
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                raise TypeError(f"Invalid type {type(value)} for memory budget.")
+            if value <= 0:
+                raise ValueError("Memory budget must be positive.")
+
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+
+        self._memory_budget_mb = value
+
+    @contextlib.contextmanager
+    def track_memory(self, stage: str):
+        """
+        Record the peak memory allocated by given stage, when there is a budget.
+
+        Memory still held by earlier stages when this one starts, e.g. the batch being transformed, is not counted.
+        """
+        if self.memory_budget_mb is None:
+            yield
+            return
+
+        start_memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        try:
+            yield
+        finally:
+            self.stage_peaks[stage] = (tracemalloc.get_traced_memory()[1] - start_memory) / 2 ** 20
+
+    def report_memory(self) -> None:
+        """Print peak memory of each stage of the last batch, and peak resident memory of the whole process."""
+        if self.memory_budget_mb is None:
+            return
+
+        stage_peaks = ", ".join(f"{stage} {peak:.1f} MB" for stage, peak in self.stage_peaks.items())
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 10  # kilobytes on linux
+        print(f"Memory peaks: {stage_peaks} (budget {self.memory_budget_mb} MB, peak RSS {peak_rss:.1f} MB).")
+
+    def exceeds_memory_budget(self, dataframes: list) -> bool:
+        """Check whether uploading given dataframes, on top of what is already allocated, would exceed the budget."""
+        if self.memory_budget_mb is None:
+            return False
+
+        dataframes_size = sum(dataframe.memory_usage(deep=True).sum() for dataframe in dataframes)
+        expected_memory = tracemalloc.get_traced_memory()[0] + LOAD_MEMORY_FACTOR * dataframes_size
+        return expected_memory / 2 ** 20 > self.memory_budget_mb
+
+    def spill_dataframes(self, dataframes: list) -> FileSink:
+        """
+        Write dataframes to a temporary directory, in chunks small enough to be uploaded within the budget.
+
+        Dataframes are popped from given list as they are written, so that each one is released once on disk.
+        Return the sink holding the chunks.
+        """
+        spill_sink = FileSink(schema="spill", path=tempfile.mkdtemp(prefix="b3_history_spill_"), file_format="npy")
+        print(f"Batch exceeds the memory budget, spilling it to {spill_sink.path}... ", end="")
+        while dataframes:
+            dataframe = dataframes.pop(0)
+            row_size = max(dataframe.memory_usage(deep=True).sum() / max(len(dataframe), 1), 1)
+            chunk_rows = max(
+                int(self.memory_budget_mb * 2 ** 20 / (2 * LOAD_MEMORY_FACTOR * row_size)),
+                MIN_SPILL_CHUNK_ROWS
+            )
+            for chunk_start in range(0, len(dataframe), chunk_rows):
+                spill_sink.upload_data(
+                    dataframe=dataframe.iloc[chunk_start:chunk_start + chunk_rows].reset_index(drop=True),
+                    table_name="batch"
+                )
+            del dataframe
+
+        print("Spilled!")
+        return spill_sink
+
+    @staticmethod
+    def read_spilled_dataframes(spill_sink: FileSink):
+        """Read spilled chunks back one at a time, removing the temporary directory once they are all read."""
+        try:
+            yield from spill_sink.read_parts(table_name="batch")
+        finally:
+            shutil.rmtree(spill_sink.path, ignore_errors=True)
+
+    def adapt_batch_size(self) -> None:
+        """Halve the batch size for the next batches when any stage of the last one peaked above the budget."""
+        if self.memory_budget_mb is None or not self.stage_peaks:
+            return
+
+        if max(self.stage_peaks.values()) > self.memory_budget_mb and self.batch_size > MIN_SPILL_CHUNK_ROWS:
+            self.batch_size = max(self.batch_size // 2, MIN_SPILL_CHUNK_ROWS)
+            print(f"Batch peaked above the memory budget, reading {self.batch_size} lines per batch from now on.")
@@ -1,18 +1,34 @@
 """File containing the class that applies many transformations."""
+from __future__ import annotations
+
 from datetime import datetime
 
-import numpy as np
-import pandas as pd
+from src.shared.column_definitions import CENTS_PRICE_COLUMNS, OPTION_MARKET_TYPES
+from src.shared.lazy_import import lazy_import
+
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+
+# Options are kept apart from spot and forward records, along with the columns that only make sense for them
+OPTION_COLUMNS = [
+    'preco_exercicio_opcoes',
+    'data_vencimento_opcoes',
+    'preco_exercicio_pontos_opcoes',
+]
 
 
 class TransformationEngine:
     """Class for cleaning, formatting and converting dataframe's data."""
 
-    def transform_dataframe(self, dataframe: pd.DataFrame) -> pd.DataFrame:
-        """Apply many dataframe transformations."""
+    def transform_dataframe(self, dataframe: pd.DataFrame, price_cents: bool = False) -> pd.DataFrame:
+        """
+        Apply many dataframe transformations, optionally keeping prices as exact integer cents.
+
+        Dataframe is transformed in place, one column at a time, so that the batch is never copied as a whole.
+        """
         # Exclude file header and trailer
-        header_trailer_filter = dataframe['data_pregao'] != "COTAHIST"
-        dataframe = dataframe[header_trailer_filter]
+        header_trailer_filter = dataframe['data_pregao'] == "COTAHIST"
+        dataframe.drop(index=dataframe.index[header_trailer_filter], inplace=True)
 
         # Special character treatment
         special_character_columns = 'prazo_dias_mercado_termo'
@@ -23,29 +39,23 @@ class TransformationEngine:
             dataframe.loc[special_character_filter, special_character_columns] = np.nan
 
         # Remove whitespaces
-        dataframe = dataframe.apply(self._remove_whitespaces)
+        for column in dataframe.columns:
+            dataframe[column] = self._remove_whitespaces(dataframe[column])
 
         # The previous removal could generate np.nan values. Removing them
         known_nan_columns = ['prazo_dias_mercado_termo']
-        dataframe[known_nan_columns] = dataframe[known_nan_columns].fillna("0")
+        for column in known_nan_columns:
+            dataframe[column] = dataframe[column].fillna("0")
 
         # Convert date string to date format
         date_columns = ["data_pregao", "data_vencimento_opcoes"]
-        dataframe[date_columns] = dataframe[date_columns].applymap(self._format_dates)
-
-        # Format price values
-        price_columns = [
-            'preco_abertura_pregao',
-            'preco_maximo_pregao',
-            'preco_minimo_pregao',
-            'preco_medio_pregao',
-            'preco_ultimo_negocio',
-            'preco_melhor_oferta_compra',
-            'preco_melhor_oferta_venda',
-            'preco_exercicio_opcoes',
-            'preco_exercicio_pontos_opcoes'
-        ]
-        dataframe[price_columns] = dataframe[price_columns].applymap(self._format_price_values)
+        for column in date_columns:
+            dataframe[column] = dataframe[column].map(self._format_dates)
+
+        # B3 quotes prices and volume as integer cents, parsed column-wise rather than cell by cell
+        for column in CENTS_PRICE_COLUMNS:
+            price_values = dataframe[column].astype('int64')
+            dataframe[column] = price_values if price_cents else price_values / 100
 
         # Format string to integer
         integer_columns = [
@@ -53,10 +63,28 @@ class TransformationEngine:
             'numero_negocios_efetuados',
             'quantidade_total_titulos_negociados'
         ]
-        dataframe[integer_columns] = dataframe[integer_columns].applymap(self._format_quantity_values)
+        for column in integer_columns:
+            dataframe[column] = dataframe[column].astype('int64')
 
         return dataframe
 
+    @staticmethod
+    def split_options(dataframe: pd.DataFrame) -> tuple:
+        """
+        Split transformed records into options and every other market, e.g. spot and forward.
+
+        Options gain their underlying, the first four characters of their code (e.g. PETR for PETRA20), and their type.
+        Other records lose option columns, which are meaningless for them.
+        """
+        is_option = dataframe['tipo_de_mercado'].isin(list(OPTION_MARKET_TYPES))
+
+        options_dataframe = dataframe[is_option].reset_index(drop=True)
+        options_dataframe.insert(0, 'underlying', options_dataframe['codigo_negociaco_papel'].str[:4])
+        options_dataframe.insert(1, 'option_type', options_dataframe['tipo_de_mercado'].map(OPTION_MARKET_TYPES))
+
+        spot_dataframe = dataframe[~is_option].drop(columns=OPTION_COLUMNS).reset_index(drop=True)
+        return spot_dataframe, options_dataframe
+
     @staticmethod
     def _remove_whitespaces(series: pd.Series) -> pd.Series:
         return series.str.rstrip().replace(r'^\s*$', np.nan, regex=True)
@@ -65,11 +93,3 @@ class TransformationEngine:
     def _format_dates(cell: str) -> datetime.date:
         date_format = "%Y%m%d"  # date example: 20230228
         return datetime.strptime(cell, date_format).date()
-
-    @staticmethod
-    def _format_price_values(cell: str) -> float:
-        return round(int(cell)/100, 2)
-
-    @staticmethod
-    def _format_quantity_values(cell: str) -> int:
-        return int(cell)
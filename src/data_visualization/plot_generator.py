@@ -8,10 +8,12 @@ and yahoo_finance app have already been run entirely before the execution of thi
 from datetime import date
 import os
 
-import matplotlib.dates as mdates
-import matplotlib.pyplot as plt
-
+from src.shared.lazy_import import lazy_import
 from src.shared.loading_engine import PostgresConnector
+from src.shared.query_engine import HistoryQueryEngine
+
+mdates = lazy_import("matplotlib.dates")
+plt = lazy_import("matplotlib.pyplot")
 
 
 ROOT_PATH = os.path.abspath(os.path.join(__file__, os.pardir))
@@ -20,9 +22,9 @@ ROOT_PATH = os.path.abspath(os.path.join(__file__, os.pardir))
 def lambda_handler():
     """Orchestrate figures generation."""
     # Get Data Warehouse data
+    dw_dataframe = HistoryQueryEngine().get_history(tickers=["PETR3"], source="data_warehouse")
+
     postgres = PostgresConnector()
-    dw_query = "SELECT * FROM data_warehouse.petr3"
-    dw_dataframe = postgres.read_sql_query(query=dw_query, params={})
 
     # Get Yahoo Finance data from postgres
     yahoo_query = "SELECT * FROM yahoo_finance.petr3_sa"
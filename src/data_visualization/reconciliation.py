@@ -0,0 +1,202 @@
+"""
+File for reconciling Data Warehouse prices with the ones fetched from Yahoo Finance, inside postgresql.
+
+Every ticker loaded by both data_warehouse app and yahoo_finance app is compared session by session
+with a single set-based join, and results are stored in the Data Warehouse schema.
+"""
+from __future__ import annotations
+
+import re
+
+from src.shared.loading_engine import PostgresConnector
+from src.shared.query_engine import IDENTIFIER_PATTERN
+
+RECONCILIATION_TABLE = "yahoo_reconciliation"
+SUMMARY_VIEW = "yahoo_reconciliation_summary"
+
+# Yahoo Finance tables are named after B3 tickers with the .SA suffix, e.g. petr3_sa for PETR3.SA
+YAHOO_TABLE_PATTERN = re.compile(r"^([a-z0-9]+)_sa$")
+
+# Data Warehouse columns and the Yahoo Finance columns they are compared to
+COMPARED_COLUMNS = {
+    "open": "preco_abertura_pregao",
+    "high": "preco_maximo_pregao",
+    "low": "preco_minimo_pregao",
+    "close": "preco_ultimo_negocio",
+}
+
+
+def lambda_handler(event: dict) -> bool:
+    """Handle the event and reconcile every ticker present in both schemas, returning whether there was any."""
+    data_warehouse_schema = _validate_schema_name(event.get("data_warehouse_schema", "data_warehouse"))
+    yahoo_schema = _validate_schema_name(event.get("yahoo_schema", "yahoo_finance"))
+
+    postgres = PostgresConnector(schema=yahoo_schema)
+    yahoo_tables = _list_yahoo_tables(postgres=postgres)
+    if not yahoo_tables:
+        print("This app is supposed to run only after yahoo_finance app.")
+        return False
+
+    postgres.schema = data_warehouse_schema
+    _create_reconciliation_table(postgres=postgres)
+
+    print(f"Reconciling {len(yahoo_tables)} tickers with Yahoo Finance... ", end="")
+    _reconcile_new_sessions(
+        postgres=postgres,
+        yahoo_schema=yahoo_schema,
+        yahoo_tables=yahoo_tables
+    )
+    _create_summary_view(postgres=postgres)
+    print("Reconciliation complete!")
+    return True
+
+
+def _list_yahoo_tables(postgres: PostgresConnector) -> dict:
+    """Map every B3 ticker loaded from Yahoo Finance to its table."""
+    yahoo_tables = {}
+    for table_name in postgres.list_tables():
+        match = YAHOO_TABLE_PATTERN.match(table_name)
+        if match:
+            yahoo_tables[match.group(1).upper()] = table_name
+
+    return yahoo_tables
+
+
+def _create_reconciliation_table(postgres: PostgresConnector) -> None:
+    """Create the table holding one reconciled row per ticker and session, if it does not exist yet."""
+    divergence_columns = "\n".join(
+        f"{yahoo_column}_divergence DOUBLE PRECISION," for yahoo_column in COMPARED_COLUMNS
+    )
+    postgres.execute_statement(statement=f"""
+        CREATE TABLE IF NOT EXISTS {postgres.schema}.{RECONCILIATION_TABLE} (
+            ticker TEXT NOT NULL,
+            data_pregao DATE NOT NULL,
+            status TEXT NOT NULL,
+            b3_close DOUBLE PRECISION,
+            yahoo_close DOUBLE PRECISION,
+            {divergence_columns}
+            PRIMARY KEY (ticker, data_pregao)
+        )
+    """)
+
+
+def _reconcile_new_sessions(postgres: PostgresConnector, yahoo_schema: str, yahoo_tables: dict) -> None:
+    """
+    Compare sessions of every ticker in one statement, from the session after its last matched one on.
+
+    Only the period covered by both sources is compared, since Yahoo Finance history starts much later than B3's.
+    A session missing from one source is checked again on the next run, as the source may have caught up since.
+    Divergences are relative to B3 prices, i.e. yahoo / b3 - 1.
+    """
+    # Table names come from the catalog and are matched against the pattern above, tickers are derived from them
+    yahoo_union = "\nUNION ALL\n".join(
+        f"SELECT '{ticker}' AS ticker, y.date AS data_pregao, "
+        f"{', '.join(f'y.{yahoo_column}' for yahoo_column in COMPARED_COLUMNS)} "
+        f"FROM {yahoo_schema}.{table_name} y"
+        for ticker, table_name in yahoo_tables.items()
+    )
+    divergences = ",\n".join(
+        f"y.{yahoo_column} / NULLIF(dp.{b3_column}, 0) - 1"
+        for yahoo_column, b3_column in COMPARED_COLUMNS.items()
+    )
+    divergence_columns = [f"{yahoo_column}_divergence" for yahoo_column in COMPARED_COLUMNS]
+    updated_columns = ", ".join(
+        f"{column} = EXCLUDED.{column}"
+        for column in ["status", "b3_close", "yahoo_close", *divergence_columns]
+    )
+
+    # Yahoo Finance tables loaded before they were replaced on each download may hold a session more than once
+    statement = f"""
+        WITH yahoo AS (
+            SELECT DISTINCT ON (u.ticker, u.data_pregao) u.*
+            FROM (
+                {yahoo_union}
+            ) u
+            ORDER BY u.ticker, u.data_pregao
+        ),
+        b3 AS (
+            SELECT dp.*
+            FROM {postgres.schema}.daily_prices dp
+            WHERE dp.ticker = ANY(%(tickers)s)
+        ),
+        windows AS (
+            SELECT
+                b.ticker,
+                greatest(b.first_session, y.first_session, r.last_matched_session + 1) AS first_session,
+                least(b.last_session, y.last_session) AS last_session
+            FROM (
+                SELECT ticker, min(data_pregao) AS first_session, max(data_pregao) AS last_session
+                FROM b3 GROUP BY ticker
+            ) b
+            JOIN (
+                SELECT ticker, min(data_pregao) AS first_session, max(data_pregao) AS last_session
+                FROM yahoo GROUP BY ticker
+            ) y ON y.ticker = b.ticker
+            LEFT JOIN (
+                SELECT ticker, max(data_pregao) AS last_matched_session
+                FROM {postgres.schema}.{RECONCILIATION_TABLE}
+                WHERE status = 'matched'
+                GROUP BY ticker
+            ) r ON r.ticker = b.ticker
+        )
+        INSERT INTO {postgres.schema}.{RECONCILIATION_TABLE} (
+            ticker, data_pregao, status, b3_close, yahoo_close, {', '.join(divergence_columns)}
+        )
+        SELECT
+            w.ticker,
+            coalesce(dp.data_pregao, y.data_pregao),
+            CASE
+                WHEN y.data_pregao IS NULL THEN 'missing_in_yahoo'
+                WHEN dp.data_pregao IS NULL THEN 'missing_in_b3'
+                ELSE 'matched'
+            END,
+            dp.preco_ultimo_negocio,
+            y.close,
+            {divergences}
+        FROM windows w
+        JOIN (
+            b3 dp FULL OUTER JOIN yahoo y
+            ON y.ticker = dp.ticker AND y.data_pregao = dp.data_pregao
+        ) ON w.ticker = coalesce(dp.ticker, y.ticker)
+        WHERE coalesce(dp.data_pregao, y.data_pregao) BETWEEN w.first_session AND w.last_session
+        ON CONFLICT (ticker, data_pregao) DO UPDATE SET {updated_columns}
+    """
+    postgres.execute_statement(statement=statement, params={"tickers": list(yahoo_tables)})
+
+
+def _create_summary_view(postgres: PostgresConnector) -> None:
+    """Create the view summarizing reconciliation results per ticker."""
+    divergence_statistics = ",\n".join(
+        f"avg(abs(r.{yahoo_column}_divergence)) AS mean_abs_{yahoo_column}_divergence,\n"
+        f"max(abs(r.{yahoo_column}_divergence)) AS max_abs_{yahoo_column}_divergence"
+        for yahoo_column in COMPARED_COLUMNS
+    )
+    postgres.execute_statement(statement=f"""
+        CREATE OR REPLACE VIEW {postgres.schema}.{SUMMARY_VIEW} AS
+        SELECT
+            r.ticker,
+            min(r.data_pregao) AS first_session,
+            max(r.data_pregao) AS last_session,
+            count(*) FILTER (WHERE r.status = 'matched') AS matched_sessions,
+            count(*) FILTER (WHERE r.status = 'missing_in_yahoo') AS missing_in_yahoo_sessions,
+            count(*) FILTER (WHERE r.status = 'missing_in_b3') AS missing_in_b3_sessions,
+            {divergence_statistics}
+        FROM {postgres.schema}.{RECONCILIATION_TABLE} r
+        GROUP BY r.ticker
+    """)
+
+
+def _validate_schema_name(schema_name: str) -> str:
+    """Validate schema name, which is put straight into queries, in order to avoid SQL injection."""
+    if not isinstance(schema_name, str) or not IDENTIFIER_PATTERN.match(schema_name):
+        raise ValueError("Prohibited characters found in schema name!")
+
+    return schema_name
+
+
+if __name__ == "__main__":
+    event = {
+        "data_warehouse_schema": "data_warehouse",
+        "yahoo_schema": "yahoo_finance",
+    }
+    lambda_handler(event=event)
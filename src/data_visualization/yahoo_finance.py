@@ -1,9 +1,12 @@
 """File for getting brazilian stocks through yfinance package and uploading to postgresql."""
-import pandas as pd
-import yfinance as yf
+from __future__ import annotations
 
+from src.shared.lazy_import import lazy_import
 from src.shared.loading_engine import PostgresConnector
 
+pd = lazy_import("pandas")
+yf = lazy_import("yfinance")
+
 
 def lambda_handler(event: any) -> None:
     """Handle the event and call the appropriate methods."""
@@ -55,8 +58,8 @@ def _transform_dataframe(dataframe: pd.DataFrame) -> pd.DataFrame:
 
 
 def _load_data_into_postgres(postgres: PostgresConnector, dataframe: pd.DataFrame, stock: str) -> None:
-    """Load dataframe to postgresql."""
-    postgres.upload_data(
+    """Load dataframe to postgresql, replacing the ticker's table since its whole history is downloaded each time."""
+    postgres.replace_data(
         dataframe=dataframe,
         table_name=_format_ticker_name(stock=stock)
     )
@@ -2,8 +2,8 @@
 from src.data_warehouse.modules.main_engine import DataWarehouseMainEngine
 
 
-def lambda_function(event: dict) -> None:
-    """Orchestrate accordingly."""
+def lambda_function(event: dict) -> bool:
+    """Orchestrate accordingly, returning whether it ran to completion."""
     # Instance main engine
     engine = DataWarehouseMainEngine()
 
@@ -16,7 +16,7 @@ def lambda_function(event: dict) -> None:
     view_exists = engine.postgres.check_materialized_view_existence(view_name="stocks_history")
     if not view_exists:
         print("This app is supposed to run only after the creation of data lake materialized view.")
-        return
+        return False
 
     # Data Warehouse schema setup
     if event.get('data_warehouse_schema'):
@@ -24,39 +24,95 @@ def lambda_function(event: dict) -> None:
     else:
         engine.data_warehouse_schema = "data_warehouse"  # default value if not provided
     engine.postgres.create_schema_database()  # must have 'create' privilege
+    engine.create_fact_table()
+    engine.create_rollup_tables()
 
-    for stock in event.get('stocks'):
+    # Indicators are computed for every session lacking them, that is, new sessions or all of them when one is added
+    if event.get('indicators') is not None:
+        engine.indicators = event['indicators']
+    added_indicators = engine.create_indicators_table() if engine.indicators else []
+    loaded_tickers = []
 
-        # Extract
-        extracted_ticket_data = engine.extract_data_lake(stock=stock)
+    for stock in event.get('stocks'):
 
-        if len(extracted_ticket_data) == 0:
+        # Tickers are normalized once, since Data Lake stores codes in uppercase
+        ticker = stock.get('ticket_name', '').upper()
+        if not ticker.isalnum():
+            print(f"Invalid ticket name {stock.get('ticket_name')!r}. Skipping...")
             continue
+        stock = {**stock, 'ticket_name': ticker}
+        if stock.get('optional_old_ticket_name'):
+            stock['optional_old_ticket_name'] = stock['optional_old_ticket_name'].upper()
+
+        # Only sessions that are not in the Data Warehouse yet are loaded
+        last_session = engine.get_last_loaded_session(ticker=ticker)
+
+        # Extract, either at once or streamed in chunks of sessions
+        if event.get('chunk_size'):
+            extracted_chunks = engine.extract_data_lake_chunks(
+                stock=stock,
+                since=last_session,
+                chunk_size=int(event['chunk_size'])
+            )
+        else:
+            extracted_chunks = [engine.extract_data_lake(stock=stock, since=last_session)]
+
+        first_session = None
+        for extracted_ticket_data in extracted_chunks:
+
+            if len(extracted_ticket_data) == 0:
+                continue
+
+            # Transform
+            ticket_data = engine.transform_dataframe(dataframe=extracted_ticket_data)
+
+            # Load
+            print("Uploading to Data Warehouse... ", end="")
+            engine.load_fact_table(dataframe=ticket_data, ticker=ticker)
+            print("Upload complete!")
 
-        # Transform
-        ticket_data = engine.transform_dataframe(dataframe=extracted_ticket_data)
+            # Chunks arrive ordered by session, the first one holds the earliest session
+            if first_session is None:
+                first_session = ticket_data['data_pregao'].min()
 
-        # Load
-        print("Uploading to Data Warehouse... ", end="")
-        engine.postgres.upload_data(
-            dataframe=ticket_data,
-            table_name=stock.get('ticket_name').lower()
+        # Former per ticker tables are kept as views over the fact table
+        engine.create_ticker_view(ticker=ticker)
+
+        loaded_tickers.append(ticker)
+
+        if first_session is None:
+            continue
+
+        # Rebuild only the weekly, monthly and yearly bars touched by the new sessions
+        engine.update_rollups(
+            ticker=ticker,
+            first_session=first_session
         )
-        print("Upload complete!")
+
+    # Every ticker's indicators are computed at once, including tickers not in the event when an indicator was added
+    if added_indicators:
+        loaded_tickers = list(dict.fromkeys([*loaded_tickers, *engine.get_priced_tickers()]))
+    engine.update_indicators(tickers=loaded_tickers)
+
+    # Optionally rewrite the fact table in primary key order, which pays off after large loads
+    if event.get('cluster'):
+        engine.cluster_fact_table()
+
+    engine.postgres.record_load_watermark()
+    return True
 
 
 if __name__ == "__main__":
     event = {
         "data_warehouse_schema": "data_warehouse",
         "datalake_schema": "b3_history",
+        "chunk_size": 50000,
         "stocks": [
             {
-                "ticket_name": "VALE3",
-                "optional_old_ticket_name": "VAL 3"
+                "ticket_name": "VALE3"
             },
             {
-                "ticket_name": "PETR3",
-                "optional_old_ticket_name": "PET 3"
+                "ticket_name": "PETR3"
             }
         ]
     }
@@ -0,0 +1,230 @@
+"""File containing the class that materializes technical indicators of every ticker."""
+from __future__ import annotations
+
+from src.shared.column_definitions import INDICATOR_PATTERN
+from src.shared.lazy_import import lazy_import
+
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+
+INDICATORS_TABLE = "daily_indicators"
+TRADING_SESSIONS_PER_YEAR = 252
+
+
+class IndicatorEngine:
+    """Class for keeping technical indicators of every ticker up to date, next to its daily prices."""
+
+    @property
+    def indicators(self) -> list:
+        """Access attribute value."""
+        return self._indicators
+
+    @indicators.setter
+    def indicators(self, indicators: list) -> None:
+        """Define property setter and validate indicator names, which are also column names."""
+        if not isinstance(indicators, list):
+            raise TypeError(f"Invalid type {type(indicators)} for indicators.")
+
+        invalid_indicators = [
+            indicator for indicator in indicators
+            if not isinstance(indicator, str) or not INDICATOR_PATTERN.match(indicator)
+        ]
+        if invalid_indicators:
+            raise ValueError(
+                f"Invalid indicators {invalid_indicators}. "
+                f"Expected daily_return, log_return, drawdown, sma_<window> or volatility_<window>."
+            )
+
+        self._indicators = list(dict.fromkeys(indicators))
+
+    def create_indicators_table(self) -> list:
+        """
+        Create the indicators table, and a column for each configured indicator it lacks.
+
+        Rows computed before a column was added keep their other indicators, and are filled in the next time
+        their ticker is updated. Return the added columns.
+        """
+        self.postgres.execute_statement(statement=f"""
+            CREATE TABLE IF NOT EXISTS {self.data_warehouse_schema}.{INDICATORS_TABLE} (
+                ticker TEXT NOT NULL,
+                data_pregao DATE NOT NULL,
+                running_peak DOUBLE PRECISION,
+                PRIMARY KEY (ticker, data_pregao)
+            )
+        """)
+
+        table_columns = self.postgres.get_table_columns(table_name=INDICATORS_TABLE)
+        missing_columns = [indicator for indicator in self.indicators if indicator not in table_columns]
+        for column in missing_columns:
+            # Column names have been validated against the indicator pattern
+            self.postgres.execute_statement(
+                statement=f"ALTER TABLE {self.data_warehouse_schema}.{INDICATORS_TABLE} "
+                          f"ADD COLUMN IF NOT EXISTS {column} DOUBLE PRECISION"
+            )
+
+        return missing_columns
+
+    def get_priced_tickers(self) -> list:
+        """Get every ticker in the fact table, e.g. to backfill an indicator that was just added."""
+        tickers = self.postgres.read_sql_query(
+            query=f"SELECT DISTINCT ticker FROM {self.data_warehouse_schema}.daily_prices ORDER BY ticker",
+            params={}
+        )
+        return tickers['ticker'].tolist()
+
+    def _get_missing_indicator_condition(self) -> str:
+        """
+        Build the condition telling that a session lacks some configured indicator.
+
+        Indicators are legitimately null until their window is filled, e.g. the first 19 sessions of sma_20,
+        so a null value only means the indicator was never computed past those sessions.
+        """
+        conditions = ["di.ticker IS NULL"]
+        for indicator in self.indicators:
+            match = INDICATOR_PATTERN.match(indicator)
+            if match['kind'] == "drawdown":
+                first_session_number = 0
+            elif match['kind'] is not None:
+                first_session_number = 1
+            elif match['window_kind'] == "sma":
+                first_session_number = int(match['window']) - 1
+            else:
+                first_session_number = int(match['window'])
+
+            # Column names have been validated against the indicator pattern
+            conditions.append(
+                f"(di.{indicator} IS NULL AND s.session_number >= {first_session_number} "
+                f"AND s.preco_ultimo_negocio > 0)"
+            )
+
+        return "\n                                OR ".join(conditions)
+
+    def update_indicators(self, tickers: list) -> None:
+        """
+        Compute indicators of given tickers from the first session that lacks any of them, e.g. the first new session.
+
+        Only the trailing window of sessions before the first one is read back, as context for returns and
+        rolling windows. Drawdown continues from the running peak stored for the session before.
+        Every ticker is computed at once, with vectorized rolling windows.
+        """
+        if not tickers or not self.indicators:
+            return
+
+        context_sessions = max([1, *(
+            int(INDICATOR_PATTERN.match(indicator)['window'] or 0)
+            for indicator in self.indicators
+        )])
+
+        # When the running peak of the previous session is missing, it is computed from prices
+        query = f"""
+            WITH requested AS (
+                SELECT
+                    t.ticker,
+                    (
+                        SELECT min(s.data_pregao)
+                        FROM (
+                            SELECT
+                                dp.data_pregao,
+                                dp.preco_ultimo_negocio,
+                                row_number() OVER (ORDER BY dp.data_pregao) - 1 AS session_number
+                            FROM {self.data_warehouse_schema}.daily_prices dp
+                            WHERE dp.ticker = t.ticker
+                        ) s
+                        LEFT JOIN {self.data_warehouse_schema}.{INDICATORS_TABLE} di
+                            ON di.ticker = t.ticker AND di.data_pregao = s.data_pregao
+                        WHERE {self._get_missing_indicator_condition()}
+                    ) AS first_session
+                FROM unnest(%(tickers)s::text[]) AS t (ticker)
+            )
+            SELECT
+                r.ticker,
+                s.data_pregao,
+                s.preco_ultimo_negocio,
+                s.is_new,
+                coalesce(
+                    p.running_peak,
+                    (
+                        SELECT max(dp.preco_ultimo_negocio)
+                        FROM {self.data_warehouse_schema}.daily_prices dp
+                        WHERE dp.ticker = r.ticker AND dp.data_pregao < r.first_session
+                    )
+                ) AS previous_peak
+            FROM requested r
+            CROSS JOIN LATERAL (
+                (
+                    SELECT dp.data_pregao, dp.preco_ultimo_negocio, false AS is_new
+                    FROM {self.data_warehouse_schema}.daily_prices dp
+                    WHERE dp.ticker = r.ticker AND dp.data_pregao < r.first_session
+                    ORDER BY dp.data_pregao DESC
+                    LIMIT %(context_sessions)s
+                )
+                UNION ALL
+                SELECT dp.data_pregao, dp.preco_ultimo_negocio, true AS is_new
+                FROM {self.data_warehouse_schema}.daily_prices dp
+                WHERE dp.ticker = r.ticker AND dp.data_pregao >= r.first_session
+            ) s
+            LEFT JOIN LATERAL (
+                SELECT di.running_peak
+                FROM {self.data_warehouse_schema}.{INDICATORS_TABLE} di
+                WHERE di.ticker = r.ticker AND di.data_pregao < r.first_session
+                ORDER BY di.data_pregao DESC
+                LIMIT 1
+            ) p ON true
+            ORDER BY r.ticker, s.data_pregao
+        """
+        prices = self.postgres.read_sql_query(
+            query=query,
+            params={"tickers": tickers, "context_sessions": context_sessions}
+        )
+        if prices.empty:
+            return
+
+        print(f"Computing indicators of {prices['ticker'].nunique()} tickers... ", end="")
+        indicators = self.compute_indicators(dataframe=prices, indicators=self.indicators)
+        self.postgres.bulk_upsert(
+            dataframe=indicators[prices['is_new'].astype(bool)],
+            table_name=INDICATORS_TABLE,
+            key_columns=['ticker', 'data_pregao']
+        )
+        print("Indicators updated!")
+
+    @staticmethod
+    def compute_indicators(dataframe: pd.DataFrame, indicators: list) -> pd.DataFrame:
+        """
+        Compute indicators from closing prices of a dataframe ordered by ticker and session.
+
+        Rolling windows run over the whole dataframe at once, and are discarded where they would reach
+        into the previous ticker's sessions. Volatility is the annualized deviation of daily returns.
+        """
+        dataframe = dataframe.reset_index(drop=True)
+        tickers = dataframe['ticker']
+        close = dataframe['preco_ultimo_negocio'].astype('float64')
+        session_number = dataframe.groupby('ticker').cumcount()
+
+        previous_close = close.shift(1).where(session_number > 0)
+        daily_return = close / previous_close - 1
+
+        result = dataframe[['ticker', 'data_pregao']].copy()
+        previous_peak = dataframe.get('previous_peak', pd.Series(np.nan, index=dataframe.index)).astype('float64')
+        result['running_peak'] = np.fmax(close.groupby(tickers).cummax(), previous_peak)
+
+        for indicator in indicators:
+            match = INDICATOR_PATTERN.match(indicator)
+            kind, window = match['kind'] or match['window_kind'], int(match['window'] or 0)
+
+            if kind == "daily_return":
+                result[indicator] = daily_return
+            elif kind == "log_return":
+                result[indicator] = np.log(close / previous_close)
+            elif kind == "drawdown":
+                result[indicator] = close / result['running_peak'] - 1
+            elif kind == "sma":
+                result[indicator] = close.rolling(window, min_periods=window).mean().where(
+                    session_number >= window - 1
+                )
+            elif kind == "volatility":
+                result[indicator] = daily_return.rolling(window, min_periods=window).std().where(
+                    session_number >= window
+                ) * np.sqrt(TRADING_SESSIONS_PER_YEAR)
+
+        return result
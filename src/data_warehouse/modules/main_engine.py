@@ -1,10 +1,40 @@
 """Main engine for extracting stocks data from Data Lake and uploading to Data Warehouse."""
-import pandas as pd
+from __future__ import annotations
 
+from src.data_warehouse.modules.indicator_engine import IndicatorEngine
+from src.data_warehouse.modules.rollup_engine import RollupEngine
+from src.shared.column_definitions import DEFAULT_INDICATORS, select_price
+from src.shared.lazy_import import lazy_import
 from src.shared.loading_engine import PostgresConnector
 
+pd = lazy_import("pandas")
+errors = lazy_import("psycopg2.errors")
 
-class DataWarehouseMainEngine:
+# Fact table holding every ticker's daily prices, hash partitioned by ticker
+FACT_TABLE = "daily_prices"
+FACT_TABLE_PARTITIONS = 16
+FACT_TABLE_COLUMNS = [
+    'ticker',
+    'data_pregao',
+    'codigo_negociaco_papel',
+    'nome_resumido',
+    'moeda_referencia',
+    'preco_abertura_pregao',
+    'preco_ultimo_negocio',
+    'preco_maximo_pregao',
+    'preco_minimo_pregao',
+    'numero_negocios_efetuados',
+    'volume_total_titulos_negociados',
+]
+
+# Types fixed up front when streaming extraction, avoiding per-chunk inference (and Decimal objects for volume)
+EXTRACTION_DTYPES = {
+    'numero_negocios_efetuados': 'int64',
+    'volume_total_titulos_negociados': 'float64',
+}
+
+
+class DataWarehouseMainEngine(RollupEngine, IndicatorEngine):
     """Main class for extraction ticket price data from Data Lake, and uploading it to Data Warehouse."""
 
     def __init__(self):
@@ -16,6 +46,9 @@ class DataWarehouseMainEngine:
         self._data_warehouse_schema = "data_warehouse"  # can be overwritten with event parameter
         self._datalake_schema = "b3_history"  # can be overwritten with event parameter
 
+        # Technical indicators materialized next to daily prices
+        self._indicators = list(DEFAULT_INDICATORS)  # can be overwritten with event parameter
+
     @property
     def data_warehouse_schema(self):
         """Access attribute value."""
@@ -57,53 +90,233 @@ class DataWarehouseMainEngine:
         ]):
             raise ValueError("Prohibited characters found in schema name!")
 
-    def extract_data_lake(self, stock: dict) -> pd.DataFrame:
-        """Get ticket data from Data Lake."""
-        data_lake_extraction_query = f"""
-            SELECT
-                sh.data_pregao,
-                sh.codigo_negociaco_papel,
-                sh.nome_resumido,
-                sh.moeda_referencia,
-                sh.preco_abertura_pregao,
-                sh.preco_ultimo_negocio,
-                sh.preco_maximo_pregao,
-                sh.preco_minimo_pregao
-            FROM {self.data_lake_schema}.stocks_history sh
-            WHERE sh.tipo_de_mercado = '010'
+    def create_fact_table(self) -> None:
+        """
+        Create the daily prices fact table and its partitions, if they do not exist yet.
+
+        Primary key (ticker, data_pregao) serves both single ticker and multi ticker queries.
+        """
+        partitions = "\n".join(
+            f"CREATE TABLE IF NOT EXISTS {self.data_warehouse_schema}.{FACT_TABLE}_p{remainder} "
+            f"PARTITION OF {self.data_warehouse_schema}.{FACT_TABLE} "
+            f"FOR VALUES WITH (MODULUS {FACT_TABLE_PARTITIONS}, REMAINDER {remainder});"
+            for remainder in range(FACT_TABLE_PARTITIONS)
+        )
+        statement = f"""
+            CREATE TABLE IF NOT EXISTS {self.data_warehouse_schema}.{FACT_TABLE} (
+                ticker TEXT NOT NULL,
+                data_pregao DATE NOT NULL,
+                codigo_negociaco_papel TEXT,
+                nome_resumido TEXT,
+                moeda_referencia TEXT,
+                preco_abertura_pregao DOUBLE PRECISION,
+                preco_ultimo_negocio DOUBLE PRECISION,
+                preco_maximo_pregao DOUBLE PRECISION,
+                preco_minimo_pregao DOUBLE PRECISION,
+                numero_negocios_efetuados BIGINT,
+                volume_total_titulos_negociados DOUBLE PRECISION,
+                PRIMARY KEY (ticker, data_pregao)
+            ) PARTITION BY HASH (ticker);
+            {partitions}
+        """
+        self.postgres.execute_statement(statement=statement)
+
+    def load_fact_table(self, dataframe: pd.DataFrame, ticker: str) -> None:
+        """Bulk load ticker's sessions into the fact table, replacing sessions that were already there."""
+        dataframe = dataframe.assign(ticker=ticker)
+        self.postgres.bulk_upsert(
+            dataframe=dataframe[FACT_TABLE_COLUMNS],
+            table_name=FACT_TABLE,
+            key_columns=['ticker', 'data_pregao']
+        )
+
+    def create_ticker_view(self, ticker: str) -> None:
+        """
+        Create a view named after the ticker over the fact table, for consumers of the former per ticker tables.
+
+        A former per ticker table is dropped, since its sessions are reloaded into the fact table.
+        """
+        self._validate_ticker_name(ticker=ticker)
+        view_name = ticker.lower()
+
+        if self.postgres.check_table_existence(table_name=view_name)[view_name]:
+            print(f"Replacing table {view_name} with a view over {FACT_TABLE}... ", end="")
+            self.postgres.execute_statement(statement=f"DROP TABLE {self.data_warehouse_schema}.{view_name}")
+
+        view_columns = ", ".join(column for column in FACT_TABLE_COLUMNS if column != 'ticker')
+        self.postgres.execute_statement(statement=f"""
+            CREATE OR REPLACE VIEW {self.data_warehouse_schema}.{view_name} AS
+            SELECT {view_columns}
+            FROM {self.data_warehouse_schema}.{FACT_TABLE}
+            WHERE ticker = '{ticker}'
+        """)
+
+    def cluster_fact_table(self) -> None:
+        """
+        Physically reorder the fact table by its primary key, so that each ticker's sessions are contiguous.
+
+        Partitions are clustered one at a time, on their own primary key index, since postgres cannot cluster
+        a partitioned table before version 15, nor inside a transaction block since then.
+        """
+        self.postgres.execute_autocommit(statements=[
+            *(
+                f"CLUSTER {self.data_warehouse_schema}.{FACT_TABLE}_p{remainder} "
+                f"USING {FACT_TABLE}_p{remainder}_pkey"
+                for remainder in range(FACT_TABLE_PARTITIONS)
+            ),
+            f"ANALYZE {self.data_warehouse_schema}.{FACT_TABLE}",
+        ])
+
+    def get_last_loaded_session(self, ticker: str):
+        """Get the last session of given ticker already loaded into the fact table, or None if there is none."""
+        query = f"""
+            SELECT max(dp.data_pregao) AS last_session
+            FROM {self.data_warehouse_schema}.{FACT_TABLE} dp
+            WHERE dp.ticker = %(ticker)s
+        """
+        last_session = self.postgres.read_sql_query(query=query, params={"ticker": ticker})
+        return last_session['last_session'].iloc[0]
+
+    @staticmethod
+    def _validate_ticker_name(ticker: str) -> None:
+        """Validate ticker name, which names its view, in order to avoid SQL injection."""
+        if not isinstance(ticker, str) or not ticker.isalnum():
+            raise ValueError("Prohibited characters found in ticker name!")
+
+    def extract_data_lake(self, stock: dict, since=None) -> pd.DataFrame:
         """
+        Get ticket data from Data Lake, optionally only the sessions after a given date.
 
+        Every code that shared an ISIN with the ticker (e.g. "PET 3" for PETR3) is resolved through
+        the ticker lineage table, within the dates each code was in use.
+        """
         if not stock.get('ticket_name'):
             print('Main ticket name is mandatory. Skipping...')
             return pd.DataFrame()
 
-        if stock.get('optional_old_ticket_name'):
-            query_conditional = """
-                AND (
-                    sh.codigo_negociaco_papel = %(ticket_name)s
-                    OR sh.codigo_negociaco_papel = %(old_ticket_name)s
-                )
-            """
-            query_parameters = {
-                "ticket_name": stock.get('ticket_name'),
-                "old_ticket_name": stock.get('optional_old_ticket_name')
-            }
-        else:
-            query_conditional = """
-                AND sh.codigo_negociaco_papel = %(ticket_name)s
-            """
-            query_parameters = {
-                "ticket_name": stock.get('ticket_name'),
-            }
+        lineage_query, fallback_query, query_parameters = self._build_extraction_queries(stock=stock, since=since)
 
         print(f"Extracting {stock.get('ticket_name')} from Data Lake... ", end="")
-        extracted_ticket_data = self.postgres.read_sql_query(
-            query=data_lake_extraction_query+query_conditional,
-            params=query_parameters
-        )
+        try:
+            extracted_ticket_data = self.postgres.read_sql_query(
+                query=lineage_query,
+                params=query_parameters
+            )
+        except errors.UndefinedTable:
+            # Data lake loaded before ticker lineage existed, rely on manually informed old ticker instead
+            extracted_ticket_data = self.postgres.read_sql_query(
+                query=fallback_query,
+                params=query_parameters
+            )
         print("Extraction complete!")
         return extracted_ticket_data
 
+    def extract_data_lake_chunks(self, stock: dict, since=None, chunk_size: int = 50000):
+        """
+        Yield ticket data from Data Lake in chunks of at most chunk_size sessions, ordered by session.
+
+        Rows are streamed through a server-side cursor, so each chunk can be transformed and uploaded
+        before the next one is fetched.
+        """
+        if not stock.get('ticket_name'):
+            print('Main ticket name is mandatory. Skipping...')
+            return
+
+        lineage_query, fallback_query, query_parameters = self._build_extraction_queries(stock=stock, since=since)
+
+        print(f"Streaming {stock.get('ticket_name')} from Data Lake...")
+        try:
+            yield from self.postgres.read_sql_query_chunks(
+                query=lineage_query,
+                params=query_parameters,
+                chunk_size=chunk_size,
+                dtypes=EXTRACTION_DTYPES
+            )
+        except errors.UndefinedTable:
+            # Raised when the query is executed, that is, before any chunk is yielded
+            yield from self.postgres.read_sql_query_chunks(
+                query=fallback_query,
+                params=query_parameters,
+                chunk_size=chunk_size,
+                dtypes=EXTRACTION_DTYPES
+            )
+
+    def _build_extraction_queries(self, stock: dict, since=None) -> tuple:
+        """
+        Build the lineage based query, the old ticker based fallback query, and their parameters.
+
+        Data Warehouse keeps prices and volume in reais, so those that Data Lake stores as integer cents are converted here.
+        """
+        price_columns = ['preco_abertura_pregao', 'preco_ultimo_negocio', 'preco_maximo_pregao', 'preco_minimo_pregao']
+        column_types = self._get_data_lake_column_types()
+        selected_prices = ",\n                ".join(
+            f"{select_price('sh', column, column_types.get(column))} AS {column}"
+            for column in price_columns
+        )
+        selected_volume = select_price('sh', 'volume_total_titulos_negociados',
+                                       column_types.get('volume_total_titulos_negociados'))
+        selected_columns = f"""
+                sh.data_pregao,
+                sh.codigo_negociaco_papel,
+                sh.nome_resumido,
+                sh.moeda_referencia,
+                {selected_prices},
+                sh.numero_negocios_efetuados,
+                {selected_volume} AS volume_total_titulos_negociados
+        """
+        since_conditional = "AND sh.data_pregao > %(since)s" if since is not None else ""
+        query_parameters = {
+            "ticket_name": stock.get('ticket_name'),
+            "old_ticket_name": stock.get('optional_old_ticket_name') or stock.get('ticket_name'),
+            "since": since
+        }
+
+        # When two codes of the same ISIN traded in one session, the requested ticker prevails
+        lineage_query = f"""
+            WITH lineage AS (
+                SELECT tl.codigo_negociaco_papel, tl.first_session, tl.last_session
+                FROM {self.data_lake_schema}.ticker_lineage tl
+                WHERE tl.tipo_de_mercado = '010'
+                    AND tl.codigo_papel_isin IN (
+                        SELECT ti.codigo_papel_isin
+                        FROM {self.data_lake_schema}.ticker_lineage ti
+                        WHERE ti.codigo_negociaco_papel = %(ticket_name)s
+                            AND ti.tipo_de_mercado = '010'
+                    )
+                UNION
+                SELECT %(ticket_name)s, '-infinity'::date, 'infinity'::date
+            )
+            SELECT DISTINCT ON (sh.data_pregao)
+                {selected_columns}
+            FROM {self.data_lake_schema}.stocks_history sh
+            JOIN lineage l
+                ON sh.codigo_negociaco_papel = l.codigo_negociaco_papel
+                AND sh.data_pregao BETWEEN l.first_session AND l.last_session
+            WHERE sh.tipo_de_mercado = '010'
+                {since_conditional}
+            ORDER BY sh.data_pregao, sh.codigo_negociaco_papel = %(ticket_name)s DESC
+        """
+
+        fallback_query = f"""
+            SELECT {selected_columns}
+            FROM {self.data_lake_schema}.stocks_history sh
+            WHERE sh.tipo_de_mercado = '010'
+                AND sh.codigo_negociaco_papel IN (%(ticket_name)s, %(old_ticket_name)s)
+                {since_conditional}
+            ORDER BY sh.data_pregao
+        """
+
+        return lineage_query, fallback_query, query_parameters
+
+    def _get_data_lake_column_types(self) -> dict:
+        """Map the columns of Data Lake's stocks history to their types, and return to Data Warehouse schema."""
+        data_warehouse_schema = self.postgres.schema
+        self.postgres.schema = self.data_lake_schema
+        column_types = self.postgres.get_column_types(table_name="stocks_history")
+        self.postgres.schema = data_warehouse_schema
+
+        return column_types
+
     @staticmethod
     def transform_dataframe(dataframe: pd.DataFrame) -> pd.DataFrame:
         """Order dataframe values by date."""
@@ -0,0 +1,202 @@
+"""File containing the class that maintains and reads pre-aggregated OHLC tables."""
+from __future__ import annotations
+
+from calendar import monthrange
+from datetime import date
+
+from src.shared.lazy_import import lazy_import
+
+pd = lazy_import("pandas")
+
+# Rollup tables ordered from the coarsest to the finest, keyed by the postgres date_trunc field that builds them
+ROLLUP_TABLES = {
+    "year": "ohlc_yearly",
+    "month": "ohlc_monthly",
+    "week": "ohlc_weekly",
+}
+
+# Resolutions that each stored period can be further aggregated into
+COMPATIBLE_RESOLUTIONS = {
+    "year": ["year"],
+    "month": ["month", "quarter", "year"],
+    "week": ["week"],
+    "day": ["day", "week", "month", "quarter", "year"],
+}
+
+PANDAS_PERIODS = {
+    "week": "W-SUN",
+    "month": "M",
+    "quarter": "Q",
+    "year": "Y",
+}
+
+
+class RollupEngine:
+    """Class for keeping weekly, monthly and yearly OHLC bars of every ticker up to date."""
+
+    def create_rollup_tables(self) -> None:
+        """Create rollup tables inside data warehouse schema, if they do not exist yet."""
+        for rollup_table in ROLLUP_TABLES.values():
+            statement = f"""
+                CREATE TABLE IF NOT EXISTS {self.data_warehouse_schema}.{rollup_table} (
+                    ticker TEXT NOT NULL,
+                    period_start DATE NOT NULL,
+                    last_session DATE NOT NULL,
+                    preco_abertura_pregao DOUBLE PRECISION,
+                    preco_maximo_pregao DOUBLE PRECISION,
+                    preco_minimo_pregao DOUBLE PRECISION,
+                    preco_ultimo_negocio DOUBLE PRECISION,
+                    volume_total_titulos_negociados NUMERIC,
+                    numero_negocios_efetuados BIGINT,
+                    numero_pregoes INTEGER,
+                    PRIMARY KEY (ticker, period_start)
+                )
+            """
+            self.postgres.execute_statement(statement=statement)
+
+    def update_rollups(self, ticker: str, first_session: date) -> None:
+        """
+        Rebuild the rollup periods of given ticker touched by sessions loaded from first_session on.
+
+        Periods are recomputed from the daily prices fact table, hence a period that was only partially loaded before
+        (e.g. the current week) gets its remaining sessions without any rollup being read back.
+        """
+        for period, rollup_table in ROLLUP_TABLES.items():
+            # Table names come from validated schema names and from the rollup dictionary above
+            statement = f"""
+                DELETE FROM {self.data_warehouse_schema}.{rollup_table}
+                WHERE ticker = %(ticker)s
+                    AND period_start >= date_trunc('{period}', %(first_session)s::date)::date;
+
+                INSERT INTO {self.data_warehouse_schema}.{rollup_table}
+                SELECT
+                    %(ticker)s AS ticker,
+                    date_trunc('{period}', dw.data_pregao)::date AS period_start,
+                    max(dw.data_pregao) AS last_session,
+                    (array_agg(dw.preco_abertura_pregao ORDER BY dw.data_pregao))[1] AS preco_abertura_pregao,
+                    max(dw.preco_maximo_pregao) AS preco_maximo_pregao,
+                    min(dw.preco_minimo_pregao) AS preco_minimo_pregao,
+                    (array_agg(dw.preco_ultimo_negocio ORDER BY dw.data_pregao DESC))[1] AS preco_ultimo_negocio,
+                    sum(dw.volume_total_titulos_negociados) AS volume_total_titulos_negociados,
+                    sum(dw.numero_negocios_efetuados) AS numero_negocios_efetuados,
+                    count(*) AS numero_pregoes
+                FROM {self.data_warehouse_schema}.daily_prices dw
+                WHERE dw.ticker = %(ticker)s
+                    AND dw.data_pregao >= date_trunc('{period}', %(first_session)s::date)::date
+                GROUP BY 2;
+            """
+            self.postgres.execute_statement(
+                statement=statement,
+                params={"ticker": ticker, "first_session": first_session}
+            )
+
+    def read_ohlc(self, ticker: str, resolution: str = "day", start: date = None, end: date = None) -> pd.DataFrame:
+        """
+        Get OHLC bars of given ticker at the requested resolution (day, week, month, quarter or year).
+
+        Bars are read from the coarsest stored table whose periods fit both the resolution and the date range,
+        and aggregated further in pandas when needed (e.g. quarters are built from monthly bars).
+        A range that does not start and end at period boundaries falls back to finer tables,
+        so that no session outside of it is counted.
+        """
+        if resolution not in PANDAS_PERIODS and resolution != "day":
+            raise ValueError(f"Invalid resolution {resolution}. Expected one of day, week, month, quarter or year.")
+
+        stored_period = self._choose_stored_period(resolution=resolution, start=start, end=end)
+        dataframe = self._read_stored_period(ticker=ticker, period=stored_period, start=start, end=end)
+
+        if stored_period == resolution or dataframe.empty:
+            return dataframe
+
+        return self._aggregate_bars(dataframe=dataframe, resolution=resolution)
+
+    @staticmethod
+    def _choose_stored_period(resolution: str, start: date, end: date) -> str:
+        """Pick the coarsest stored period that can build the requested resolution within date range."""
+        for period in [*ROLLUP_TABLES, "day"]:
+            if resolution not in COMPATIBLE_RESOLUTIONS[period]:
+                continue
+
+            if period == "day" or RollupEngine._is_aligned(period=period, start=start, end=end):
+                return period
+
+    @staticmethod
+    def _is_aligned(period: str, start: date, end: date) -> bool:
+        """Check whether date range starts at the beginning and ends at the end of given period."""
+        if start is not None:
+            if period == "year" and (start.month, start.day) != (1, 1):
+                return False
+            if period == "month" and start.day != 1:
+                return False
+            if period == "week" and start.weekday() != 0:
+                return False
+
+        if end is not None:
+            if period == "year" and (end.month, end.day) != (12, 31):
+                return False
+            if period == "month" and end.day != monthrange(end.year, end.month)[1]:
+                return False
+            if period == "week" and end.weekday() != 6:
+                return False
+
+        return True
+
+    def _read_stored_period(self, ticker: str, period: str, start: date, end: date) -> pd.DataFrame:
+        """Read bars from the daily prices fact table or from a rollup table."""
+        if period == "day":
+            query = f"""
+                SELECT
+                    dw.data_pregao AS period_start,
+                    dw.data_pregao AS last_session,
+                    dw.preco_abertura_pregao,
+                    dw.preco_maximo_pregao,
+                    dw.preco_minimo_pregao,
+                    dw.preco_ultimo_negocio,
+                    dw.volume_total_titulos_negociados,
+                    dw.numero_negocios_efetuados,
+                    1 AS numero_pregoes
+                FROM {self.data_warehouse_schema}.daily_prices dw
+                WHERE dw.ticker = %(ticker)s
+            """
+            date_column = "dw.data_pregao"
+        else:
+            query = f"""
+                SELECT
+                    r.period_start,
+                    r.last_session,
+                    r.preco_abertura_pregao,
+                    r.preco_maximo_pregao,
+                    r.preco_minimo_pregao,
+                    r.preco_ultimo_negocio,
+                    r.volume_total_titulos_negociados,
+                    r.numero_negocios_efetuados,
+                    r.numero_pregoes
+                FROM {self.data_warehouse_schema}.{ROLLUP_TABLES[period]} r
+                WHERE r.ticker = %(ticker)s
+            """
+            date_column = "r.period_start"
+
+        if start is not None:
+            query += f" AND {date_column} >= %(start)s"
+        if end is not None:
+            query += f" AND {date_column} <= %(end)s"
+
+        return self.postgres.read_sql_query(
+            query=query + f" ORDER BY {date_column}",
+            params={"ticker": ticker, "start": start, "end": end}
+        )
+
+    @staticmethod
+    def _aggregate_bars(dataframe: pd.DataFrame, resolution: str) -> pd.DataFrame:
+        """Aggregate finer bars into coarser ones, with vectorized group by."""
+        period_start = pd.to_datetime(dataframe['period_start']).dt.to_period(PANDAS_PERIODS[resolution])
+        return dataframe.groupby(period_start.dt.start_time.dt.date.rename('period_start')).agg(
+            last_session=('last_session', 'max'),
+            preco_abertura_pregao=('preco_abertura_pregao', 'first'),
+            preco_maximo_pregao=('preco_maximo_pregao', 'max'),
+            preco_minimo_pregao=('preco_minimo_pregao', 'min'),
+            preco_ultimo_negocio=('preco_ultimo_negocio', 'last'),
+            volume_total_titulos_negociados=('volume_total_titulos_negociados', 'sum'),
+            numero_negocios_efetuados=('numero_negocios_efetuados', 'sum'),
+            numero_pregoes=('numero_pregoes', 'sum'),
+        ).reset_index()
@@ -0,0 +1,250 @@
+"""
+File for running every app as a dependency graph, from B3 files to figures.
+
+Each data lake file, Data Warehouse ticker and Yahoo Finance ticker is a node of its own, so independent ones
+run concurrently and a node is only run again once its inputs change, e.g. a new version of a COTAHIST file.
+"""
+import hashlib
+import os
+from datetime import date
+
+from src.orchestrator.modules.dag_engine import DagEngine, DagNode
+from src.shared.lazy_import import lazy_import
+from src.shared.loading_engine import PostgresConnector
+
+extraction_engine = lazy_import("src.b3_history.modules.extraction_engine")
+
+ROOT_PATH = os.path.abspath(os.path.join(__file__, os.pardir))
+STATE_PATH = ROOT_PATH + '/resources/dag_state.json'
+
+
+def lambda_handler(event: dict) -> dict:
+    """Build the graph of apps described by the event, run whatever is not up to date and return node statuses."""
+    engine = DagEngine(
+        state_path=event.get('state_path', STATE_PATH),
+        workers=int(event.get('workers', 1)),
+        force=bool(event.get('force', False))
+    )
+
+    data_lake_nodes = _add_data_lake_nodes(engine=engine, b3_event=event.get('b3_history'))
+    data_warehouse_nodes = _add_data_warehouse_nodes(
+        engine=engine,
+        data_warehouse_event=event.get('data_warehouse'),
+        upstream=data_lake_nodes
+    )
+    yahoo_nodes = _add_yahoo_finance_nodes(engine=engine, yahoo_event=event.get('yahoo_finance'))
+
+    # Reconciliation and figures read both the Data Warehouse and Yahoo Finance schemas
+    if event.get('reconciliation') is not None:
+        reconciliation_event = event['reconciliation']
+        engine.add_node(DagNode(
+            name="reconciliation",
+            module_name="src.data_visualization.reconciliation",
+            function_name="lambda_handler",
+            event=reconciliation_event,
+            upstream=data_warehouse_nodes + yahoo_nodes,
+            inputs=_get_outside_inputs(
+                upstream=data_warehouse_nodes,
+                schema=reconciliation_event.get('data_warehouse_schema', 'data_warehouse')
+            )
+        ))
+
+    if event.get('figures'):
+        engine.add_node(DagNode(
+            name="figures",
+            module_name="src.data_visualization.plot_generator",
+            function_name="lambda_handler",
+            upstream=data_warehouse_nodes + yahoo_nodes,
+            inputs=_get_outside_inputs(upstream=data_warehouse_nodes, schema='data_warehouse')
+        ))
+
+    statuses = engine.run()
+    print(
+        "Orchestration complete! " + ", ".join(
+            f"{status}: {list(statuses.values()).count(status)}"
+            for status in ["done", "skipped", "failed", "blocked"]
+        )
+    )
+    return statuses
+
+
+def _add_data_lake_nodes(engine: DagEngine, b3_event: dict) -> list:
+    """
+    Add a node per COTAHIST file, between a schema setup node and a node refreshing the stocks history view.
+
+    Files loaded into the same yearly table run one after the other, in event order,
+    since a file replaces the sessions of its period and a later file (e.g. a daily one) must land on top.
+    """
+    if not b3_event:
+        return []
+
+    options = {key: value for key, value in b3_event.items() if key != 'files_to_run'}
+    setup_node = engine.add_node(DagNode(
+        name="data_lake_setup",
+        module_name="src.b3_history.app",
+        function_name="lambda_handler",
+        event={**options, 'files_to_run': [], 'refresh_view': False}
+    ))
+
+    files_path = extraction_engine.ROOT_PATH + extraction_engine.RESOURCES_PATH
+    file_nodes = []
+    last_node_of_table = {}
+    for file_name in b3_event.get('files_to_run', []):
+        table_key = _get_yearly_table_key(file_name=file_name)
+        upstream = [setup_node.name]
+        if table_key in last_node_of_table:
+            upstream.append(last_node_of_table[table_key])
+
+        file_node = engine.add_node(DagNode(
+            name=f"data_lake_file:{file_name}",
+            module_name="src.b3_history.app",
+            function_name="lambda_handler",
+            event={**options, 'files_to_run': [file_name], 'refresh_view': False},
+            upstream=upstream,
+            inputs={"file_hash": _hash_file(file_path=files_path + file_name)}
+        ))
+        last_node_of_table[table_key] = file_node.name
+        file_nodes.append(file_node.name)
+
+    view_node = engine.add_node(DagNode(
+        name="data_lake_view",
+        module_name="src.b3_history.app",
+        function_name="lambda_handler",
+        event={**options, 'files_to_run': [], 'refresh_view': True},
+        upstream=file_nodes or [setup_node.name]
+    ))
+    return [view_node.name]
+
+
+def _add_data_warehouse_nodes(engine: DagEngine, data_warehouse_event: dict, upstream: list) -> list:
+    """Add a node per ticker after a schema setup node, and optionally a node clustering the fact table."""
+    if not data_warehouse_event:
+        return []
+
+    options = {key: value for key, value in data_warehouse_event.items() if key not in ['stocks', 'cluster']}
+    setup_node = engine.add_node(DagNode(
+        name="data_warehouse_setup",
+        module_name="src.data_warehouse.app",
+        function_name="lambda_function",
+        event={**options, 'stocks': []},
+        upstream=upstream,
+        inputs=_get_outside_inputs(upstream=upstream, schema=options.get('datalake_schema', 'b3_history'))
+    ))
+
+    ticker_nodes = []
+    for stock in data_warehouse_event.get('stocks', []):
+        ticker_node = engine.add_node(DagNode(
+            name=f"data_warehouse_ticker:{stock.get('ticket_name', '').upper()}",
+            module_name="src.data_warehouse.app",
+            function_name="lambda_function",
+            event={**options, 'stocks': [stock]},
+            upstream=[setup_node.name]
+        ))
+        ticker_nodes.append(ticker_node.name)
+
+    if data_warehouse_event.get('cluster'):
+        cluster_node = engine.add_node(DagNode(
+            name="data_warehouse_cluster",
+            module_name="src.data_warehouse.app",
+            function_name="lambda_function",
+            event={**options, 'stocks': [], 'cluster': True},
+            upstream=ticker_nodes or [setup_node.name]
+        ))
+        return [cluster_node.name]
+
+    return ticker_nodes or [setup_node.name]
+
+
+def _add_yahoo_finance_nodes(engine: DagEngine, yahoo_event: dict) -> list:
+    """Add a node per Yahoo Finance ticker, downloaded again once a day."""
+    if not yahoo_event:
+        return []
+
+    setup_node = engine.add_node(DagNode(
+        name="yahoo_finance_setup",
+        module_name="src.data_visualization.yahoo_finance",
+        function_name="lambda_handler",
+        event={'stocks': []}
+    ))
+
+    ticker_nodes = []
+    for stock in yahoo_event.get('stocks', []):
+        ticker_node = engine.add_node(DagNode(
+            name=f"yahoo_finance_ticker:{stock}",
+            module_name="src.data_visualization.yahoo_finance",
+            function_name="lambda_handler",
+            event={'stocks': [stock]},
+            upstream=[setup_node.name],
+            inputs={"download_date": date.today().isoformat()}
+        ))
+        ticker_nodes.append(ticker_node.name)
+
+    return ticker_nodes or [setup_node.name]
+
+
+def _get_outside_inputs(upstream: list, schema: str) -> dict:
+    """When the schema a node reads is not loaded inside the graph, track its last load instead."""
+    if upstream:
+        return {}
+
+    return {"load_watermark": PostgresConnector(schema=schema).get_load_watermark()}
+
+
+def _get_yearly_table_key(file_name: str) -> str:
+    """Get the year of the table a COTAHIST file is loaded into, or the file name itself if it is unrecognized."""
+    match = extraction_engine.FILE_NAME_PATTERN.match(os.path.basename(file_name))
+    if not match:
+        return file_name
+
+    return match['year'] or match['month_year'] or match['day_year']
+
+
+def _hash_file(file_path: str) -> str:
+    """Hash file content, so that a file published again by B3 is loaded again. Missing files hash to None."""
+    if not os.path.exists(file_path):
+        return None
+
+    file_hash = hashlib.blake2b(digest_size=16)
+    with open(file_path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            file_hash.update(block)
+
+    return file_hash.hexdigest()
+
+
+if __name__ == "__main__":
+    event = {
+        "workers": 4,
+        "b3_history": {
+            "schema": "b3_history",
+            "batch_size": 5000,
+            "files_to_run": [
+                "COTAHIST_A2022.zip",
+                "COTAHIST_A2023.zip",
+            ]
+        },
+        "data_warehouse": {
+            "data_warehouse_schema": "data_warehouse",
+            "datalake_schema": "b3_history",
+            "stocks": [
+                {
+                    "ticket_name": "VALE3"
+                },
+                {
+                    "ticket_name": "PETR3"
+                }
+            ]
+        },
+        "yahoo_finance": {
+            "stocks": [
+                "PETR3.SA",
+                "VALE3.SA"
+            ]
+        },
+        "reconciliation": {
+            "data_warehouse_schema": "data_warehouse",
+            "yahoo_schema": "yahoo_finance"
+        },
+        "figures": True
+    }
+    lambda_handler(event=event)
@@ -0,0 +1,202 @@
+"""File containing the engine that runs app handlers as a dependency graph."""
+from __future__ import annotations
+
+import hashlib
+import importlib
+import json
+import os
+
+from src.shared.lazy_import import lazy_import
+
+futures = lazy_import("concurrent.futures")
+traceback = lazy_import("traceback")
+
+
+def run_node_handler(module_name: str, function_name: str, event: dict = None) -> None:
+    """
+    Import an app and call its handler, meant to run inside a worker process.
+
+    Handlers that stop without doing their work, e.g. for lack of privileges, return False rather than raise,
+    so that they can still be invoked on their own. Under the graph, this is a failure.
+    """
+    handler = getattr(importlib.import_module(module_name), function_name)
+    completed = handler() if event is None else handler(event=event)
+    if completed is False:
+        raise RuntimeError(f"{module_name}.{function_name} stopped before completing its work.")
+
+
+class DagNode:
+    """Node of the graph: an app handler called with its event, once the nodes it depends on are done."""
+
+    def __init__(
+            self,
+            name: str,
+            module_name: str,
+            function_name: str,
+            event: dict = None,
+            upstream: list = None,
+            inputs: dict = None
+    ) -> None:
+        """Initialize the constructor."""
+        self.name = name
+        self.module_name = module_name
+        self.function_name = function_name
+        self.event = event
+        self.upstream = list(upstream or [])
+
+        # Whatever the handler reads besides its event, e.g. the hash of a file to be loaded
+        self.inputs = inputs or {}
+
+
+class DagEngine:
+    """
+    Class for running app handlers as a dependency graph.
+
+    A node's fingerprint hashes its handler, event and inputs, along with the fingerprints of its upstream nodes.
+    Nodes whose fingerprint matches the one stored after their last successful run are skipped, and nodes
+    whose upstream nodes are all done run concurrently in worker processes, within the worker budget.
+    """
+
+    def __init__(self, state_path: str, workers: int = 1, force: bool = False) -> None:
+        """Initialize the constructor."""
+        self.nodes = {}
+        self.fingerprints = {}
+        self.state_path = state_path
+        self.force = force
+        self._workers = 1
+        self.workers = workers
+
+    @property
+    def workers(self) -> int:
+        """Access attribute value."""
+        return self._workers
+
+    @workers.setter
+    def workers(self, value: int) -> None:
+        """Define property setter and validate the number of worker processes."""
+        if not isinstance(value, int):
+            raise TypeError(f"Invalid type {type(value)} for workers.")
+        if value < 1:
+            raise ValueError("At least one worker is needed.")
+
+        self._workers = value
+
+    def add_node(self, node: DagNode) -> DagNode:
+        """Add node to the graph, after the nodes it depends on."""
+        if node.name in self.nodes:
+            raise ValueError(f"Node {node.name} was already added.")
+
+        missing_upstream = [name for name in node.upstream if name not in self.nodes]
+        if missing_upstream:
+            raise ValueError(f"Node {node.name} depends on unknown nodes {missing_upstream}.")
+
+        self.nodes[node.name] = node
+        return node
+
+    def compute_fingerprints(self) -> dict:
+        """Fingerprint every node, upstream nodes first. Nodes are added after their upstream ones, so in order."""
+        for name, node in self.nodes.items():
+            payload = json.dumps(
+                {
+                    "handler": f"{node.module_name}.{node.function_name}",
+                    "event": node.event,
+                    "inputs": node.inputs,
+                    "upstream": {upstream: self.fingerprints[upstream] for upstream in node.upstream},
+                },
+                sort_keys=True,
+                default=str
+            )
+            self.fingerprints[name] = hashlib.blake2b(payload.encode(), digest_size=16).hexdigest()
+
+        return self.fingerprints
+
+    def run(self) -> dict:
+        """
+        Run every node that is not up to date, and return the status of each one.
+
+        Statuses are done, skipped (up to date), failed, or blocked (an upstream node failed).
+        A failure does not stop independent nodes, and fingerprints are stored as soon as each node is done.
+        """
+        self.compute_fingerprints()
+        state = self._read_state()
+        statuses = {}
+        running = {}
+
+        executor = futures.ProcessPoolExecutor(max_workers=self.workers) if self.workers > 1 else None
+        try:
+            while len(statuses) < len(self.nodes):
+                for name, node in self.nodes.items():
+                    if name in statuses or name in running.values():
+                        continue
+
+                    upstream_statuses = [statuses.get(upstream) for upstream in node.upstream]
+                    if any(status in ["failed", "blocked"] for status in upstream_statuses):
+                        print(f"Blocking {name}, since a node it depends on failed.")
+                        statuses[name] = "blocked"
+                        continue
+
+                    if not all(status in ["done", "skipped"] for status in upstream_statuses):
+                        continue
+
+                    if not self.force and state.get(name) == self.fingerprints[name]:
+                        print(f"Skipping {name}, its inputs did not change.")
+                        statuses[name] = "skipped"
+                        continue
+
+                    if executor is None:
+                        print(f"Running {name}...")
+                        statuses[name] = self._run_inline(node=node, state=state)
+
+                    elif len(running) < self.workers:
+                        print(f"Running {name}...")
+                        future = executor.submit(run_node_handler, node.module_name, node.function_name, node.event)
+                        running[future] = name
+
+                if running:
+                    finished_futures, _ = futures.wait(running, return_when=futures.FIRST_COMPLETED)
+                    for future in finished_futures:
+                        name = running.pop(future)
+                        statuses[name] = self._record_result(name=name, error=future.exception(), state=state)
+
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        return statuses
+
+    def _run_inline(self, node: DagNode, state: dict) -> str:
+        """Run node inside current process, when there is a single worker."""
+        try:
+            run_node_handler(module_name=node.module_name, function_name=node.function_name, event=node.event)
+        except Exception as error:
+            traceback.print_exc()
+            return self._record_result(name=node.name, error=error, state=state)
+
+        return self._record_result(name=node.name, error=None, state=state)
+
+    def _record_result(self, name: str, error: BaseException, state: dict) -> str:
+        """Store the fingerprint of a node that is done, so that it is skipped until its inputs change."""
+        if error is not None:
+            print(f"Node {name} failed: {error!r}")
+            return "failed"
+
+        state[name] = self.fingerprints[name]
+        self._write_state(state=state)
+        print(f"Node {name} done!")
+        return "done"
+
+    def _read_state(self) -> dict:
+        """Read the fingerprints of the last successful run of each node."""
+        if not os.path.exists(self.state_path):
+            return {}
+
+        with open(self.state_path) as state_file:
+            return json.load(state_file)
+
+    def _write_state(self, state: dict) -> None:
+        """Write node fingerprints, replacing the state file at once so that an interruption cannot corrupt it."""
+        os.makedirs(os.path.dirname(self.state_path) or ".", exist_ok=True)
+        temporary_path = self.state_path + ".tmp"
+        with open(temporary_path, "w") as state_file:
+            json.dump(state, state_file, indent=2, sort_keys=True)
+        os.replace(temporary_path, self.state_path)
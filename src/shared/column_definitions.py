@@ -0,0 +1,54 @@
+"""File containing the column definitions shared by Data Lake, Data Warehouse and their readers."""
+import re
+
+# B3 market types of options, which Data Lake keeps apart from spot and forward records
+OPTION_MARKET_TYPES = {
+    "070": "call",
+    "080": "put",
+}
+
+# B3 quotes these prices, along with the traded volume, as integer cents, which are kept as such when loading cents
+CENTS_PRICE_COLUMNS = [
+    'preco_abertura_pregao',
+    'preco_maximo_pregao',
+    'preco_minimo_pregao',
+    'preco_medio_pregao',
+    'preco_ultimo_negocio',
+    'preco_melhor_oferta_compra',
+    'preco_melhor_oferta_venda',
+    'preco_exercicio_opcoes',
+    'preco_exercicio_pontos_opcoes',
+    'volume_total_titulos_negociados',
+]
+
+# Postgres type of prices kept as integer cents, which readers convert back to reais
+PRICE_CENTS_TYPE = "bigint"
+
+# Technical indicators, whose names are also the columns of the indicators table
+DEFAULT_INDICATORS = [
+    "daily_return",
+    "log_return",
+    "sma_20",
+    "sma_50",
+    "sma_200",
+    "volatility_20",
+    "drawdown",
+]
+
+# Indicators are either fixed (e.g. drawdown) or computed over a window of sessions (e.g. sma_20)
+INDICATOR_PATTERN = re.compile(
+    r"^(?:(?P<kind>daily_return|log_return|drawdown)|(?P<window_kind>sma|volatility)_(?P<window>[1-9]\d{0,3}))$"
+)
+
+
+def select_price(table_alias: str, column: str, column_type: str) -> str:
+    """
+    Select a column, converting prices that Data Lake keeps as integer cents back to reais.
+
+    Other integer columns, e.g. numero_negocios_efetuados, share the price type and are selected as they are.
+    """
+    expression = f"{table_alias}.{column}"
+    if column in CENTS_PRICE_COLUMNS and column_type == PRICE_CENTS_TYPE:
+        return f"{expression}::double precision / 100"
+
+    return expression
@@ -0,0 +1,24 @@
+"""File containing a helper for postponing heavy imports until they are actually needed."""
+import importlib
+import types
+
+
+class LazyModule(types.ModuleType):
+    """Module placeholder that imports the real module on its first attribute access."""
+
+    def __getattr__(self, attribute: str):
+        """Import the real module, cache its namespace and return the requested attribute."""
+        module = importlib.import_module(self.__name__)
+        self.__dict__.update(module.__dict__)
+        return getattr(module, attribute)
+
+
+def lazy_import(module_name: str) -> types.ModuleType:
+    """
+    Return a placeholder for given module, which will only be imported when first used.
+
+    Lambda handlers pay for every import at cold start, even on invocations that exit early.
+    Annotations referencing lazy modules must not be evaluated at import time,
+    hence modules using this helper should also import annotations from __future__.
+    """
+    return LazyModule(module_name)
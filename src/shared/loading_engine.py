@@ -1,11 +1,31 @@
 """File containing methods for Postgres."""
+from __future__ import annotations
+
 import os
+import re
+import uuid
+from io import StringIO
+
+from src.shared.lazy_import import lazy_import
+
+# Heavy dependencies are only imported by the methods that need them, keeping handlers' cold start short
+pd = lazy_import("pandas")
+psycopg2 = lazy_import("psycopg2")
+errors = lazy_import("psycopg2.errors")
+sql = lazy_import("psycopg2.sql")
+sqlalchemy = lazy_import("sqlalchemy")
+sqlalchemy_exc = lazy_import("sqlalchemy.exc")
 
-import pandas as pd
-import psycopg2
-from psycopg2 import sql
-from sqlalchemy import create_engine
-from sqlalchemy.exc import ProgrammingError
+# Kinds of pg_class relations kept in the catalog cache, partitioned tables being tables to their readers
+RELATION_KINDS = {
+    'r': "table",
+    'p': "table",
+    'v': "view",
+    'm': "materialized_view",
+}
+
+# Statements that change the catalog, at the beginning of any statement of a script
+DDL_PATTERN = re.compile(r"(?:^|;)\s*(?:CREATE|DROP|ALTER)\b", re.IGNORECASE)
 
 
 class PostgresConnector:
@@ -29,9 +49,16 @@ class PostgresConnector:
         self.connection = None
         self.engine = None
 
+        # Catalog of each schema, read at once on the first existence or type check
+        self._catalogs = {}
+
     def _connect_to_database(self) -> None:
-        """Connect to Postgres server."""
-        self.connection = psycopg2.connect(
+        """Connect to Postgres server through psycopg2, which is enough for catalog checks and DDL."""
+        self.connection = self._open_connection()
+
+    def _open_connection(self):
+        """Open a psycopg2 connection of its own, which callers are responsible for closing."""
+        return psycopg2.connect(
             database=self.database,
             host=self.host,
             port=self.port,
@@ -39,7 +66,9 @@ class PostgresConnector:
             password=self.password,
         )
 
-        self.engine = create_engine(
+    def _create_engine(self) -> None:
+        """Create sqlalchemy engine, needed by pandas methods."""
+        self.engine = sqlalchemy.create_engine(
             f"{self.dialect}+{self.driver}://"
             f"{self.user}:{self.password}@"
             f"{self.host}:{self.port}/{self.database}"
@@ -47,7 +76,7 @@ class PostgresConnector:
 
     def upload_data(self, dataframe: pd.DataFrame, table_name: str) -> None:
         """Use pandas to_sql method and sqlalchemy engine to send data to postgres."""
-        self._connect_to_database()
+        self._create_engine()
         dataframe.to_sql(
             name=table_name,
             con=self.engine,
@@ -58,16 +87,117 @@ class PostgresConnector:
         )
         self.close_connections()
 
+        # pandas creates the table on the first upload
+        if table_name not in self._catalogs.get(self.schema, {}):
+            self.invalidate_catalog()
+
+    def create_table(self, dataframe: pd.DataFrame, table_name: str) -> None:
+        """
+        Create an empty table with dataframe's columns, typed as pandas to_sql method would type them.
+
+        Pandas infers types such as dates from values, so dataframe should hold at least one row.
+        """
+        self._create_engine()
+        statement = pd.io.sql.get_schema(dataframe, name=table_name, con=self.engine, schema=self.schema)
+        self.close_connections()
+
+        # Processes loading files concurrently may race to create the same table
+        self.execute_statement(statement=statement.replace("CREATE TABLE", "CREATE TABLE IF NOT EXISTS", 1))
+
+    def replace_data(self, dataframe: pd.DataFrame, table_name: str) -> None:
+        """
+        Replace table content with dataframe, e.g. a history downloaded in full again.
+
+        Table is dropped and written again in a single transaction, so readers keep the former content until
+        the new one is committed, and an interrupted upload leaves it untouched.
+        """
+        self._create_engine()
+        try:
+            with self.engine.begin() as connection:
+                dataframe.to_sql(
+                    name=table_name,
+                    con=connection,
+                    schema=self.schema,
+                    if_exists='replace',
+                    index=False,
+                    chunksize=1000
+                )
+        finally:
+            self.close_connections()
+
+        self.invalidate_catalog()
+
+    def bulk_upsert(self, dataframe: pd.DataFrame, table_name: str, key_columns: list) -> None:
+        """
+        Load dataframe into table through COPY, replacing rows whose keys already exist.
+
+        Rows are copied into a temporary table first and merged into the target with a single statement,
+        which is much faster than pandas' row inserts and keeps re-runs free of duplicates.
+        """
+        columns = list(dataframe.columns)
+
+        self._connect_to_database()
+        with self.connection.cursor() as cursor:
+            staging_table = sql.Identifier(f"staging_{table_name}")
+            cursor.execute(sql.SQL("""
+                CREATE TEMPORARY TABLE {staging_table} (LIKE {table_name} INCLUDING DEFAULTS) ON COMMIT DROP
+            """).format(
+                staging_table=staging_table,
+                table_name=sql.Identifier(self.schema, table_name)
+            ))
+            self._copy_dataframe(cursor=cursor, dataframe=dataframe, table=staging_table)
+
+            cursor.execute(sql.SQL("""
+                INSERT INTO {table_name} ({columns})
+                SELECT {columns} FROM {staging_table}
+                ON CONFLICT ({key_columns}) DO UPDATE SET {updates}
+            """).format(
+                table_name=sql.Identifier(self.schema, table_name),
+                columns=sql.SQL(", ").join(map(sql.Identifier, columns)),
+                staging_table=staging_table,
+                key_columns=sql.SQL(", ").join(map(sql.Identifier, key_columns)),
+                updates=sql.SQL(", ").join(
+                    sql.SQL("{column} = EXCLUDED.{column}").format(column=sql.Identifier(column))
+                    for column in columns
+                    if column not in key_columns
+                )
+            ))
+
+        self.connection.commit()
+        self.close_connections()
+
+    def copy_data(self, dataframe: pd.DataFrame, table_name: str) -> None:
+        """Append dataframe to an existing table through COPY, which is much faster than pandas' row inserts."""
+        self._connect_to_database()
+        with self.connection.cursor() as cursor:
+            self._copy_dataframe(cursor=cursor, dataframe=dataframe, table=sql.Identifier(self.schema, table_name))
+
+        self.connection.commit()
+        self.close_connections()
+
+    @staticmethod
+    def _copy_dataframe(cursor, dataframe: pd.DataFrame, table) -> None:
+        """Stream dataframe as CSV into given table identifier, missing values becoming nulls."""
+        buffer = StringIO()
+        dataframe.to_csv(buffer, index=False, header=False)
+        buffer.seek(0)
+
+        copy_statement = sql.SQL("COPY {table} ({columns}) FROM STDIN WITH (FORMAT csv)").format(
+            table=table,
+            columns=sql.SQL(", ").join(map(sql.Identifier, dataframe.columns))
+        )
+        cursor.copy_expert(copy_statement.as_string(cursor), buffer)
+
     def read_sql_query(self, query: str, params: dict) -> pd.DataFrame:
         """Run a query in the database and return its result as a dataframe."""
-        self._connect_to_database()
+        self._create_engine()
         try:
             dataframe = pd.read_sql_query(
                 sql=query,
                 con=self.engine,
                 params=params
             )
-        except ProgrammingError as error:
+        except sqlalchemy_exc.ProgrammingError as error:
             # In case of UndefinedTable error, we re-raise it to catch the original error
             raise error.orig
 
@@ -76,19 +206,57 @@ class PostgresConnector:
 
         return dataframe
 
-    def execute_statement(self, statement):
-        """Execute and commit statement."""
+    def read_sql_query_chunks(self, query: str, params: dict, chunk_size: int = 50000, dtypes: dict = None):
+        """
+        Run a query in the database and yield its result as dataframes of at most chunk_size rows.
+
+        A named (server-side) cursor keeps the result in Postgres, so peak memory is bounded by chunk size
+        and callers can process a chunk while the next ones are still to be fetched.
+        The cursor lives on a connection of its own, so that callers may use the connector while streaming.
+        """
+        connection = self._open_connection()
+        try:
+            with connection.cursor(name=f"chunks_{uuid.uuid4().hex}") as cursor:
+                cursor.itersize = chunk_size
+                cursor.execute(query, params)
+
+                while True:
+                    rows = cursor.fetchmany(chunk_size)
+                    if not rows:
+                        break
+
+                    dataframe = pd.DataFrame(rows, columns=[column.name for column in cursor.description])
+                    if dtypes:
+                        dataframe = dataframe.astype(dtypes)
+                    yield dataframe
+
+        finally:
+            connection.close()
+
+    def execute_statement(self, statement, params: dict = None):
+        """
+        Execute and commit statement, forgetting the cached catalog if it creates, drops or alters anything.
+
+        Statements are committed explicitly, since SQLAlchemy only autocommits the ones starting with
+        a data changing keyword, leaving out e.g. WITH ... INSERT, SET and ANALYZE.
+        """
+        if DDL_PATTERN.search(str(statement)):
+            self.invalidate_catalog()
+
         # Create engine
-        self._connect_to_database()
+        self._create_engine()
 
         try:
-            # Use engine to connect to database
-            with self.engine.connect() as connection:
+            # Use engine to connect to database, committing once the block exits without errors
+            with self.engine.begin() as connection:
 
-                # Execute and autocommit
-                connection.execute(statement)
+                # Execute
+                if params:
+                    connection.execute(statement, params)
+                else:
+                    connection.execute(statement)
 
-        except ProgrammingError as error:
+        except sqlalchemy_exc.ProgrammingError as error:
             # In case of InsufficientPrivilege error, we re-raise it to catch the original error
             raise error.orig
 
@@ -96,6 +264,21 @@ class PostgresConnector:
             # Dispose engine
             self.close_connections()
 
+    def execute_autocommit(self, statements: list) -> None:
+        """Execute statements one by one outside of any transaction block, e.g. CLUSTER of partitioned tables."""
+        if any(DDL_PATTERN.search(statement) for statement in statements):
+            self.invalidate_catalog()
+
+        self._connect_to_database()
+        self.connection.set_session(autocommit=True)
+        try:
+            with self.connection.cursor() as cursor:
+                for statement in statements:
+                    cursor.execute(statement)
+
+        finally:
+            self.close_connections()
+
     def create_schema_database(self) -> None:
         """Execute schema creation statement."""
         self._connect_to_database()
@@ -110,59 +293,132 @@ class PostgresConnector:
             cursor.execute(statement)
 
         self.close_connections()
+        self.invalidate_catalog()
+
+    def get_catalog(self) -> dict:
+        """
+        Get every table, view and materialized view inside schema, along with their column types.
+
+        The whole catalog of the schema is read in a single round trip and kept in memory, so that
+        existence and type checks cost one query per schema. DDL issued by this connector invalidates it.
+        """
+        if self.schema in self._catalogs:
+            return self._catalogs[self.schema]
 
-    def check_table_existence(self, table_name: str) -> dict:
-        """Check if given table exists inside schema."""
         self._connect_to_database()
 
         with self.connection.cursor() as cursor:
             statement = sql.SQL("""
-            SELECT EXISTS (
-                SELECT * FROM pg_catalog.pg_tables pt
-                WHERE pt.schemaname = {schema_name}
-                    AND pt.tablename = {table_name}
-            );
+            SELECT pc.relname, pc.relkind, pa.attname, format_type(pa.atttypid, pa.atttypmod)
+            FROM pg_catalog.pg_class pc
+            JOIN pg_catalog.pg_namespace pn ON pn.oid = pc.relnamespace
+            LEFT JOIN pg_catalog.pg_attribute pa
+                ON pa.attrelid = pc.oid
+                AND pa.attnum > 0
+                AND NOT pa.attisdropped
+            WHERE pn.nspname = {schema_name}
+                AND pc.relkind IN ('r', 'p', 'v', 'm')
+            ORDER BY pc.relname, pa.attnum;
             """).format(
-                schema_name=sql.Literal(self.schema),
-                table_name=sql.Literal(table_name)
+                schema_name=sql.Literal(self.schema)
             )
             # There is no need to put this execution inside try-except block
             # Even without any privilege, one can still safely run this query
             cursor.execute(statement)
-            result = cursor.fetchone()
+            result = cursor.fetchall()
 
         self.close_connections()
 
-        table_exists, = result
-        return {table_name: table_exists}
+        catalog = {}
+        for relation_name, relation_kind, column_name, column_type in result:
+            relation = catalog.setdefault(relation_name, {"kind": RELATION_KINDS[relation_kind], "columns": {}})
+            if column_name is not None:
+                relation["columns"][column_name] = column_type
+
+        self._catalogs[self.schema] = catalog
+        return catalog
+
+    def invalidate_catalog(self) -> None:
+        """Forget the cached catalog of every schema, which will be read again on the next check."""
+        self._catalogs.clear()
+
+    def check_table_existence(self, table_name: str) -> dict:
+        """Check if given table exists inside schema."""
+        relation = self.get_catalog().get(table_name)
+        return {table_name: relation is not None and relation["kind"] == "table"}
+
+    def list_tables(self, prefix: str = "") -> list:
+        """List tables inside schema whose names start with given prefix, in alphabetical order."""
+        return sorted(
+            relation_name
+            for relation_name, relation in self.get_catalog().items()
+            if relation["kind"] == "table" and relation_name.startswith(prefix)
+        )
 
-    def check_materialized_view_existence(self, view_name: str) -> dict:
+    def get_table_columns(self, table_name: str) -> list:
+        """List the columns of given table inside schema, in their ordinal position."""
+        return list(self.get_column_types(table_name=table_name))
+
+    def get_column_types(self, table_name: str) -> dict:
+        """Map the columns of given table, view or materialized view inside schema to their types."""
+        relation = self.get_catalog().get(table_name)
+        if relation is None:
+            return {}
+
+        return dict(relation["columns"])
+
+    def check_materialized_view_existence(self, view_name: str) -> bool:
         """Check if given materialized view exists inside schema."""
+        relation = self.get_catalog().get(view_name)
+        return relation is not None and relation["kind"] == "materialized_view"
+
+    def record_load_watermark(self) -> None:
+        """Register that a load into schema has just finished, so that cached query results become outdated."""
         self._connect_to_database()
+        self.connection.set_session(autocommit=True)
 
         with self.connection.cursor() as cursor:
             statement = sql.SQL("""
-            SELECT EXISTS (
-                SELECT *
-                FROM pg_catalog.pg_matviews pm
-                WHERE pm.schemaname = {schema_name}
-                    AND pm.matviewname = {view_name}
-            );
+                CREATE TABLE IF NOT EXISTS {schema_name}.load_watermark (loaded_at TIMESTAMPTZ NOT NULL);
+                INSERT INTO {schema_name}.load_watermark (loaded_at) VALUES (clock_timestamp());
             """).format(
-                schema_name=sql.Literal(self.schema),
-                view_name=sql.Literal(view_name)
+                schema_name=sql.Identifier(self.schema)
             )
-            # There is no need to put this execution inside try-except block
-            # Even without any privilege, one can still safely run this query
             cursor.execute(statement)
-            result = cursor.fetchone()
 
         self.close_connections()
 
-        view_exists, = result
-        return view_exists
+        if "load_watermark" not in self._catalogs.get(self.schema, {}):
+            self.invalidate_catalog()
+
+    def get_load_watermark(self) -> str:
+        """Get the moment of the last load into schema, as text, or an empty string if there was none."""
+        self._connect_to_database()
+
+        with self.connection.cursor() as cursor:
+            statement = sql.SQL("""
+                SELECT max(lw.loaded_at)::text FROM {schema_name}.load_watermark lw;
+            """).format(
+                schema_name=sql.Identifier(self.schema)
+            )
+            try:
+                cursor.execute(statement)
+                watermark, = cursor.fetchone()
+
+            except errors.UndefinedTable:
+                # Nothing has been loaded since watermarks were introduced
+                watermark = ""
+
+        self.close_connections()
+
+        return watermark or ""
 
     def close_connections(self) -> None:
         """Close all connections."""
-        self.engine.dispose()
-        self.connection.close()
+        if self.engine is not None:
+            self.engine.dispose()
+            self.engine = None
+
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
@@ -0,0 +1,358 @@
+"""File containing a cached read API over Data Lake and Data Warehouse."""
+from __future__ import annotations
+
+import hashlib
+import os
+import re
+import shutil
+import time
+from collections import OrderedDict
+from datetime import date
+
+from src.shared.column_definitions import DEFAULT_INDICATORS, OPTION_MARKET_TYPES, select_price
+from src.shared.lazy_import import lazy_import
+from src.shared.loading_engine import PostgresConnector
+
+pd = lazy_import("pandas")
+
+DEFAULT_COLUMNS = [
+    'preco_abertura_pregao',
+    'preco_maximo_pregao',
+    'preco_minimo_pregao',
+    'preco_ultimo_negocio',
+    'numero_negocios_efetuados',
+]
+PRICE_COLUMNS = [
+    'preco_abertura_pregao',
+    'preco_maximo_pregao',
+    'preco_minimo_pregao',
+    'preco_medio_pregao',
+    'preco_ultimo_negocio',
+    'preco_melhor_oferta_compra',
+    'preco_melhor_oferta_venda',
+]
+SNAPSHOT_COLUMNS = [
+    *DEFAULT_COLUMNS,
+    'volume_total_titulos_negociados',
+]
+IDENTIFIER_PATTERN = re.compile(r"^[a-z_][a-z0-9_]*$")
+TICKER_PATTERN = re.compile(r"^[A-Z0-9]+$")
+
+# B3 market types are three digit codes, e.g. 010 for spot, 070 and 080 for call and put options
+MARKET_TYPE_PATTERN = re.compile(r"^\d{3}$")
+
+
+class HistoryQueryEngine:
+    """
+    Class for reading stocks history from Data Lake or Data Warehouse, caching results in memory and on disk.
+
+    Cached results are keyed by query and by the schema's load watermark, which every load updates.
+    The watermark itself is checked at most once every watermark_ttl seconds, so repeated reads
+    within that interval do not reach Postgres at all.
+    """
+
+    def __init__(
+            self,
+            data_lake_schema: str = "b3_history",
+            data_warehouse_schema: str = "data_warehouse",
+            memory_cache_mb: float = 256,
+            disk_cache_path: str = None,
+            watermark_ttl: float = 60
+    ) -> None:
+        """Initialize the constructor."""
+        self.postgres = PostgresConnector()
+        self.data_lake_schema = self._validate_identifier(data_lake_schema)
+        self.data_warehouse_schema = self._validate_identifier(data_warehouse_schema)
+
+        # In-process LRU cache of (dataframe, size in bytes), bounded by the memory used by cached dataframes
+        self.memory_cache_bytes = int(memory_cache_mb * 1024 ** 2)
+        self._memory_cache = OrderedDict()
+        self._memory_cache_used_bytes = 0
+
+        # Optional on-disk cache, one directory per schema and watermark
+        self.disk_cache_path = disk_cache_path
+
+        # Load watermarks per schema, along with the moment they were last checked
+        self.watermark_ttl = watermark_ttl
+        self._watermarks = {}
+
+    def get_history(
+            self,
+            tickers: list,
+            start: date = None,
+            end: date = None,
+            columns: list = None,
+            adjusted: bool = False,
+            source: str = "data_lake"
+    ) -> pd.DataFrame:
+        """
+        Get daily history of given tickers, ordered by ticker and session.
+
+        Adjusted prices are divided by B3's quotation factor (fator_cotacao_papel), turning quotes
+        of lots of 1000 shares into prices per share. It is only available from Data Lake.
+        """
+        if isinstance(tickers, str):
+            tickers = [tickers]
+        tickers = sorted({ticker.upper() for ticker in tickers})
+        if not all(TICKER_PATTERN.match(ticker) for ticker in tickers):
+            raise ValueError("Prohibited characters found in ticker name!")
+
+        columns = [self._validate_identifier(column) for column in (columns or DEFAULT_COLUMNS)]
+
+        if source == "data_lake":
+            query, schema = self._build_data_lake_query(columns=columns, adjusted=adjusted), self.data_lake_schema
+        elif source == "data_warehouse":
+            if adjusted:
+                raise ValueError("Adjusted prices are only available from Data Lake.")
+            query, schema = self._build_data_warehouse_query(columns=columns), self.data_warehouse_schema
+        else:
+            raise ValueError(f"Invalid source {source}. Expected data_lake or data_warehouse.")
+
+        if start is not None:
+            query += " AND h.data_pregao >= %(start)s"
+        if end is not None:
+            query += " AND h.data_pregao <= %(end)s"
+        query += " ORDER BY ticker, h.data_pregao"
+
+        return self.read_cached_query(
+            query=query,
+            params={"tickers": tickers, "start": start, "end": end},
+            schema=schema
+        )
+
+    def get_indicators(
+            self,
+            tickers: list,
+            start: date = None,
+            end: date = None,
+            indicators: list = None
+    ) -> pd.DataFrame:
+        """Get technical indicators materialized in Data Warehouse for given tickers, ordered by ticker and session."""
+        if isinstance(tickers, str):
+            tickers = [tickers]
+        tickers = sorted({ticker.upper() for ticker in tickers})
+        if not all(TICKER_PATTERN.match(ticker) for ticker in tickers):
+            raise ValueError("Prohibited characters found in ticker name!")
+
+        columns = [self._validate_identifier(column) for column in (indicators or DEFAULT_INDICATORS)]
+        query = f"""
+            SELECT di.ticker, di.data_pregao, {', '.join(f"di.{column}" for column in columns)}
+            FROM {self.data_warehouse_schema}.daily_indicators di
+            WHERE di.ticker = ANY(%(tickers)s)
+        """
+        if start is not None:
+            query += " AND di.data_pregao >= %(start)s"
+        if end is not None:
+            query += " AND di.data_pregao <= %(end)s"
+        query += " ORDER BY di.ticker, di.data_pregao"
+
+        return self.read_cached_query(
+            query=query,
+            params={"tickers": tickers, "start": start, "end": end},
+            schema=self.data_warehouse_schema
+        )
+
+    def get_snapshot(
+            self,
+            session: date,
+            market_type: str = "010",
+            end: date = None,
+            columns: list = None,
+            adjusted: bool = False
+    ) -> pd.DataFrame:
+        """
+        Get every ticker of given market types on a session, or on every session up to end, ordered by session.
+
+        Cross-sections are read from Data Lake through its date-major index on session and market type,
+        so that they do not scan the whole history. Options are stored apart, see get_option_chain.
+        """
+        market_types = [market_type] if isinstance(market_type, str) else list(market_type)
+        if not all(isinstance(code, str) and MARKET_TYPE_PATTERN.match(code) for code in market_types):
+            raise ValueError(f"Invalid market type {market_type}. Expected three digit codes, e.g. 010.")
+        if any(code in OPTION_MARKET_TYPES for code in market_types):
+            raise ValueError("Options are not part of stocks history, read them with get_option_chain instead.")
+
+        end = end or session
+        if end < session:
+            raise ValueError("End of session range must not be earlier than its start.")
+
+        columns = [self._validate_identifier(column) for column in (columns or SNAPSHOT_COLUMNS)]
+        query = self._build_data_lake_query(
+            columns=['tipo_de_mercado', *columns],
+            adjusted=adjusted,
+            condition="h.data_pregao BETWEEN %(start)s AND %(end)s AND h.tipo_de_mercado = ANY(%(market_types)s)"
+        )
+        query += " ORDER BY h.data_pregao, ticker"
+
+        return self.read_cached_query(
+            query=query,
+            params={"start": session, "end": end, "market_types": sorted(market_types)},
+            schema=self.data_lake_schema
+        )
+
+    def get_option_chain(
+            self,
+            underlying: str,
+            session: date,
+            expiry: date = None,
+            columns: list = None
+    ) -> pd.DataFrame:
+        """
+        Get every call and put of given underlying traded on a session, ordered by expiry, strike and type.
+
+        Underlying is the four character root of option codes, e.g. PETR, so a stock code such as PETR4 also works.
+        Chains are read from Data Lake's options history, indexed by underlying, session, expiry and strike.
+        """
+        underlying = underlying.upper()[:4]
+        if not TICKER_PATTERN.match(underlying):
+            raise ValueError("Prohibited characters found in underlying name!")
+
+        columns = [self._validate_identifier(column) for column in (columns or SNAPSHOT_COLUMNS)]
+        column_types = self._get_column_types(schema=self.data_lake_schema, relation_name="options_history")
+        selected_columns = [
+            f"{select_price('o', column, column_types.get(column))} AS {column}"
+            for column in columns
+        ]
+        query = f"""
+            SELECT
+                o.codigo_negociaco_papel AS ticker,
+                o.data_pregao,
+                o.option_type,
+                o.data_vencimento_opcoes AS expiry,
+                {select_price('o', 'preco_exercicio_opcoes', column_types.get('preco_exercicio_opcoes'))} AS strike,
+                {', '.join(selected_columns)}
+            FROM {self.data_lake_schema}.options_history o
+            WHERE o.underlying = %(underlying)s AND o.data_pregao = %(session)s
+        """
+        if expiry is not None:
+            query += " AND o.data_vencimento_opcoes = %(expiry)s"
+        query += " ORDER BY o.data_vencimento_opcoes, o.preco_exercicio_opcoes, o.option_type, ticker"
+
+        return self.read_cached_query(
+            query=query,
+            params={"underlying": underlying, "session": session, "expiry": expiry},
+            schema=self.data_lake_schema
+        )
+
+    def read_cached_query(self, query: str, params: dict, schema: str) -> pd.DataFrame:
+        """Run a query, or get its result from memory or disk if schema has not been loaded since."""
+        watermark = self._get_watermark(schema=schema)
+        cache_key = hashlib.sha256(repr((query, sorted(params.items()))).encode()).hexdigest()
+
+        # In-process cache
+        if cache_key in self._memory_cache:
+            self._memory_cache.move_to_end(cache_key)
+            dataframe, _ = self._memory_cache[cache_key]
+            return dataframe.copy()
+
+        # On-disk cache
+        cache_file = None
+        if self.disk_cache_path:
+            cache_file = os.path.join(self._get_disk_cache_directory(schema, watermark), cache_key + ".pkl")
+            if os.path.exists(cache_file):
+                dataframe = pd.read_pickle(cache_file)
+                self._store_in_memory(cache_key=cache_key, dataframe=dataframe)
+                return dataframe.copy()
+
+        # Database
+        dataframe = self.postgres.read_sql_query(query=query, params=params)
+        self._store_in_memory(cache_key=cache_key, dataframe=dataframe)
+        if cache_file:
+            dataframe.to_pickle(cache_file)
+
+        return dataframe.copy()
+
+    def clear_cache(self) -> None:
+        """Drop every cached result held in memory."""
+        self._memory_cache.clear()
+        self._memory_cache_used_bytes = 0
+
+    def _build_data_lake_query(
+            self,
+            columns: list,
+            adjusted: bool,
+            condition: str = "h.codigo_negociaco_papel = ANY(%(tickers)s)"
+    ) -> str:
+        """
+        Build the query that reads given columns from Data Lake's stocks history, by ticker unless told otherwise.
+
+        Prices stored as integer cents are converted back to reais here, and nowhere else.
+        """
+        column_types = self._get_column_types(schema=self.data_lake_schema, relation_name="stocks_history")
+        selected_columns = []
+        for column in columns:
+            expression = select_price("h", column, column_types.get(column))
+            if adjusted and column in PRICE_COLUMNS:
+                expression += " / CAST(h.fator_cotacao_papel AS INTEGER)"
+            selected_columns.append(f"{expression} AS {column}")
+
+        return f"""
+            SELECT h.codigo_negociaco_papel AS ticker, h.data_pregao, {', '.join(selected_columns)}
+            FROM {self.data_lake_schema}.stocks_history h
+            WHERE {condition}
+        """
+
+    def _build_data_warehouse_query(self, columns: list) -> str:
+        """Build the query that reads given columns from Data Warehouse's daily prices fact table."""
+        selected_columns = ', '.join(f"h.{column}" for column in columns)
+        return f"""
+            SELECT h.ticker, h.data_pregao, {selected_columns}
+            FROM {self.data_warehouse_schema}.daily_prices h
+            WHERE h.ticker = ANY(%(tickers)s)
+        """
+
+    def _get_watermark(self, schema: str) -> str:
+        """Get schema's load watermark, querying Postgres only when the last check is older than the ttl."""
+        watermark, checked_at = self._watermarks.get(schema, (None, None))
+        if checked_at is not None and time.monotonic() - checked_at < self.watermark_ttl:
+            return watermark
+
+        self.postgres.schema = schema
+        current_watermark = self.postgres.get_load_watermark()
+        if watermark is not None and current_watermark != watermark:
+            # A load happened in the meantime, every cached result and column type may be outdated
+            self.clear_cache()
+            self.postgres.invalidate_catalog()
+
+        self._watermarks[schema] = (current_watermark, time.monotonic())
+        return current_watermark
+
+    def _get_column_types(self, schema: str, relation_name: str) -> dict:
+        """Map the columns of a table or view to their types, from a catalog read again whenever schema is loaded."""
+        self._get_watermark(schema=schema)
+        self.postgres.schema = schema
+        return self.postgres.get_column_types(table_name=relation_name)
+
+    def _get_disk_cache_directory(self, schema: str, watermark: str) -> str:
+        """Get the cache directory of schema's current watermark, removing the ones of older watermarks."""
+        schema_directory = os.path.join(self.disk_cache_path, schema)
+        watermark_directory = hashlib.sha256(watermark.encode()).hexdigest()[:16]
+
+        if os.path.isdir(schema_directory):
+            for directory in os.listdir(schema_directory):
+                if directory != watermark_directory:
+                    shutil.rmtree(os.path.join(schema_directory, directory), ignore_errors=True)
+
+        os.makedirs(os.path.join(schema_directory, watermark_directory), exist_ok=True)
+        return os.path.join(schema_directory, watermark_directory)
+
+    def _store_in_memory(self, cache_key: str, dataframe: pd.DataFrame) -> None:
+        """Store dataframe in the LRU cache, evicting the least recently used ones to respect the memory bound."""
+        dataframe_bytes = int(dataframe.memory_usage(index=True, deep=True).sum())
+        if dataframe_bytes > self.memory_cache_bytes:
+            return
+
+        while self._memory_cache and self._memory_cache_used_bytes + dataframe_bytes > self.memory_cache_bytes:
+            _, (_, evicted_bytes) = self._memory_cache.popitem(last=False)
+            self._memory_cache_used_bytes -= evicted_bytes
+
+        self._memory_cache[cache_key] = (dataframe, dataframe_bytes)
+        self._memory_cache_used_bytes += dataframe_bytes
+
+    @staticmethod
+    def _validate_identifier(identifier: str) -> str:
+        """Validate schema and column names, which are put straight into queries, in order to avoid SQL injection."""
+        if not isinstance(identifier, str) or not IDENTIFIER_PATTERN.match(identifier):
+            raise ValueError(f"Prohibited characters found in name {identifier}!")
+
+        return identifier
@@ -0,0 +1,49 @@
+"""Fixtures shared by the tests, which replace the database unless SQL_* variables point to a test one."""
+import os
+import uuid
+
+import pytest
+
+from src.b3_history.modules import extraction_engine
+from src.shared.loading_engine import PostgresConnector
+
+
+@pytest.fixture
+def resources_path(tmp_path, monkeypatch) -> str:
+    """Point B3 history app at a temporary resources directory, returning where COTAHIST files go."""
+    monkeypatch.setattr(extraction_engine, "ROOT_PATH", str(tmp_path))
+    return str(tmp_path) + extraction_engine.RESOURCES_PATH
+
+
+@pytest.fixture
+def postgres_env(monkeypatch) -> None:
+    """Set the credentials PostgresConnector reads, for tests that replace the database itself."""
+    for variable in ["SQL_HOST", "SQL_PORT", "SQL_USER", "SQL_PASS", "SQL_DB"]:
+        monkeypatch.setenv(variable, "test")
+
+
+@pytest.fixture
+def make_schema():
+    """
+    Create throwaway schemas in the database SQL_* variables point to, dropping them afterwards.
+
+    Tests using it are skipped when there is no such database.
+    """
+    if not os.environ.get("SQL_HOST"):
+        pytest.skip("SQL_* variables do not point to a test database.")
+
+    connector = PostgresConnector()
+    try:
+        connector.execute_autocommit(statements=["SELECT 1"])
+    except Exception as error:
+        pytest.skip(f"Test database is unreachable: {error}")
+
+    schemas = []
+
+    def make() -> str:
+        schemas.append(f"test_{uuid.uuid4().hex[:12]}")
+        connector.execute_autocommit(statements=[f"CREATE SCHEMA {schemas[-1]}"])
+        return schemas[-1]
+
+    yield make
+    connector.execute_autocommit(statements=[f"DROP SCHEMA IF EXISTS {schema} CASCADE" for schema in schemas])
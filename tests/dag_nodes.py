@@ -0,0 +1,19 @@
+"""Handlers run as nodes by the DAG engine tests, which log each call to the file given in their event."""
+
+
+def record_call(event: dict) -> None:
+    """Append the node name to the call log."""
+    with open(event["log_path"], "a") as log_file:
+        log_file.write(event["name"] + "\n")
+
+
+def fail(event: dict) -> None:
+    """Log the call, then fail."""
+    record_call(event=event)
+    raise RuntimeError(f"{event['name']} failed")
+
+
+def stop_early(event: dict) -> bool:
+    """Log the call, then report that the work was not done, like apps lacking a prerequisite."""
+    record_call(event=event)
+    return False
@@ -0,0 +1,55 @@
+"""Builders of the B3 files and records the tests load."""
+import os
+import zipfile
+from datetime import date
+
+OPTION_MARKET_TYPES = ["070", "080"]
+
+
+def build_record(
+        session: date,
+        ticker: str,
+        market_type: str = "010",
+        price: int = 1234,
+        name: str = "PETROBRAS",
+        volume: int = 1
+) -> str:
+    """Build a COTAHIST quotation record (type 01), with every price set to given cents, as is volume."""
+    is_option = market_type in OPTION_MARKET_TYPES
+    record = "".join([
+        "01",
+        session.strftime("%Y%m%d"),
+        "02",
+        ticker.ljust(12),
+        market_type,
+        name.ljust(12),
+        "ON".ljust(10),
+        "   ",
+        "R$  ",
+        str(price).zfill(13) * 7,
+        "00010",
+        "1".zfill(18),
+        str(volume).zfill(18),
+        ("2000" if is_option else "0").zfill(13),
+        "0",
+        "20230220" if is_option else "99991231",
+        "0000001",
+        "0" * 13,
+        "BRPETRACNOR9",
+        "123",
+    ])
+    assert len(record) == 245
+    return record
+
+
+def write_cotahist(directory: str, file_name: str, records: list, header_date: str = "20230101") -> None:
+    """Write a zipped COTAHIST file holding given records between its header and trailer."""
+    lines = [
+        "00COTAHIST.2023BOVESPA " + header_date + " " * 214,
+        *records,
+        "99COTAHIST.2023BOVESPA " + header_date + str(len(records) + 2).zfill(11) + " " * 203,
+    ]
+    os.makedirs(directory, exist_ok=True)
+    with zipfile.ZipFile(os.path.join(directory, file_name), "w") as zipped_file:
+        # B3 files are encoded as latin-1
+        zipped_file.writestr(file_name.replace(".zip", ".TXT"), ("\r\n".join(lines) + "\r\n").encode("latin-1"))
@@ -0,0 +1,109 @@
+"""Tests of bulk mode, which stages postgres loads in unlogged tables until each file is complete."""
+from datetime import date, timedelta
+
+import pytest
+
+import src.b3_history.app as app
+from src.b3_history.modules.main_engine import DataLakeMainEngine
+from src.shared.loading_engine import PostgresConnector
+from tests.helpers import build_record, write_cotahist
+
+SESSIONS = [date(2023, 1, 2) + timedelta(days=day) for day in range(8)]
+
+
+class AbortingEngine(DataLakeMainEngine):
+    """Engine whose process is killed right after its first batch."""
+
+    def run_etl(self) -> None:
+        """Run a batch, then abort."""
+        super().run_etl()
+        raise KeyboardInterrupt
+
+
+@pytest.fixture
+def schema(resources_path, make_schema) -> str:
+    """Write an annual file and a daily file of 2023, returning the schema to bulk load them into."""
+    write_cotahist(
+        directory=resources_path,
+        file_name="COTAHIST_A2023.zip",
+        records=[build_record(session=session, ticker="PETR3") for session in SESSIONS]
+    )
+    write_cotahist(
+        directory=resources_path,
+        file_name="COTAHIST_D12012023.zip",
+        records=[build_record(session=date(2023, 1, 12), ticker="PETR3", price=999)]
+    )
+    return make_schema()
+
+
+def load(schema: str, file_name: str) -> None:
+    """Bulk load given file into schema."""
+    app.lambda_handler(event={
+        "schema": schema,
+        "batch_size": 3,
+        "bulk_mode": True,
+        "files_to_run": [file_name],
+    })
+
+
+def read(schema: str, query: str):
+    """Run a query within given schema."""
+    return PostgresConnector(schema=schema).read_sql_query(query=query, params={})
+
+
+def read_relations(schema: str):
+    """Read the persistence and estimated row count of every relation inside schema."""
+    return read(schema, f"""
+        SELECT pc.relname, pc.relpersistence, pc.reltuples
+        FROM pg_catalog.pg_class pc
+        JOIN pg_catalog.pg_namespace pn ON pn.oid = pc.relnamespace
+        WHERE pn.nspname = '{schema}'
+    """).set_index("relname")
+
+
+def count_checkpoints(schema: str, table_name: str, file_name: str) -> int:
+    """Count the checkpoints of given file inside given bookkeeping table."""
+    query = f"SELECT count(*) AS checkpoints FROM {schema}.{table_name} WHERE file_name = '{file_name}'"
+    return read(schema, query)["checkpoints"][0]
+
+
+def test_bulk_loaded_tables_are_published_indexed_and_analyzed(schema):
+    load(schema=schema, file_name="COTAHIST_A2023.zip")
+
+    assert sorted(read(schema, f"SELECT data_pregao FROM {schema}.stocks_history")["data_pregao"]) == SESSIONS
+    relations = read_relations(schema=schema)
+
+    assert "staging_cotahist_a2023" not in relations.index
+    assert relations.loc["cotahist_a2023", "relpersistence"] == "p"
+    assert PostgresConnector(schema=schema).get_column_types(table_name="cotahist_a2023")["data_pregao"] == "date"
+    for relation_name in ["cotahist_a2023", "stocks_history", "ticker_lineage"]:
+        assert relations.loc[relation_name, "reltuples"] > 0
+    assert {"stocks_history_ticker_session_idx", "ticker_lineage_isin_idx"} <= set(relations.index)
+
+
+def test_rows_staged_by_an_aborted_load_are_not_published_with_another_file(schema, monkeypatch):
+    monkeypatch.setattr(app, "DataLakeMainEngine", AbortingEngine)
+    with pytest.raises(KeyboardInterrupt):
+        load(schema=schema, file_name="COTAHIST_A2023.zip")
+    monkeypatch.setattr(app, "DataLakeMainEngine", DataLakeMainEngine)
+
+    # Aborted batch is left in an unlogged staging table, next to the empty yearly table it was created from
+    relations = read_relations(schema=schema)
+    assert relations.loc["staging_cotahist_a2023", "relpersistence"] == "u"
+    assert relations.loc["cotahist_a2023", "relpersistence"] == "p"
+    assert len(read(schema, f"SELECT data_pregao FROM {schema}.staging_cotahist_a2023")) == 3
+    assert read(schema, f"SELECT data_pregao FROM {schema}.cotahist_a2023").empty
+    assert count_checkpoints(schema, "staging_extraction_progress", "COTAHIST_A2023.zip")
+
+    load(schema=schema, file_name="COTAHIST_D12012023.zip")
+    assert read(schema, f"SELECT data_pregao FROM {schema}.cotahist_a2023")["data_pregao"].tolist() == [
+        date(2023, 1, 12)
+    ]
+    for table_name in ["staging_extraction_progress", "staging_extraction_fingerprint", "extraction_progress"]:
+        assert not count_checkpoints(schema, table_name, "COTAHIST_A2023.zip")
+    assert "staging_cotahist_a2023" not in read_relations(schema=schema).index
+
+    # Annual file is read again from its beginning, rather than resumed over rows that were dropped
+    load(schema=schema, file_name="COTAHIST_A2023.zip")
+    sessions = read(schema, f"SELECT data_pregao FROM {schema}.cotahist_a2023")["data_pregao"]
+    assert sorted(sessions) == SESSIONS + [date(2023, 1, 12)]
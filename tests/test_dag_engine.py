@@ -0,0 +1,154 @@
+"""Tests of the orchestrator's dependency graph, which skips nodes whose fingerprint did not change."""
+import os
+
+import pytest
+
+import src.orchestrator.app as orchestrator
+from src.b3_history.modules import extraction_engine
+from src.orchestrator.modules.dag_engine import DagEngine, DagNode
+
+
+@pytest.fixture
+def log_path(tmp_path) -> str:
+    """File logging the nodes that were run."""
+    return str(tmp_path / "calls.log")
+
+
+def build_graph(
+        tmp_path,
+        log_path: str,
+        workers: int = 1,
+        force: bool = False,
+        events: dict = None,
+        failing=(),
+        stopping=()
+):
+    """
+    Build the graph lake -> (warehouse_a, warehouse_b), warehouse_a -> figures, and an independent yahoo node.
+
+    Events of given nodes are extended with given values, e.g. to change their fingerprint.
+    """
+    engine = DagEngine(state_path=str(tmp_path / "state" / "dag_state.json"), workers=workers, force=force)
+    for name, upstream in [
+        ("lake", []),
+        ("warehouse_a", ["lake"]),
+        ("warehouse_b", ["lake"]),
+        ("figures", ["warehouse_a"]),
+        ("yahoo", []),
+    ]:
+        engine.add_node(DagNode(
+            name=name,
+            module_name="tests.dag_nodes",
+            function_name="fail" if name in failing else "stop_early" if name in stopping else "record_call",
+            event={"name": name, "log_path": log_path, **(events or {}).get(name, {})},
+            upstream=upstream
+        ))
+    return engine
+
+
+def read_calls(log_path: str) -> list:
+    """Read the nodes that were run, and clear the log."""
+    with open(log_path) as log_file:
+        calls = log_file.read().split()
+    open(log_path, "w").close()
+    return sorted(calls)
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_unchanged_nodes_are_skipped(tmp_path, log_path, workers):
+    statuses = build_graph(tmp_path=tmp_path, log_path=log_path, workers=workers).run()
+    assert set(statuses.values()) == {"done"}
+    assert read_calls(log_path) == ["figures", "lake", "warehouse_a", "warehouse_b", "yahoo"]
+
+    statuses = build_graph(tmp_path=tmp_path, log_path=log_path, workers=workers).run()
+    assert set(statuses.values()) == {"skipped"}
+    assert read_calls(log_path) == []
+
+
+def test_changed_node_runs_again_with_its_descendants(tmp_path, log_path):
+    build_graph(tmp_path=tmp_path, log_path=log_path).run()
+    read_calls(log_path)
+
+    statuses = build_graph(tmp_path=tmp_path, log_path=log_path, events={"warehouse_a": {"chunk_size": 10}}).run()
+
+    assert read_calls(log_path) == ["figures", "warehouse_a"]
+    assert statuses["warehouse_b"] == "skipped"
+
+
+def test_failed_node_blocks_its_descendants_only(tmp_path, log_path):
+    statuses = build_graph(tmp_path=tmp_path, log_path=log_path, failing=["warehouse_a"]).run()
+
+    assert statuses == {
+        "lake": "done",
+        "warehouse_a": "failed",
+        "warehouse_b": "done",
+        "figures": "blocked",
+        "yahoo": "done",
+    }
+    read_calls(log_path)
+
+    # Failed and blocked nodes are not recorded, so they run once fixed
+    build_graph(tmp_path=tmp_path, log_path=log_path).run()
+    assert read_calls(log_path) == ["figures", "warehouse_a"]
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_node_stopping_early_is_not_recorded_as_done(tmp_path, log_path, workers):
+    statuses = build_graph(tmp_path=tmp_path, log_path=log_path, workers=workers, stopping=["lake"]).run()
+
+    assert statuses["lake"] == "failed"
+    assert {statuses[name] for name in ["warehouse_a", "warehouse_b", "figures"]} == {"blocked"}
+    read_calls(log_path)
+
+    build_graph(tmp_path=tmp_path, log_path=log_path, workers=workers).run()
+    assert read_calls(log_path) == ["figures", "lake", "warehouse_a", "warehouse_b"]
+
+
+def test_forced_run_ignores_stored_fingerprints(tmp_path, log_path):
+    build_graph(tmp_path=tmp_path, log_path=log_path).run()
+    read_calls(log_path)
+
+    build_graph(tmp_path=tmp_path, log_path=log_path, force=True).run()
+    assert read_calls(log_path) == ["figures", "lake", "warehouse_a", "warehouse_b", "yahoo"]
+
+
+def test_nodes_must_follow_their_upstream_nodes(tmp_path):
+    engine = DagEngine(state_path=str(tmp_path / "dag_state.json"))
+    with pytest.raises(ValueError):
+        engine.add_node(DagNode(name="figures", module_name="tests.dag_nodes", function_name="record_call",
+                                upstream=["warehouse"]))
+    with pytest.raises(ValueError):
+        DagEngine(state_path=str(tmp_path / "dag_state.json"), workers=0)
+
+
+def test_republished_file_reruns_the_nodes_loading_its_table(resources_path, monkeypatch, tmp_path):
+    # Orchestrator's lazy module keeps the attributes it resolved, e.g. in earlier tests
+    monkeypatch.setattr(orchestrator, "extraction_engine", extraction_engine)
+    file_names = ["COTAHIST_A2022.zip", "COTAHIST_A2023.zip", "COTAHIST_D02012023.zip"]
+    os.makedirs(resources_path)
+    for file_name in file_names:
+        with open(resources_path + file_name, "wb") as file:
+            file.write(file_name.encode())
+
+    def build_data_lake_graph() -> DagEngine:
+        engine = DagEngine(state_path=str(tmp_path / "dag_state.json"))
+        orchestrator._add_data_lake_nodes(engine=engine, b3_event={"files_to_run": file_names})
+        return engine
+
+    engine = build_data_lake_graph()
+    # Daily file lands on the annual table of its year, after the annual file
+    assert engine.nodes["data_lake_file:COTAHIST_D02012023.zip"].upstream == [
+        "data_lake_setup", "data_lake_file:COTAHIST_A2023.zip"
+    ]
+    first_fingerprints = dict(engine.compute_fingerprints())
+
+    with open(resources_path + "COTAHIST_A2023.zip", "ab") as file:
+        file.write(b"appended records")
+    changed = {
+        name for name, fingerprint in build_data_lake_graph().compute_fingerprints().items()
+        if fingerprint != first_fingerprints[name]
+    }
+
+    assert changed == {
+        "data_lake_file:COTAHIST_A2023.zip", "data_lake_file:COTAHIST_D02012023.zip", "data_lake_view"
+    }
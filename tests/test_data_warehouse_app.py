@@ -0,0 +1,37 @@
+"""Tests of the Data Warehouse app, loading tickers from a Data Lake inside postgres."""
+from datetime import date, timedelta
+
+import pytest
+
+import src.b3_history.app as b3_history_app
+import src.data_warehouse.app as data_warehouse_app
+from src.shared.loading_engine import PostgresConnector
+from tests.helpers import build_record, write_cotahist
+
+SESSIONS = [date(2023, 1, 2) + timedelta(days=day) for day in range(3)]
+
+
+@pytest.fixture
+def schemas(resources_path, make_schema) -> dict:
+    """Load PETR3 and VALE3 into a Data Lake schema, and return it along with an empty Data Warehouse schema."""
+    data_lake_schema, data_warehouse_schema = make_schema(), make_schema()
+    write_cotahist(
+        directory=resources_path,
+        file_name="COTAHIST_A2023.zip",
+        records=[build_record(session=session, ticker=ticker) for session in SESSIONS for ticker in ["PETR3", "VALE3"]]
+    )
+    b3_history_app.lambda_handler(event={"schema": data_lake_schema, "files_to_run": ["COTAHIST_A2023.zip"]})
+    return {"datalake_schema": data_lake_schema, "data_warehouse_schema": data_warehouse_schema}
+
+
+def test_tickers_are_normalized_before_being_loaded(schemas):
+    data_warehouse_app.lambda_function(event={**schemas, "indicators": [], "stocks": [{"ticket_name": "petr3"}]})
+
+    schema = schemas["data_warehouse_schema"]
+    postgres = PostgresConnector(schema=schema)
+    fact_rows = postgres.read_sql_query(query=f"SELECT ticker, data_pregao FROM {schema}.daily_prices", params={})
+    view_rows = postgres.read_sql_query(query=f"SELECT data_pregao FROM {schema}.petr3", params={})
+
+    assert set(fact_rows["ticker"]) == {"PETR3"}
+    assert sorted(fact_rows["data_pregao"]) == SESSIONS
+    assert len(view_rows) == len(SESSIONS)
@@ -0,0 +1,15 @@
+"""Tests of the Data Warehouse engine statements that do not need a running database."""
+from src.data_warehouse.modules.main_engine import FACT_TABLE_PARTITIONS, DataWarehouseMainEngine
+
+
+def test_fact_table_is_clustered_partition_by_partition(postgres_env, monkeypatch):
+    engine = DataWarehouseMainEngine()
+    executed = []
+    monkeypatch.setattr(engine.postgres, "execute_autocommit", lambda statements: executed.extend(statements))
+
+    engine.cluster_fact_table()
+
+    clusters = [statement for statement in executed if statement.startswith("CLUSTER")]
+    assert len(clusters) == FACT_TABLE_PARTITIONS
+    assert clusters[0] == "CLUSTER data_warehouse.daily_prices_p0 USING daily_prices_p0_pkey"
+    assert executed[-1] == "ANALYZE data_warehouse.daily_prices"
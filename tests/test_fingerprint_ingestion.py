@@ -0,0 +1,108 @@
+"""Tests of the ingestion of re-published COTAHIST files, which only reads the records appended to them."""
+from datetime import date, timedelta
+
+import pytest
+
+import src.b3_history.app as app
+from src.b3_history.modules.load_sinks import FileSink
+from src.b3_history.modules.main_engine import DataLakeMainEngine
+from tests.helpers import build_record, write_cotahist
+
+FILE_NAME = "COTAHIST_A2023.zip"
+SESSIONS = [date(2023, 1, 2) + timedelta(days=day) for day in range(20)]
+
+
+class SmallBlockEngine(DataLakeMainEngine):
+    """Engine fingerprinting a few records per block, so that small files span several blocks."""
+
+    def __init__(self):
+        """Initialize the constructor."""
+        super().__init__()
+        self.fingerprint_block_size = 4
+
+
+@pytest.fixture
+def sink_path(tmp_path, monkeypatch) -> str:
+    """Load into local files, with small fingerprint blocks."""
+    monkeypatch.setattr(app, "DataLakeMainEngine", SmallBlockEngine)
+    return str(tmp_path / "sink")
+
+
+def write_version(resources_path: str, number_of_records: int, price: int = 1234) -> None:
+    """Write a version of the annual file holding one record per session, up to given number of sessions."""
+    write_cotahist(
+        directory=resources_path,
+        file_name=FILE_NAME,
+        records=[build_record(session=session, ticker="PETR3", price=price) for session in SESSIONS[:number_of_records]]
+    )
+
+
+def load(sink_path: str, batch_size: int, raw_file_mode: bool = False) -> FileSink:
+    """Load the annual file and return the sink it was loaded into."""
+    app.lambda_handler(event={
+        "batch_size": batch_size,
+        "raw_file_mode": raw_file_mode,
+        "sink": "files",
+        "sink_path": sink_path,
+        "files_to_run": [FILE_NAME],
+    })
+    return FileSink(schema="b3_history", path=sink_path)
+
+
+@pytest.mark.parametrize("raw_file_mode", [False, True])
+@pytest.mark.parametrize(
+    "batch_size, first_records",
+    [
+        (3, 12),  # last record ends a batch
+        (3, 11),  # trailer ends a batch
+        (7, 13),  # trailer ends a batch, within the last block
+        (4, 9),   # nothing aligned
+    ]
+)
+def test_appended_records_are_all_loaded(resources_path, sink_path, batch_size, first_records, raw_file_mode):
+    write_version(resources_path=resources_path, number_of_records=first_records)
+    sink = load(sink_path=sink_path, batch_size=batch_size, raw_file_mode=raw_file_mode)
+
+    fingerprints = sink.read_table("extraction_fingerprint")
+    assert fingerprints["is_final_block"].tolist() == [False] * (len(fingerprints) - 1) + [True]
+
+    write_version(resources_path=resources_path, number_of_records=len(SESSIONS))
+    sink = load(sink_path=sink_path, batch_size=batch_size, raw_file_mode=raw_file_mode)
+
+    assert sorted(sink.read_table("cotahist_a2023")["data_pregao"]) == SESSIONS
+    assert sink.read_table("extraction_fingerprint")["record_count"].sum() == len(SESSIONS)
+
+
+def test_checkpoints_without_final_flag_resume_after_last_record(resources_path, sink_path):
+    write_version(resources_path=resources_path, number_of_records=11)
+    sink = load(sink_path=sink_path, batch_size=3)
+
+    # Checkpoints stored before the final block was reliably flagged
+    fingerprints = sink.read_table("extraction_fingerprint")
+    fingerprints["is_final_block"] = False
+    sink.write_table(table_name="extraction_fingerprint", dataframe=fingerprints)
+
+    write_version(resources_path=resources_path, number_of_records=len(SESSIONS))
+    sink = load(sink_path=sink_path, batch_size=3)
+
+    assert sorted(sink.read_table("cotahist_a2023")["data_pregao"]) == SESSIONS
+
+
+def test_unchanged_file_is_not_loaded_again(resources_path, sink_path):
+    write_version(resources_path=resources_path, number_of_records=10)
+    load(sink_path=sink_path, batch_size=3)
+    sink = load(sink_path=sink_path, batch_size=3)
+
+    assert sorted(sink.read_table("cotahist_a2023")["data_pregao"]) == SESSIONS[:10]
+
+
+def test_changed_file_is_reloaded_entirely(resources_path, sink_path):
+    write_version(resources_path=resources_path, number_of_records=10)
+    load(sink_path=sink_path, batch_size=3)
+
+    write_version(resources_path=resources_path, number_of_records=15, price=999)
+    sink = load(sink_path=sink_path, batch_size=3)
+
+    table = sink.read_table("cotahist_a2023")
+    assert sorted(table["data_pregao"]) == SESSIONS[:15]
+    assert set(table["preco_ultimo_negocio"]) == {9.99}
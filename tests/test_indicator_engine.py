@@ -0,0 +1,82 @@
+"""Tests of the technical indicators materialized next to daily prices, which run inside postgres."""
+from datetime import date, timedelta
+
+import pytest
+
+from src.data_warehouse.modules.main_engine import DataWarehouseMainEngine
+
+SESSIONS = [date(2023, 1, 2) + timedelta(days=day) for day in range(6)]
+CLOSES = {"PETR3": [10, 11, 12, 11, 13, 14], "VALE3": [50, 49, 48, 50, 52, 51]}
+
+
+@pytest.fixture
+def engine(make_schema) -> DataWarehouseMainEngine:
+    """Create a Data Warehouse schema holding the daily prices of two tickers, and daily returns of both."""
+    engine = DataWarehouseMainEngine()
+    engine.data_warehouse_schema = make_schema()
+    engine.create_fact_table()
+    engine.postgres.execute_statement(statement=f"""
+        INSERT INTO {engine.data_warehouse_schema}.daily_prices (ticker, data_pregao, preco_ultimo_negocio)
+        VALUES {", ".join(
+            f"('{ticker}', '{session}', {close})"
+            for ticker, closes in CLOSES.items()
+            for session, close in zip(SESSIONS, closes)
+        )}
+    """)
+
+    engine.indicators = ["daily_return"]
+    engine.create_indicators_table()
+    engine.update_indicators(tickers=list(CLOSES))
+    return engine
+
+
+def read_indicators(engine: DataWarehouseMainEngine, ticker: str):
+    """Read materialized indicators of given ticker, ordered by session."""
+    return engine.postgres.read_sql_query(
+        query=f"""
+            SELECT * FROM {engine.data_warehouse_schema}.daily_indicators
+            WHERE ticker = %(ticker)s ORDER BY data_pregao
+        """,
+        params={"ticker": ticker}
+    )
+
+
+def test_added_indicator_is_backfilled_for_every_ticker(engine):
+    engine.indicators = ["daily_return", "sma_3"]
+    assert engine.create_indicators_table() == ["sma_3"]
+    assert engine.get_priced_tickers() == ["PETR3", "VALE3"]
+
+    engine.update_indicators(tickers=engine.get_priced_tickers())
+
+    for ticker, closes in CLOSES.items():
+        indicators = read_indicators(engine=engine, ticker=ticker)
+        assert indicators["sma_3"].tolist() == pytest.approx(
+            [float("nan")] * 2 + [sum(closes[end - 3:end]) / 3 for end in range(3, len(closes) + 1)],
+            nan_ok=True
+        )
+        assert indicators["daily_return"].tolist()[1:] == pytest.approx(
+            [close / previous - 1 for previous, close in zip(closes, closes[1:])]
+        )
+
+
+def test_ticker_left_out_of_a_backfill_catches_up_on_its_next_update(engine):
+    engine.indicators = ["daily_return", "sma_3"]
+    engine.create_indicators_table()
+    engine.update_indicators(tickers=["PETR3"])
+
+    assert read_indicators(engine=engine, ticker="VALE3")["sma_3"].isna().all()
+
+    engine.update_indicators(tickers=["VALE3"])
+    assert read_indicators(engine=engine, ticker="VALE3")["sma_3"].tolist()[2:] == pytest.approx([49, 49, 50, 51])
+
+
+def test_indicators_are_not_recomputed_once_complete(engine, monkeypatch):
+    engine.indicators = ["daily_return", "sma_3", "drawdown"]
+    engine.create_indicators_table()
+    engine.update_indicators(tickers=list(CLOSES))
+
+    def fail(**_):
+        raise AssertionError("Indicators were computed again.")
+
+    monkeypatch.setattr(engine, "compute_indicators", fail)
+    engine.update_indicators(tickers=list(CLOSES))
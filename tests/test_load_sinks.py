@@ -0,0 +1,182 @@
+"""Tests of the local sinks, which load B3 history without any database."""
+import os
+import sqlite3
+import tempfile
+import tracemalloc
+from datetime import date, timedelta
+
+import pandas as pd
+import pytest
+from psycopg2 import errors
+
+import src.b3_history.app as app
+from src.b3_history.modules.load_sinks import FileSink, build_sink
+from src.b3_history.modules.main_engine import DataLakeMainEngine
+from tests.helpers import build_record, write_cotahist
+
+SESSIONS = [date(2023, 1, 2) + timedelta(days=day) for day in range(5)]
+TICKERS = {"PETR3": "010", "VALE3": "010", "PETRA20": "070", "PETRM20": "080"}
+
+
+class RecordingEngine(DataLakeMainEngine):
+    """Engine keeping track of the last instance, so that tests can reach its sink."""
+
+    last_instance = None
+
+    def __init__(self):
+        """Initialize the constructor."""
+        super().__init__()
+        RecordingEngine.last_instance = self
+
+
+@pytest.fixture
+def annual_file(resources_path, monkeypatch) -> str:
+    """Write an annual file holding spot and option records of a few sessions."""
+    monkeypatch.setattr(app, "DataLakeMainEngine", RecordingEngine)
+    write_cotahist(
+        directory=resources_path,
+        file_name="COTAHIST_A2023.zip",
+        records=[
+            build_record(session=session, ticker=ticker, market_type=market_type)
+            for session in SESSIONS
+            for ticker, market_type in TICKERS.items()
+        ]
+    )
+    return "COTAHIST_A2023.zip"
+
+
+def load(files: list, sink: str, tmp_path, **options):
+    """Load files into given sink and return it."""
+    app.lambda_handler(event={
+        "batch_size": 7,
+        "sink": sink,
+        "sink_path": str(tmp_path / "sink"),
+        "files_to_run": files,
+        **options,
+    })
+    return RecordingEngine.last_instance.sink
+
+
+def normalize(dataframe):
+    """Sort rows and turn sessions into ISO text, which is how SQLite stores them."""
+    dataframe = dataframe.assign(data_pregao=dataframe["data_pregao"].astype(str))
+    return dataframe.sort_values(["data_pregao", "codigo_negociaco_papel"]).reset_index(drop=True)
+
+
+def test_options_are_loaded_apart_from_other_markets(annual_file, tmp_path):
+    sink = load(files=[annual_file], sink="memory", tmp_path=tmp_path)
+
+    spot = sink.read_table("cotahist_a2023")
+    options = sink.read_table("options_a2023")
+    assert set(spot["codigo_negociaco_papel"]) == {"PETR3", "VALE3"}
+    assert "preco_exercicio_opcoes" not in spot.columns
+    assert set(zip(options["underlying"], options["option_type"])) == {("PETR", "call"), ("PETR", "put")}
+    assert set(options["preco_exercicio_opcoes"]) == {20.0}
+
+
+@pytest.mark.parametrize("file_format", ["npy", "csv"])
+def test_file_sink_reads_back_what_memory_sink_holds(annual_file, tmp_path, file_format):
+    memory_sink = load(files=[annual_file], sink="memory", tmp_path=tmp_path)
+    load(files=[annual_file], sink="files", tmp_path=tmp_path, file_format=file_format)
+    file_sink = FileSink(schema="b3_history", path=str(tmp_path / "sink"), file_format=file_format)
+
+    for table_name in ["cotahist_a2023", "options_a2023"]:
+        expected = memory_sink.read_table(table_name)
+        loaded = file_sink.read_table(table_name)
+        assert loaded.dtypes.to_dict() == expected.dtypes.to_dict()
+        assert normalize(loaded).equals(normalize(expected))
+
+
+def test_spilled_batches_load_the_same_rows(annual_file, tmp_path, monkeypatch):
+    spill_directories = []
+
+    def make_spill_directory(**options) -> str:
+        """Create spill directories inside the test's directory, keeping track of them."""
+        spill_directories.append(make_directory(dir=tmp_path, **options))
+        return spill_directories[-1]
+
+    make_directory = tempfile.mkdtemp
+    monkeypatch.setattr(tempfile, "mkdtemp", make_spill_directory)
+    memory_sink = load(files=[annual_file], sink="memory", tmp_path=tmp_path)
+    spilled_sink = load(files=[annual_file], sink="memory", tmp_path=tmp_path, memory_budget_mb=0.001)
+    tracemalloc.stop()
+
+    assert spill_directories
+    assert not [directory for directory in spill_directories if os.path.exists(directory)]
+    for table_name in ["cotahist_a2023", "options_a2023"]:
+        pd.testing.assert_frame_equal(
+            normalize(spilled_sink.read_table(table_name)),
+            normalize(memory_sink.read_table(table_name))
+        )
+
+
+def test_sqlite_sink_builds_history_views(annual_file, tmp_path):
+    memory_sink = load(files=[annual_file], sink="memory", tmp_path=tmp_path)
+    load(files=[annual_file], sink="sqlite", tmp_path=tmp_path)
+
+    with sqlite3.connect(tmp_path / "sink" / "b3_history.sqlite") as connection:
+        stocks_history = pd.read_sql("SELECT * FROM stocks_history", connection)
+        options_history = pd.read_sql("SELECT * FROM options_history", connection)
+
+    expected = memory_sink.read_table("cotahist_a2023")
+    assert normalize(stocks_history)[list(expected.columns)].astype(str).equals(normalize(expected).astype(str))
+    assert len(options_history) == len(memory_sink.read_table("options_a2023"))
+
+
+def test_null_sink_counts_rows_and_keeps_checkpoints(annual_file, tmp_path):
+    sink = load(files=[annual_file], sink="null", tmp_path=tmp_path)
+
+    assert sink.row_counts["cotahist_a2023"] == 2 * len(SESSIONS)
+    assert sink.row_counts["options_a2023"] == 2 * len(SESSIONS)
+    assert sink.read_table("cotahist_a2023") is None
+    assert sink.get_last_line_read(file_name=annual_file) == len(SESSIONS) * len(TICKERS) + 1
+
+
+@pytest.mark.parametrize("sink_name", ["files", "sqlite"])
+def test_daily_file_replaces_its_session(annual_file, resources_path, tmp_path, sink_name):
+    write_cotahist(
+        directory=resources_path,
+        file_name="COTAHIST_D03012023.zip",
+        records=[build_record(session=SESSIONS[1], ticker="PETR3", price=999)]
+    )
+    load(files=[annual_file, "COTAHIST_D03012023.zip"], sink=sink_name, tmp_path=tmp_path)
+
+    if sink_name == "files":
+        spot = FileSink(schema="b3_history", path=str(tmp_path / "sink")).read_table("cotahist_a2023")
+    else:
+        with sqlite3.connect(tmp_path / "sink" / "b3_history.sqlite") as connection:
+            spot = pd.read_sql("SELECT * FROM cotahist_a2023", connection)
+
+    session_rows = spot[spot["data_pregao"].astype(str) == SESSIONS[1].isoformat()]
+    assert session_rows["preco_ultimo_negocio"].tolist() == [9.99]
+    assert len(spot) == 2 * len(SESSIONS) - 1
+
+
+def test_unknown_sink_is_refused():
+    with pytest.raises(ValueError):
+        build_sink(sink_name="parquet", schema="b3_history")
+
+
+@pytest.mark.parametrize("raw_file_mode", [False, True])
+def test_names_are_decoded_as_latin_1_in_both_modes(resources_path, tmp_path, monkeypatch, raw_file_mode):
+    monkeypatch.setattr(app, "DataLakeMainEngine", RecordingEngine)
+    write_cotahist(
+        directory=resources_path,
+        file_name="COTAHIST_A2023.zip",
+        records=[build_record(session=SESSIONS[0], ticker="SMTO3", name="SÃO MARTINHO")]
+    )
+    sink = load(files=["COTAHIST_A2023.zip"], sink="memory", tmp_path=tmp_path, raw_file_mode=raw_file_mode)
+
+    assert sink.read_table("cotahist_a2023")["nome_resumido"].tolist() == ["SÃO MARTINHO"]
+
+
+def test_app_reports_it_stopped_without_privileges(monkeypatch):
+    sink = build_sink(sink_name="null", schema="b3_history")
+
+    def refuse() -> None:
+        raise errors.InsufficientPrivilege()
+
+    monkeypatch.setattr(sink, "create_schema", refuse)
+    monkeypatch.setattr(app, "build_sink", lambda **_: sink)
+
+    assert app.lambda_handler(event={"sink": "null", "files_to_run": []}) is False
@@ -0,0 +1,142 @@
+"""Tests of PostgresConnector methods that do not need a running database."""
+from collections import namedtuple
+
+import sqlalchemy
+
+from src.shared import loading_engine
+from src.shared.loading_engine import PostgresConnector
+
+Column = namedtuple("Column", ["name"])
+
+
+class FakeCursor:
+    """Server-side cursor returning rows in the order they were given."""
+
+    def __init__(self, rows: list) -> None:
+        self.rows = list(rows)
+        self.description = [Column("ticker"), Column("close")]
+        self.itersize = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args) -> None:
+        pass
+
+    def execute(self, query, params) -> None:
+        pass
+
+    def fetchmany(self, size: int) -> list:
+        rows, self.rows = self.rows[:size], self.rows[size:]
+        return rows
+
+
+class FakeConnection:
+    """Connection that fails to stream once it is closed."""
+
+    def __init__(self, rows: list) -> None:
+        self.rows = rows
+        self.closed = False
+        self.cursors = []
+
+    def cursor(self, name: str = None) -> FakeCursor:
+        cursor = FakeCursor(rows=self.rows)
+        fetchmany = cursor.fetchmany
+
+        def fetch_while_open(size: int) -> list:
+            assert not self.closed, "connection closed while streaming"
+            return fetchmany(size)
+
+        cursor.fetchmany = fetch_while_open
+        self.cursors.append(cursor)
+        return cursor
+
+    def commit(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+
+def test_chunks_keep_streaming_while_connector_is_used(postgres_env, monkeypatch):
+    connections = []
+
+    def connect(**kwargs) -> FakeConnection:
+        connections.append(FakeConnection(rows=[("PETR3", float(day)) for day in range(5)]))
+        return connections[-1]
+
+    monkeypatch.setattr(loading_engine.psycopg2, "connect", connect)
+    connector = PostgresConnector(schema="data_lake")
+
+    chunks = []
+    for chunk in connector.read_sql_query_chunks(query="SELECT 1", params={}, chunk_size=2):
+        chunks.append(chunk)
+
+        # Loading a chunk, e.g. through bulk_upsert, opens and closes the connector's own connection
+        connector._connect_to_database()
+        connector.close_connections()
+
+    assert [len(chunk) for chunk in chunks] == [2, 2, 1]
+    assert sum(chunk["close"].sum() for chunk in chunks) == 10
+    assert all(connection.closed for connection in connections)
+
+
+def build_engine_like_psycopg2(database_url: str, create_engine):
+    """Create a SQLite engine whose driver, like psycopg2, opens a transaction before any statement."""
+    engine = create_engine(database_url)
+
+    @sqlalchemy.event.listens_for(engine, "connect")
+    def disable_driver_transactions(dbapi_connection, connection_record) -> None:
+        dbapi_connection.isolation_level = None
+
+    @sqlalchemy.event.listens_for(engine, "before_cursor_execute")
+    def begin_transaction(connection, cursor, statement, parameters, context, executemany) -> None:
+        if not cursor.connection.in_transaction:
+            cursor.execute("BEGIN")
+
+    return engine
+
+
+def test_statements_without_leading_keyword_are_committed(postgres_env, monkeypatch, tmp_path):
+    database_url = f"sqlite:///{tmp_path / 'database.sqlite'}"
+    create_engine = sqlalchemy.create_engine
+    # Connector's lazy module keeps the attributes it resolved, e.g. in earlier tests
+    monkeypatch.setattr(loading_engine, "sqlalchemy", sqlalchemy)
+    monkeypatch.setattr(
+        sqlalchemy,
+        "create_engine",
+        lambda url: build_engine_like_psycopg2(database_url=database_url, create_engine=create_engine)
+    )
+    connector = PostgresConnector(schema="main")
+
+    connector.execute_statement(statement="CREATE TABLE prices (close REAL)")
+    connector.execute_statement(statement="WITH new AS (SELECT 1.5 AS close) INSERT INTO prices SELECT close FROM new")
+
+    engine = create_engine(database_url)
+    with engine.connect() as connection:
+        assert connection.exec_driver_sql("SELECT close FROM prices").fetchall() == [(1.5,)]
+    engine.dispose()
+
+
+def test_autocommit_statements_run_outside_transactions(postgres_env, monkeypatch):
+    executed = []
+
+    class AutocommitConnection(FakeConnection):
+        autocommit = False
+
+        def set_session(self, autocommit: bool) -> None:
+            self.autocommit = autocommit
+
+        def cursor(self, name: str = None):
+            connection = self
+
+            class RecordingCursor(FakeCursor):
+                def execute(self, query, params=None) -> None:
+                    executed.append((query, connection.autocommit))
+
+            return RecordingCursor(rows=[])
+
+    monkeypatch.setattr(loading_engine.psycopg2, "connect", lambda **kwargs: AutocommitConnection(rows=[]))
+    PostgresConnector(schema="data_warehouse").execute_autocommit(statements=["CLUSTER a", "ANALYZE a"])
+
+    assert executed == [("CLUSTER a", True), ("ANALYZE a", True)]
@@ -0,0 +1,55 @@
+"""Tests of the memory budget of B3 history batches."""
+import tracemalloc
+
+import pytest
+
+from src.b3_history.modules.memory_engine import MemoryEngine
+
+
+class BudgetedEngine(MemoryEngine):
+    """Memory engine holding the state main engine gives it."""
+
+    def __init__(self, memory_budget_mb: float, batch_size: int) -> None:
+        """Initialize the constructor."""
+        self.stage_peaks = {}
+        self.batch_size = batch_size
+        self.memory_budget_mb = memory_budget_mb
+
+
+@pytest.fixture(autouse=True)
+def stop_tracing():
+    """Stop tracing allocations once each test is done, since the budget setter starts it."""
+    yield
+    tracemalloc.stop()
+
+
+def test_stage_peak_leaves_out_memory_held_before_the_stage():
+    engine = BudgetedEngine(memory_budget_mb=100, batch_size=4000)
+    batch = bytearray(40 * 2 ** 20)
+
+    with engine.track_memory(stage="load"):
+        buffer = bytearray(10 * 2 ** 20)
+        del buffer
+
+    assert 9.5 < engine.stage_peaks["load"] < 11
+    del batch
+
+
+def test_batch_size_is_halved_once_a_stage_peaks_above_the_budget():
+    engine = BudgetedEngine(memory_budget_mb=15, batch_size=4000)
+    batch = bytearray(10 * 2 ** 20)
+
+    # Each stage stays within the budget, although memory held across stages exceeds it
+    for stage in ["extract", "transform"]:
+        with engine.track_memory(stage=stage):
+            buffer = bytearray(10 * 2 ** 20)
+            del buffer
+    engine.adapt_batch_size()
+    assert engine.batch_size == 4000
+
+    with engine.track_memory(stage="load"):
+        buffer = bytearray(20 * 2 ** 20)
+        del buffer
+    engine.adapt_batch_size()
+    assert engine.batch_size == 2000
+    del batch
@@ -0,0 +1,113 @@
+"""Tests of the postgres sink on schemas loaded by former versions of B3 history app."""
+from datetime import date
+
+import pytest
+
+import src.b3_history.app as app
+from src.b3_history.modules.load_sinks import PostgresSink
+from src.shared.loading_engine import PostgresConnector
+from tests.helpers import build_record, write_cotahist
+
+
+@pytest.fixture
+def schema(resources_path, make_schema) -> str:
+    """Load a file of 2022 and another of 2023 into a new schema."""
+    for year in [2022, 2023]:
+        write_cotahist(
+            directory=resources_path,
+            file_name=f"COTAHIST_A{year}.zip",
+            records=[build_record(session=date(year, 1, 3), ticker=ticker) for ticker in ["PETR3", "VALE3"]]
+        )
+
+    schema = make_schema()
+    app.lambda_handler(event={"schema": schema, "files_to_run": ["COTAHIST_A2022.zip", "COTAHIST_A2023.zip"]})
+    return schema
+
+
+def read_sessions(schema: str, relation_name: str) -> list:
+    """Read the sessions of given relation, in order."""
+    sessions = PostgresConnector(schema=schema).read_sql_query(
+        query=f"SELECT data_pregao FROM {schema}.{relation_name} ORDER BY data_pregao",
+        params={}
+    )
+    return sessions["data_pregao"].tolist()
+
+
+def test_view_is_rebuilt_over_yearly_tables_lacking_new_columns(schema):
+    # Yearly tables loaded before volume was extracted lack its column
+    PostgresConnector(schema=schema).execute_statement(
+        statement=f"ALTER TABLE {schema}.cotahist_a2022 DROP COLUMN volume_total_titulos_negociados CASCADE"
+    )
+
+    app.lambda_handler(event={"schema": schema, "files_to_run": ["COTAHIST_A2023.zip"]})
+
+    sessions = read_sessions(schema=schema, relation_name="stocks_history")
+    assert sessions == [date(2022, 1, 3)] * 2 + [date(2023, 1, 3)] * 2
+
+
+def test_volume_kept_as_text_cents_is_parsed_before_views_are_rebuilt(schema):
+    # Yearly tables loaded before volume was parsed keep it as zero-padded text cents
+    PostgresConnector(schema=schema).execute_statement(statement=f"""
+        DROP MATERIALIZED VIEW {schema}.stocks_history;
+        ALTER TABLE {schema}.cotahist_a2022 ALTER COLUMN volume_total_titulos_negociados TYPE TEXT
+        USING lpad((volume_total_titulos_negociados * 100)::bigint::text, 18, '0');
+    """)
+
+    app.lambda_handler(event={"schema": schema, "files_to_run": ["COTAHIST_A2023.zip"]})
+
+    postgres = PostgresConnector(schema=schema)
+    volumes = postgres.read_sql_query(
+        query=f"SELECT volume_total_titulos_negociados FROM {schema}.stocks_history ORDER BY data_pregao",
+        params={}
+    )
+    assert postgres.get_column_types(table_name="cotahist_a2022")["volume_total_titulos_negociados"] == (
+        "double precision"
+    )
+    assert volumes["volume_total_titulos_negociados"].tolist() == [0.01] * 4
+
+
+def test_options_are_split_out_of_legacy_tables_lacking_new_columns(resources_path, make_schema):
+    write_cotahist(
+        directory=resources_path,
+        file_name="COTAHIST_A2023.zip",
+        records=[
+            build_record(session=date(2023, 1, 3), ticker="PETR3"),
+            build_record(session=date(2023, 1, 3), ticker="PETRA20", market_type="070"),
+        ]
+    )
+    schema = make_schema()
+    app.lambda_handler(event={"schema": schema, "files_to_run": ["COTAHIST_A2023.zip"]})
+
+    # Chains are read by underlying and session, so that a single range of the index is scanned
+    postgres = PostgresConnector(schema=schema)
+    chain_index = postgres.read_sql_query(
+        query="SELECT indexdef FROM pg_indexes WHERE schemaname = %(schema)s AND indexname = %(index_name)s",
+        params={"schema": schema, "index_name": "options_history_chain_idx"}
+    )
+    index_columns = "(underlying, data_pregao, data_vencimento_opcoes, preco_exercicio_opcoes)"
+    assert chain_index["indexdef"][0].endswith(index_columns)
+
+    # Yearly tables loaded before options were kept apart hold them, along with their columns, and may lack volume
+    spot_columns = ", ".join(postgres.get_table_columns(table_name="cotahist_a2023"))
+    option_columns = postgres.get_table_columns(table_name="options_a2023")
+    postgres.execute_statement(statement=f"""
+        DROP MATERIALIZED VIEW {schema}.stocks_history;
+        DROP MATERIALIZED VIEW {schema}.options_history;
+        ALTER TABLE {schema}.cotahist_a2023
+            ADD COLUMN preco_exercicio_opcoes DOUBLE PRECISION,
+            ADD COLUMN data_vencimento_opcoes DATE,
+            ADD COLUMN preco_exercicio_pontos_opcoes DOUBLE PRECISION;
+        INSERT INTO {schema}.cotahist_a2023 ({spot_columns}, data_vencimento_opcoes)
+        SELECT {spot_columns}, data_vencimento_opcoes FROM {schema}.options_a2023;
+        TRUNCATE {schema}.options_a2023;
+        ALTER TABLE {schema}.cotahist_a2023 DROP COLUMN volume_total_titulos_negociados;
+    """)
+
+    PostgresSink(schema=schema).split_legacy_options(option_columns=option_columns)
+
+    options = postgres.read_sql_query(
+        query=f"SELECT codigo_negociaco_papel, option_type FROM {schema}.options_a2023",
+        params={}
+    )
+    assert options.values.tolist() == [["PETRA20", "call"]]
+    assert read_sessions(schema=schema, relation_name="cotahist_a2023") == [date(2023, 1, 3)]
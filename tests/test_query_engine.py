@@ -0,0 +1,77 @@
+"""Tests of the read API over Data Lake, whose prices may be stored as integer cents."""
+import subprocess
+import sys
+from datetime import date
+
+import pytest
+
+import src.b3_history.app as app
+from src.shared.column_definitions import select_price
+from src.shared.query_engine import HistoryQueryEngine
+from tests.helpers import build_record, write_cotahist
+
+SESSION = date(2023, 1, 2)
+
+
+def test_only_prices_are_converted_from_cents():
+    assert select_price("h", "preco_ultimo_negocio", "bigint") == "h.preco_ultimo_negocio::double precision / 100"
+    assert select_price("h", "preco_ultimo_negocio", "double precision") == "h.preco_ultimo_negocio"
+    assert select_price("h", "numero_negocios_efetuados", "bigint") == "h.numero_negocios_efetuados"
+    assert select_price("h", "volume_total_titulos_negociados", "bigint") == (
+        "h.volume_total_titulos_negociados::double precision / 100"
+    )
+
+
+@pytest.fixture
+def data_lake_schemas(resources_path, make_schema) -> dict:
+    """Load the same file into a schema storing prices as floats, and another one storing them as cents."""
+    write_cotahist(
+        directory=resources_path,
+        file_name="COTAHIST_A2023.zip",
+        records=[
+            build_record(session=SESSION, ticker="PETR3", price=3407, volume=123456),
+            build_record(session=SESSION, ticker="PETRA20", market_type="070", price=123),
+        ]
+    )
+
+    schemas = {}
+    for price_cents in [False, True]:
+        schemas[price_cents] = make_schema()
+        app.lambda_handler(event={
+            "schema": schemas[price_cents],
+            "price_cents": price_cents,
+            "files_to_run": ["COTAHIST_A2023.zip"],
+        })
+    return schemas
+
+
+def test_prices_stored_as_cents_read_back_in_reais(data_lake_schemas):
+    histories, chains = {}, {}
+    for price_cents, schema in data_lake_schemas.items():
+        query_engine = HistoryQueryEngine(data_lake_schema=schema, memory_cache_mb=0)
+        histories[price_cents] = query_engine.get_history(tickers=["PETR3"])
+        chains[price_cents] = query_engine.get_option_chain(underlying="PETR", session=SESSION)
+
+    for price_cents in [False, True]:
+        assert histories[price_cents]["preco_ultimo_negocio"].tolist() == [34.07]
+        assert histories[price_cents]["numero_negocios_efetuados"].tolist() == [10]
+        assert chains[price_cents]["strike"].tolist() == [20.0]
+        assert chains[price_cents]["preco_ultimo_negocio"].tolist() == [1.23]
+
+
+def test_snapshot_volume_read_back_in_reais(data_lake_schemas):
+    for schema in data_lake_schemas.values():
+        query_engine = HistoryQueryEngine(data_lake_schema=schema, memory_cache_mb=0)
+        snapshot = query_engine.get_snapshot(session=SESSION)
+
+        assert snapshot["volume_total_titulos_negociados"].dtype == "float64"
+        assert snapshot["volume_total_titulos_negociados"].tolist() == [1234.56]
+
+
+def test_shared_modules_do_not_import_the_apps():
+    imported_modules = subprocess.run(
+        [sys.executable, "-c", "import sys, src.shared.query_engine; print(' '.join(sys.modules))"],
+        capture_output=True, text=True, check=True
+    ).stdout.split()
+
+    assert not [module for module in imported_modules if module.startswith(("src.b3_history", "src.data_warehouse"))]
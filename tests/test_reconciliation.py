@@ -0,0 +1,57 @@
+"""Tests of the reconciliation of Data Warehouse prices with Yahoo Finance, which run inside postgres."""
+from datetime import date
+
+import pytest
+
+from src.data_visualization import reconciliation
+from src.shared.loading_engine import PostgresConnector
+
+
+@pytest.fixture
+def schemas(make_schema) -> dict:
+    """Create a Data Warehouse schema with PETR3's prices, and a Yahoo Finance schema holding a session twice."""
+    data_warehouse_schema, yahoo_schema = make_schema(), make_schema()
+    postgres = PostgresConnector()
+    postgres.execute_statement(statement=f"""
+        CREATE TABLE {data_warehouse_schema}.daily_prices (
+            ticker TEXT, data_pregao DATE, preco_abertura_pregao DOUBLE PRECISION,
+            preco_maximo_pregao DOUBLE PRECISION, preco_minimo_pregao DOUBLE PRECISION,
+            preco_ultimo_negocio DOUBLE PRECISION
+        );
+        INSERT INTO {data_warehouse_schema}.daily_prices VALUES
+            ('PETR3', '2023-01-02', 10, 11, 9, 10),
+            ('PETR3', '2023-01-03', 10, 11, 9, 10),
+            ('PETR3', '2023-01-04', 10, 11, 9, 10);
+
+        CREATE TABLE {yahoo_schema}.petr3_sa (
+            date DATE, open DOUBLE PRECISION, close DOUBLE PRECISION, high DOUBLE PRECISION,
+            low DOUBLE PRECISION, volume BIGINT
+        );
+        INSERT INTO {yahoo_schema}.petr3_sa VALUES
+            ('2023-01-02', 10, 10, 11, 9, 1),
+            ('2023-01-02', 10, 10, 11, 9, 1),
+            ('2023-01-04', 10, 11, 11, 9, 1);
+    """)
+    return {"data_warehouse_schema": data_warehouse_schema, "yahoo_schema": yahoo_schema}
+
+
+def read_reconciliation(data_warehouse_schema: str):
+    """Read reconciled sessions, ordered by session."""
+    return PostgresConnector().read_sql_query(
+        query=f"""
+            SELECT data_pregao, status, close_divergence
+            FROM {data_warehouse_schema}.{reconciliation.RECONCILIATION_TABLE}
+            ORDER BY data_pregao
+        """,
+        params={}
+    )
+
+
+def test_sessions_are_reconciled_once_despite_repeated_yahoo_rows(schemas):
+    reconciliation.lambda_handler(event=schemas)
+    reconciliation.lambda_handler(event=schemas)
+
+    reconciled = read_reconciliation(data_warehouse_schema=schemas["data_warehouse_schema"])
+    assert reconciled["data_pregao"].tolist() == [date(2023, 1, 2), date(2023, 1, 3), date(2023, 1, 4)]
+    assert reconciled["status"].tolist() == ["matched", "missing_in_yahoo", "matched"]
+    assert reconciled["close_divergence"].tolist() == pytest.approx([0.0, float("nan"), 0.1], nan_ok=True)
@@ -0,0 +1,31 @@
+"""Tests of the Yahoo Finance app, which downloads each ticker's whole history again every day."""
+import pandas as pd
+
+from src.data_visualization import yahoo_finance
+from src.shared.loading_engine import PostgresConnector
+
+
+def download(sessions: int):
+    """Build a download shaped like yfinance's, with one row per session."""
+    def download_ticker_information(stock: str) -> pd.DataFrame:
+        dates = pd.date_range("2023-01-02", periods=sessions, freq="B", name="Date")
+        return pd.DataFrame(
+            {"Open": 10.0, "High": 11.0, "Low": 9.0, "Close": 10.5, "Adj Close": 10.5, "Volume": 100},
+            index=dates
+        )
+    return download_ticker_information
+
+
+def test_daily_downloads_do_not_duplicate_sessions(make_schema, monkeypatch):
+    schema = make_schema()
+    monkeypatch.setattr(yahoo_finance, "PostgresConnector", lambda **_: PostgresConnector(schema=schema))
+
+    for sessions in [3, 3, 4]:
+        monkeypatch.setattr(yahoo_finance, "_download_ticker_information", download(sessions=sessions))
+        yahoo_finance.lambda_handler(event={"stocks": ["PETR3.SA"]})
+
+    history = PostgresConnector(schema).read_sql_query(
+        query=f"SELECT date, close FROM {schema}.petr3_sa ORDER BY date",
+        params={}
+    )
+    assert history["date"].astype(str).tolist() == ["2023-01-02", "2023-01-03", "2023-01-04", "2023-01-05"]